@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'portfolio.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,9 +79,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Conexiones persistentes (se revisan antes de reutilizarlas) y espera
+        # de hasta 20 s por el lock de escritura en vez de fallar de inmediato
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# PRAGMAs aplicados a cada conexión SQLite (ver portfolio/perfil_bd.py); None
+# los desactiva. Solo duran lo que la conexión: no modifican el archivo.
+PORTFOLIO_SQLITE_PRAGMAS = {
+    'cache_size': -65536,  # en KiB: 64 MiB por conexión
+    'mmap_size': 268435456,  # 256 MiB
+    'temp_store': 'MEMORY',
+}
+
+# journal_mode=WAL (con synchronous=NORMAL, seguro en ese modo: solo arriesga la
+# última transacción ante un corte de energía) deja que las lecturas sigan
+# mientras el ETL escribe, pero queda escrito en el archivo de la BD. Apagado por
+# defecto para que cualquier comando deje intacta la db.sqlite3 versionada;
+# activarlo en el settings del servidor que corre la API y el ETL.
+PORTFOLIO_SQLITE_WAL = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -127,4 +148,43 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ]
+}
+
+# Métricas por vista (/metrics) y línea de log estructurada por solicitud
+PORTFOLIO_METRICAS = False
+PORTFOLIO_METRICAS_LOG = False
+
+# Matriz de precios en disco (mmap); sin valor va junto a la BD SQLite (db.sqlite3.precios/)
+PORTFOLIO_MATRIZ_DIR = None
+
+# Series, pivotes de pesos e índices de cantidades calculados (ver portfolio/cache.py).
+# Cualquier backend de Django sirve; para compartirlo entre procesos use
+# FileBasedCache o Redis (django.core.cache.backends.redis.RedisCache).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'portfolio': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'portfolio',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 256},
+    },
+}
+PORTFOLIO_CACHE = 'portfolio'
+
+# GET condicional (ETag/304): segundos que se reutilizan las versiones de los
+# portafolios sin consultar la BD, y max-age del Cache-Control de las lecturas
+PORTFOLIO_VERSIONES_SEGUNDOS = 2
+PORTFOLIO_HTTP_MAX_AGE = 0
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'portfolio.metricas': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
 }
\ No newline at end of file
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     Activo, Portafolio, Precio, PesoPortafolio, 
-    CantidadActivo, ValorPortafolio, PesoActivo, Transaccion
+    CantidadActivo, ValorPortafolio, PesoActivo, Transaccion, CargaEtl
 )
 
 @admin.register(Activo)
@@ -18,6 +18,7 @@ class PortafolioAdmin(admin.ModelAdmin):
 class PrecioAdmin(admin.ModelAdmin):
     list_display = ('activo', 'fecha', 'precio')
     list_filter = ('fecha', 'activo')
+    ordering = ('fecha',)
     search_fields = ('activo__codigo', 'activo__nombre')
 
 @admin.register(PesoPortafolio)
@@ -29,20 +30,28 @@ class PesoPortafolioAdmin(admin.ModelAdmin):
 class CantidadActivoAdmin(admin.ModelAdmin):
     list_display = ('portafolio', 'activo', 'fecha', 'cantidad')
     list_filter = ('fecha', 'portafolio', 'activo')
+    ordering = ('fecha',)
     search_fields = ('portafolio__nombre', 'activo__codigo')
 
 @admin.register(ValorPortafolio)
 class ValorPortafolioAdmin(admin.ModelAdmin):
     list_display = ('portafolio', 'fecha', 'valor_total')
     list_filter = ('fecha', 'portafolio')
+    ordering = ('fecha',)
 
 @admin.register(PesoActivo)
 class PesoActivoAdmin(admin.ModelAdmin):
     list_display = ('portafolio', 'activo', 'fecha', 'peso', 'valor_activo')
     list_filter = ('fecha', 'portafolio', 'activo')
+    ordering = ('fecha',)
 
 @admin.register(Transaccion)
 class TransaccionAdmin(admin.ModelAdmin):
     list_display = ('portafolio', 'activo', 'fecha', 'tipo', 'monto', 'cantidad')
     list_filter = ('fecha', 'tipo', 'portafolio')
-    search_fields = ('portafolio__nombre', 'activo__codigo')
\ No newline at end of file
+    search_fields = ('portafolio__nombre', 'activo__codigo')
+
+@admin.register(CargaEtl)
+class CargaEtlAdmin(admin.ModelAdmin):
+    list_display = ('origen', 'huella', 'ultima_fecha', 'completada', 'actualizada')
+    list_filter = ('completada',)
\ No newline at end of file
@@ -0,0 +1,270 @@
+import contextlib
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Sum
+
+from .models import Activo, Precio, VersionPrecios
+
+# Almacén en disco de la matriz fecha x activo de precios. Cada reconstrucción
+# se escribe en un subdirectorio nuevo y `actual.json` (reemplazado de forma
+# atómica) apunta a la versión vigente:
+#   v<ns>/precios.npy   float64 fechas x activos, NaN sin precio (se abre con mmap)
+#   v<ns>/fechas.npy    datetime64[D] ordenadas
+#   v<ns>/activos.json  ids y códigos de las columnas, en orden de id
+# El puntero guarda además la firma de Precio con la que se construyó.
+
+PUNTERO = 'actual.json'
+BLOQUEO = 'reconstruir.lock'
+
+
+# Matriz densa fecha x activo de precios (NaN donde no hay precio) leída de la BD
+def matriz_desde_bd(fecha_desde=None, fecha_hasta=None, activo_ids=None):
+    qs = Precio.objects.all()
+    if fecha_desde is not None:
+        qs = qs.filter(fecha__gte=fecha_desde)
+    if fecha_hasta is not None:
+        qs = qs.filter(fecha__lte=fecha_hasta)
+    if activo_ids is not None:
+        qs = qs.filter(activo_id__in=list(activo_ids))
+
+    filas = list(qs.values_list('fecha', 'activo_id', 'precio'))
+    if not filas:
+        return [], [], np.empty((0, 0))
+
+    df = pd.DataFrame(filas, columns=['fecha', 'activo_id', 'precio'])
+    df['precio'] = df['precio'].astype(float)
+    tabla = df.pivot(index='fecha', columns='activo_id', values='precio').sort_index()
+    return list(tabla.index), [int(a) for a in tabla.columns], tabla.to_numpy(dtype=float)
+
+
+# Firma del contenido de Precio (una consulta): la versión que sube el ORM con
+# cada escritura (models.PrecioQuerySet y las señales de apps.py), así que cubre
+# también los update() masivos que no cambian filas ni fechas
+def firma_precios():
+    return ['version', VersionPrecios.objects.filter(id=1).values_list('version', flat=True).first() or 0]
+
+
+# Directorio del almacén: PORTFOLIO_MATRIZ_DIR o, con SQLite en archivo, junto a
+# la BD. Sin directorio (p. ej. BD en memoria de los tests) se lee siempre de la BD.
+def directorio_almacen():
+    directorio = getattr(settings, 'PORTFOLIO_MATRIZ_DIR', None)
+    if directorio:
+        return Path(directorio)
+    if connection.vendor == 'sqlite' and not connection.is_in_memory_db():
+        return Path(f"{connection.settings_dict['NAME']}.precios")
+    return None
+
+
+class AlmacenPrecios:
+    def __init__(self, directorio, puntero):
+        version = directorio / puntero['version']
+        self.firma = puntero['firma']
+        self.suma = puntero['suma']
+        self.celdas = puntero['celdas']
+        self.precios = np.load(version / 'precios.npy', mmap_mode='r')
+        self.fechas = np.load(version / 'fechas.npy')
+        with open(version / 'activos.json', encoding='utf-8') as f:
+            activos = json.load(f)
+        self.activo_ids = np.array(activos['ids'], dtype=np.int64)
+        self.codigos = activos['codigos']
+
+    # Mismo resultado que matriz_desde_bd con los mismos filtros: solo fechas y
+    # activos con al menos un precio dentro del recorte.
+    def recortar(self, fecha_desde=None, fecha_hasta=None, activo_ids=None):
+        i = 0 if fecha_desde is None else int(np.searchsorted(self.fechas, np.datetime64(fecha_desde, 'D'), 'left'))
+        j = len(self.fechas) if fecha_hasta is None else int(
+            np.searchsorted(self.fechas, np.datetime64(fecha_hasta, 'D'), 'right'))
+        if activo_ids is None:
+            columnas = slice(None)
+            ids = self.activo_ids
+        else:
+            columnas = np.nonzero(np.isin(self.activo_ids, list(activo_ids)))[0]
+            ids = self.activo_ids[columnas]
+        matriz = self.precios[i:j, columnas]
+        con_precio = ~np.isnan(matriz)
+        filas = con_precio.any(axis=1)
+        cols = con_precio.any(axis=0)
+        if not filas.any():
+            return [], [], np.empty((0, 0))
+        if not (filas.all() and cols.all()):
+            matriz = matriz[filas][:, cols]
+        return self.fechas[i:j][filas].tolist(), [int(a) for a in ids[cols]], np.asarray(matriz)
+
+
+_abierto = None
+_lock = threading.Lock()
+
+
+def _leer_puntero(directorio):
+    try:
+        with open(directorio / PUNTERO, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _version_ns(nombre):
+    return int(nombre[1:]) if nombre.startswith('v') and nombre[1:].isdigit() else None
+
+
+# Bloqueo exclusivo entre procesos (y entre hilos: cada uno abre su propio
+# descriptor) sobre un archivo del directorio del almacén
+@contextlib.contextmanager
+def _bloqueo(directorio):
+    with open(directorio / BLOQUEO, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK se rinde tras ~10 s; se sigue esperando
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Matriz completa y códigos de sus columnas para una reconstrucción
+def _leer_matriz():
+    fechas, activo_ids, matriz = matriz_desde_bd()
+    codigos = dict(Activo.objects.filter(id__in=activo_ids).values_list('id', 'codigo'))
+    return fechas, activo_ids, matriz, [codigos[a] for a in activo_ids]
+
+
+def _publicar(directorio, puntero):
+    global _abierto
+    almacen = AlmacenPrecios(directorio, puntero)
+    with _lock:
+        _abierto = (directorio, puntero['version'], almacen)
+    return almacen
+
+
+# Reconstruye el almacén desde Precio y lo publica reemplazando el puntero. Lo
+# llaman el ETL y verificar_almacen, no las lecturas. Las reconstrucciones se
+# serializan con un archivo de bloqueo; si al obtenerlo otra ya publicó la
+# firma vigente, se usa esa.
+def reconstruir_almacen():
+    directorio = directorio_almacen()
+    if directorio is None:
+        return None
+    directorio.mkdir(parents=True, exist_ok=True)
+    with _bloqueo(directorio):
+        anterior = _leer_puntero(directorio)
+        # La firma se lee antes que la matriz: si Precio cambia entre ambas, la
+        # firma queda vieja y la próxima verificación reconstruye
+        firma = firma_precios()
+        if anterior is not None and anterior.get('firma') == firma:
+            try:
+                return _publicar(directorio, anterior)
+            except (OSError, ValueError, KeyError):
+                pass
+        fechas, activo_ids, matriz, codigos = _leer_matriz()
+
+        nombre = f'v{time.time_ns()}'
+        version = directorio / nombre
+        version.mkdir()
+        np.save(version / 'precios.npy', np.ascontiguousarray(matriz, dtype=np.float64))
+        np.save(version / 'fechas.npy', np.array(fechas, dtype='datetime64[D]'))
+        with open(version / 'activos.json', 'w', encoding='utf-8') as f:
+            json.dump({'ids': activo_ids, 'codigos': codigos}, f)
+
+        puntero = {
+            'version': nombre, 'firma': firma,
+            'celdas': int((~np.isnan(matriz)).sum()), 'suma': float(np.nansum(matriz)),
+        }
+        temporal = directorio / f'{PUNTERO}.{nombre}'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(puntero, f)
+        os.replace(temporal, directorio / PUNTERO)
+
+        # Se conserva la versión anterior, que un lector puede haber leído del
+        # puntero y estar por mapear; las más viejas se borran (los procesos que
+        # las tengan abiertas con mmap conservan sus páginas hasta cerrarlas).
+        limite = _version_ns(str(anterior.get('version'))) if anterior is not None else None
+        if limite is not None:
+            for viejo in directorio.glob('v*'):
+                ns = _version_ns(viejo.name)
+                if viejo.is_dir() and ns is not None and ns < limite:
+                    shutil.rmtree(viejo, ignore_errors=True)
+
+        return _publicar(directorio, puntero)
+
+
+# Almacén vigente mapeado en memoria, o None si no hay directorio configurado,
+# no hay almacén o no se puede mapear. Con `verificar` también devuelve None si
+# su firma no coincide con Precio. Nunca reconstruye: las lecturas caen a la BD.
+def abrir_almacen(verificar=True):
+    global _abierto
+    directorio = directorio_almacen()
+    if directorio is None:
+        return None
+    puntero = _leer_puntero(directorio)
+    if puntero is None:
+        return None
+    with _lock:
+        abierto = _abierto
+    if abierto is not None and abierto[0] == directorio and abierto[1] == puntero.get('version'):
+        almacen = abierto[2]
+    else:
+        try:
+            almacen = AlmacenPrecios(directorio, puntero)
+        except (OSError, ValueError, KeyError):
+            return None
+        with _lock:
+            _abierto = (directorio, puntero['version'], almacen)
+    if verificar and almacen.firma != firma_precios():
+        return None
+    return almacen
+
+
+# Mapea el almacén vigente al arrancar (AppConfig.ready) sin consultar la BD, que
+# Django desaconseja durante la inicialización: la primera matriz_precios solo
+# compara la firma y no paga la apertura.
+def precargar_almacen():
+    try:
+        return abrir_almacen(verificar=False)
+    except OSError:
+        return None
+
+
+# Chequeo completo contra Precio: número de precios y suma de todos ellos. Con
+# `reconstruir`, si no coincide se reconstruye y se vuelve a comprobar.
+def verificar_almacen(reconstruir=False):
+    almacen = abrir_almacen(verificar=False)
+    consistente = False
+    if almacen is not None:
+        bd = Precio.objects.order_by().aggregate(celdas=Count('id'), suma=Sum('precio'))
+        suma_bd = float(bd['suma'] or 0)
+        consistente = (
+            almacen.firma == firma_precios()
+            and almacen.celdas == bd['celdas']
+            and abs(almacen.suma - suma_bd) <= 1e-9 * max(1.0, abs(suma_bd))
+        )
+    if not consistente and reconstruir and reconstruir_almacen() is not None:
+        return verificar_almacen()
+    return consistente
+
+
+def matriz_precios(fecha_desde=None, fecha_hasta=None, activo_ids=None):
+    almacen = abrir_almacen()
+    if almacen is None:
+        return matriz_desde_bd(fecha_desde, fecha_hasta, activo_ids)
+    return almacen.recortar(fecha_desde, fecha_hasta, activo_ids)
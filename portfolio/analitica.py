@@ -0,0 +1,128 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .almacen import firma_precios, matriz_precios
+from .cache import obtener
+from .models import Activo
+from .series import obtener_serie
+from .valuacion import seleccionar_columnas
+
+DIAS_ANIO = 252
+
+
+def _lista(arreglo, decimales=8):
+    # NaN -> None para JSON
+    return [None if np.isnan(x) else x for x in np.round(arreglo, decimales).tolist()]
+
+
+def _numero(x, decimales=8):
+    return None if x is None or not np.isfinite(x) else round(float(x), decimales)
+
+
+def retornos(valores):
+    return valores[1:] / valores[:-1] - 1 if len(valores) > 1 else np.empty(0)
+
+
+# Sharpe anualizado sobre ventanas móviles de `ventana` retornos; NaN mientras
+# no hay ventana completa o la volatilidad es cero
+def sharpe_movil(r, ventana, tasa_diaria=0.0):
+    salida = np.full(len(r), np.nan)
+    if len(r) < ventana or ventana < 2:
+        return salida
+    ventanas = sliding_window_view(r - tasa_diaria, ventana)
+    desv = ventanas.std(axis=1, ddof=1)
+    medias = ventanas.mean(axis=1)
+    np.divide(medias * np.sqrt(DIAS_ANIO), desv, out=salida[ventana - 1:], where=desv > 0)
+    return salida
+
+
+# Máxima caída desde un pico: (caída, índice del pico, índice del valle)
+def max_drawdown(valores):
+    if len(valores) == 0:
+        return None, None, None
+    picos = np.maximum.accumulate(valores)
+    caidas = valores / picos - 1
+    valle = int(caidas.argmin())
+    pico = int(valores[:valle + 1].argmax())
+    return float(caidas[valle]), pico, valle
+
+
+def beta(r, r_ref):
+    if len(r) < 2 or np.var(r_ref, ddof=1) == 0:
+        return None, None
+    cov = np.cov(r, r_ref, ddof=1)
+    return cov[0, 1] / cov[1, 1], cov[0, 1] / np.sqrt(cov[0, 0] * cov[1, 1])
+
+
+# Contribución de cada activo al retorno: Σ_t w_i,t-1 * r_i,t, con r_i,t el
+# retorno del precio. Las fechas deben tener pesos y precios para todo el rango.
+def contribuciones(fechas_pesos, codigos, pesos, fecha_inicio, fecha_fin):
+    if len(fechas_pesos) < 2 or not codigos:
+        return {}
+    ids = dict(Activo.objects.filter(codigo__in=codigos).values_list('codigo', 'id'))
+    activo_ids = [ids[c] for c in codigos]
+    fechas_p, ids_matriz, matriz = matriz_precios(fecha_inicio, fecha_fin, activo_ids)
+    fechas_p = np.array(fechas_p, dtype='datetime64[D]')
+    filas = np.searchsorted(fechas_p, fechas_pesos)
+    presentes = (filas < len(fechas_p)) & (fechas_p[np.minimum(filas, len(fechas_p) - 1)] == fechas_pesos)
+    precios = np.full((len(fechas_pesos), len(codigos)), np.nan)
+    precios[presentes] = seleccionar_columnas(matriz, ids_matriz, activo_ids)[filas[presentes]]
+    r_activos = precios[1:] / precios[:-1] - 1
+    aporte = np.nan_to_num(pesos[:-1] * r_activos)
+    return dict(zip(codigos, aporte.sum(axis=0).tolist()))
+
+
+def calcular(portafolio, fecha_inicio, fecha_fin, ventana=63, tasa_libre=0.0, referencia=None):
+    serie = obtener_serie(portafolio)
+    fechas, valores = serie.linea(fecha_inicio, fecha_fin)
+    r = retornos(valores)
+    tasa_diaria = (1 + tasa_libre) ** (1 / DIAS_ANIO) - 1
+    vol = float(np.std(r, ddof=1)) if len(r) > 1 else None
+    caida, pico, valle = max_drawdown(valores)
+
+    resultado = {
+        'portafolio': portafolio.nombre,
+        'fechas': [str(f) for f in fechas[1:].tolist()],
+        'retornos': _lista(r),
+        'retorno_total': _numero(valores[-1] / valores[0] - 1) if len(valores) else None,
+        'volatilidad': {
+            'diaria': _numero(vol),
+            'anual': _numero(vol * np.sqrt(DIAS_ANIO)) if vol is not None else None,
+        },
+        'sharpe_movil': {'ventana': ventana, 'valores': _lista(sharpe_movil(r, ventana, tasa_diaria), 6)},
+        'max_drawdown': {
+            'valor': _numero(caida),
+            'pico': str(fechas[pico]) if pico is not None else None,
+            'valle': str(fechas[valle]) if valle is not None else None,
+        },
+        'beta': None,
+    }
+
+    if referencia is not None:
+        fechas_ref, valores_ref = obtener_serie(referencia).linea(fecha_inicio, fecha_fin)
+        comunes, i, j = np.intersect1d(fechas, fechas_ref, return_indices=True)
+        b, correlacion = beta(retornos(valores[i]), retornos(valores_ref[j]))
+        resultado['beta'] = {
+            'referencia': referencia.nombre, 'valor': _numero(b),
+            'correlacion': _numero(correlacion), 'fechas_comunes': len(comunes),
+        }
+
+    fechas_pesos, codigos, pesos = serie.pesos_rango(fecha_inicio, fecha_fin)
+    aportes = contribuciones(fechas_pesos, codigos, pesos, fecha_inicio, fecha_fin)
+    resultado['contribuciones'] = [
+        {'activo': c, 'contribucion': _numero(aportes[c])} for c in sorted(aportes)
+    ]
+    return resultado
+
+
+# Resultado en caché por portafolio, rango, parámetros y versión de datos (la
+# clave se versiona con version_datos del portafolio; la del de referencia y la
+# firma de Precio, que las contribuciones leen en vivo, van en la clave)
+def analitica(portafolio, fecha_inicio, fecha_fin, ventana=63, tasa_libre=0.0, referencia=None):
+    return obtener(
+        'analitica', portafolio,
+        lambda: calcular(portafolio, fecha_inicio, fecha_fin, ventana, tasa_libre, referencia),
+        fecha_inicio, fecha_fin, ventana, tasa_libre,
+        f'{referencia.id}v{referencia.version_datos}' if referencia is not None else '-',
+        'p' + '-'.join(str(x) for x in firma_precios()),
+    )
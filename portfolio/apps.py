@@ -4,3 +4,50 @@ from django.apps import AppConfig
 class PortfolioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'portfolio'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from .almacen import precargar_almacen
+        from .condicional import olvidar_versiones
+        from .models import CantidadActivo, PesoActivo, Portafolio, Precio, ValorPortafolio, subir_version_precios
+        from .metricas import instalar_medidor
+        from .perfil_bd import aplicar_pragmas
+        from .series import marcar_cambio
+
+        connection_created.connect(aplicar_pragmas, dispatch_uid='portfolio_pragmas_sqlite')
+        connection_created.connect(instalar_medidor, dispatch_uid='portfolio_medidor_consultas')
+
+        precargar_almacen()
+
+        # Escrituras de una instancia de Precio (admin, shell); las masivas suben la
+        # versión en PrecioQuerySet. Las lecturas con otra firma van a la BD hasta
+        # que el ETL o verificar_almacen reconstruyan el almacén.
+        def _precio_cambiado(sender, raw=False, **kwargs):
+            if not raw:
+                subir_version_precios()
+
+        post_save.connect(_precio_cambiado, sender=Precio, weak=False, dispatch_uid='portfolio_version_precios_save')
+        post_delete.connect(_precio_cambiado, sender=Precio, weak=False, dispatch_uid='portfolio_version_precios_delete')
+
+        # Editar un portafolio cambia sus respuestas: sube version_datos (update() no
+        # vuelve a emitir post_save) y los ETags se recalculan
+        def _portafolio_guardado(sender, instance, raw=False, **kwargs):
+            if not raw:
+                marcar_cambio([instance.id])
+
+        def _portafolio_borrado(sender, **kwargs):
+            olvidar_versiones()
+
+        post_save.connect(_portafolio_guardado, sender=Portafolio, weak=False, dispatch_uid='portfolio_version_save')
+        post_delete.connect(_portafolio_borrado, sender=Portafolio, weak=False, dispatch_uid='portfolio_version_delete')
+
+        # Ediciones sueltas (admin, shell) de filas cacheadas; las masivas llaman a marcar_cambio
+        def _fila_cambiada(sender, instance, raw=False, **kwargs):
+            if not raw:
+                marcar_cambio([instance.portafolio_id])
+
+        for modelo in (CantidadActivo, PesoActivo, ValorPortafolio):
+            uid = f'portfolio_version_{modelo._meta.model_name}'
+            post_save.connect(_fila_cambiada, sender=modelo, weak=False, dispatch_uid=f'{uid}_save')
+            post_delete.connect(_fila_cambiada, sender=modelo, weak=False, dispatch_uid=f'{uid}_delete')
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+# Artefactos calculados por portafolio (series, pivote de pesos, índice de
+# cantidades) en el cache de Django PORTFOLIO_CACHE. La versión de cada clave es
+# el version_datos del portafolio: toda escritura la sube (series.marcar_cambio),
+# así que las entradas viejas dejan de leerse en todos los procesos que compartan
+# el backend y el límite de entradas (MAX_ENTRIES, LRU en locmem) las descarta.
+_AUSENTE = object()
+
+
+def cache_portafolio():
+    alias = getattr(settings, 'PORTFOLIO_CACHE', 'portfolio')
+    try:
+        return caches[alias]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def obtener(artefacto, portafolio, calcular, *partes):
+    clave = ':'.join(str(p) for p in (artefacto, portafolio.id, *partes))
+    cache = cache_portafolio()
+    valor = cache.get(clave, _AUSENTE, version=portafolio.version_datos)
+    if valor is _AUSENTE:
+        valor = calcular()
+        cache.set(clave, valor, version=portafolio.version_datos)
+    return valor
+
+
+# Los borrados masivos (resetear_ids) pueden reutilizar ids con versiones viejas
+def vaciar():
+    cache_portafolio().clear()
@@ -0,0 +1,146 @@
+import numpy as np
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from .cache import obtener
+from .models import CantidadActivo
+from .series import marcar_cambio
+
+CUATRO_DECIMALES = Decimal('0.0001')
+
+
+# Las cantidades c_i,t se guardan como función escalón: solo hay fila en las
+# fechas donde cambia la tenencia, y c_i,t es la última fila con fecha <= t.
+class IndiceCantidades:
+    def __init__(self, filas):
+        self._fechas = {}
+        self._cantidades = {}
+        for fecha, activo_id, cantidad in sorted(filas, key=lambda f: f[0]):
+            self._fechas.setdefault(activo_id, []).append(fecha)
+            self._cantidades.setdefault(activo_id, []).append(cantidad)
+
+    @classmethod
+    def cargar(cls, portafolio_id, fecha_hasta=None):
+        qs = CantidadActivo.objects.filter(portafolio_id=portafolio_id)
+        if fecha_hasta is not None:
+            qs = qs.filter(fecha__lte=fecha_hasta)
+        return cls(qs.values_list('fecha', 'activo_id', 'cantidad'))
+
+    # Filas (fecha, activo_id, cantidad) de varios portafolios en una sola consulta
+    @staticmethod
+    def filas_por_portafolio(portafolio_ids, fecha_hasta=None):
+        qs = CantidadActivo.objects.filter(portafolio_id__in=list(portafolio_ids))
+        if fecha_hasta is not None:
+            qs = qs.filter(fecha__lte=fecha_hasta)
+        filas = {pid: [] for pid in portafolio_ids}
+        for pid, fecha, activo_id, cantidad in qs.values_list('portafolio_id', 'fecha', 'activo_id', 'cantidad'):
+            filas[pid].append((fecha, activo_id, cantidad))
+        return filas
+
+    def copia(self):
+        nuevo = IndiceCantidades(())
+        nuevo._fechas = {a: list(f) for a, f in self._fechas.items()}
+        nuevo._cantidades = {a: list(c) for a, c in self._cantidades.items()}
+        return nuevo
+
+    def activos(self):
+        return sorted(self._fechas)
+
+    def cantidad_al(self, activo_id, fecha, default=None):
+        fechas = self._fechas.get(activo_id)
+        if not fechas:
+            return default
+        i = bisect_right(fechas, fecha)
+        return self._cantidades[activo_id][i - 1] if i else default
+
+    # Matriz fecha x activo de c_i,t (NaN antes de la primera fila del activo)
+    def matriz(self, fechas, activo_ids):
+        salida = np.full((len(fechas), len(activo_ids)), np.nan)
+        if not fechas:
+            return salida
+        objetivo = np.array(fechas, dtype='datetime64[D]')
+        for k, a in enumerate(activo_ids):
+            fechas_a = self._fechas.get(a)
+            if not fechas_a:
+                continue
+            pos = np.searchsorted(np.array(fechas_a, dtype='datetime64[D]'), objetivo, side='right') - 1
+            valores = np.array(self._cantidades[a], dtype=float)
+            salida[:, k] = np.where(pos >= 0, valores[np.maximum(pos, 0)], np.nan)
+        return salida
+
+    # {activo_id: (anterior, nueva)} al sumar `deltas` en `fecha`, sin modificar el índice.
+    # Se redondea como lo guarda CantidadActivo para que el índice coincida con la BD.
+    def cambios(self, fecha, deltas):
+        cambios = {}
+        for activo_id, delta in deltas.items():
+            anterior = self.cantidad_al(activo_id, fecha, Decimal('0'))
+            cambios[activo_id] = (anterior, (anterior + delta).quantize(CUATRO_DECIMALES))
+        return cambios
+
+    def aplicar_cambios(self, fecha, cambios):
+        for activo_id, (anterior, nueva) in cambios.items():
+            self._aplicar_cambio(activo_id, fecha, nueva, nueva - anterior)
+
+    def _aplicar_cambio(self, activo_id, fecha, nueva, delta):
+        fechas = self._fechas.setdefault(activo_id, [])
+        cantidades = self._cantidades.setdefault(activo_id, [])
+        i = bisect_left(fechas, fecha)
+        if i < len(fechas) and fechas[i] == fecha:
+            cantidades[i] = nueva
+        else:
+            fechas.insert(i, fecha)
+            cantidades.insert(i, nueva)
+        for j in range(i + 1, len(cantidades)):
+            cantidades[j] += delta
+
+
+# Índice completo del portafolio desde el cache; quien lo modifique debe usar copia()
+def indice_cantidades(portafolio):
+    return obtener('cantidades', portafolio, lambda: IndiceCantidades.cargar(portafolio.id))
+
+
+# Suma `delta` a la tenencia desde `fecha` en adelante: una fila en `fecha` y
+# el mismo ajuste sobre los cambios posteriores ya registrados.
+def registrar_cambio_cantidad(portafolio_id, activo_id, fecha, delta, indice=None):
+    if indice is None:
+        indice = IndiceCantidades(
+            CantidadActivo.objects.filter(portafolio_id=portafolio_id, activo_id=activo_id)
+            .values_list('fecha', 'activo_id', 'cantidad')
+        )
+    return registrar_cambios_cantidad(portafolio_id, fecha, {activo_id: delta}, indice)[activo_id]
+
+
+# Versión por lote de registrar_cambio_cantidad: `deltas` es {activo_id: delta}.
+# Escribe todas las filas de `fecha` con un upsert y ajusta las posteriores con un UPDATE.
+def registrar_cambios_cantidad(portafolio_id, fecha, deltas, indice=None):
+    if indice is None:
+        indice = IndiceCantidades.cargar(portafolio_id)
+
+    cambios = indice.cambios(fecha, deltas)
+
+    ajustes = [
+        When(activo_id=activo_id, then=Value(nueva - anterior))
+        for activo_id, (anterior, nueva) in cambios.items() if nueva != anterior
+    ]
+    with transaction.atomic():
+        CantidadActivo.objects.bulk_create(
+            [
+                CantidadActivo(portafolio_id=portafolio_id, activo_id=activo_id, fecha=fecha, cantidad=nueva)
+                for activo_id, (_, nueva) in cambios.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['portafolio', 'activo', 'fecha'],
+            update_fields=['cantidad'],
+        )
+        if ajustes:
+            CantidadActivo.objects.filter(
+                portafolio_id=portafolio_id, activo_id__in=list(cambios), fecha__gt=fecha
+            ).update(cantidad=F('cantidad') + Case(
+                *ajustes, default=Value(Decimal('0')), output_field=CantidadActivo._meta.get_field('cantidad')
+            ))
+        marcar_cambio([portafolio_id])
+
+    indice.aplicar_cambios(fecha, cambios)
+    return cambios
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from .models import Portafolio, ValorPortafolio
+from .muestreo import fin_de_periodo, fin_de_tramo
+
+
+# Comparación de varios portafolios con una consulta de ValorPortafolio para
+# todos: las series se alinean en las fechas que tienen en común y se devuelven
+# por columnas (una lista por portafolio, en el orden pedido).
+def comparar(portafolio_ids, fecha_inicio, fecha_fin, freq='D', max_points=None):
+    nombres = dict(Portafolio.objects.filter(id__in=portafolio_ids).values_list('id', 'nombre'))
+    faltantes = [pid for pid in portafolio_ids if pid not in nombres]
+    if faltantes:
+        raise Portafolio.DoesNotExist(f'No existen portafolios: {faltantes}')
+
+    filas = list(ValorPortafolio.objects.filter(
+        portafolio_id__in=portafolio_ids, fecha__gte=fecha_inicio, fecha__lte=fecha_fin
+    ).values_list('fecha', 'portafolio_id', 'valor_total'))
+    df = pd.DataFrame(filas, columns=['fecha', 'portafolio_id', 'valor_total'])
+    tabla = df.pivot(index='fecha', columns='portafolio_id', values='valor_total') \
+              .reindex(columns=portafolio_ids).astype(float).dropna().sort_index()
+
+    fechas = np.array(list(tabla.index), dtype='datetime64[D]')
+    valores = tabla.to_numpy(dtype=float, copy=True)
+    idx = fin_de_periodo(fechas, freq)
+    if max_points is not None:
+        idx = idx[fin_de_tramo(len(idx), max_points)]
+    fechas, valores = fechas[idx], valores[idx]
+
+    if len(fechas):
+        normalizados = valores / valores[0]
+        pesos = valores / valores.sum(axis=1, keepdims=True)
+    else:
+        normalizados = pesos = valores
+
+    def columnas(matriz, decimales):
+        return np.round(matriz.T, decimales).tolist()
+
+    return {
+        'portafolios': [{'id': pid, 'nombre': nombres[pid]} for pid in portafolio_ids],
+        'fechas': [str(f) for f in fechas.tolist()],
+        'valores': columnas(valores, 2),
+        'normalizados': columnas(normalizados, 6),
+        'retornos_acumulados': columnas(normalizados - 1, 6),
+        'pesos_relativos': columnas(pesos, 6),
+    }
@@ -0,0 +1,137 @@
+import functools
+import hashlib
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from datetime import datetime, timezone
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .almacen import firma_precios
+from .models import PesoPortafolio, Portafolio
+
+# GET condicional para las APIs de lectura. El ETag sale de las filas de
+# Portafolio (incluye version_datos, que sube con cada escritura de sus series)
+# y de la URL pedida; las filas se guardan en memoria unos segundos para que un
+# If-None-Match vigente se conteste con 304 sin consultar la BD. Las escrituras
+# en este proceso limpian la copia (ver series.marcar_cambio); las de otros
+# procesos se ven a más tardar tras PORTFOLIO_VERSIONES_SEGUNDOS.
+_versiones = None
+_lock = threading.Lock()
+
+
+def olvidar_versiones():
+    global _versiones
+    with _lock:
+        _versiones = None
+
+
+# {id: (version_datos, huella de la fila)} de todos los portafolios
+def versiones():
+    global _versiones
+    ttl = getattr(settings, 'PORTFOLIO_VERSIONES_SEGUNDOS', 2)
+    with _lock:
+        actual = _versiones
+    if actual is not None and time.monotonic() - actual[0] < ttl:
+        return actual[1]
+    filas = Portafolio.objects.order_by('id').values_list(
+        'id', 'version_datos', 'nombre', 'valor_inicial', 'fecha_inicio', 'descripcion'
+    )
+    tabla = {fila[0]: (fila[1], repr(fila)) for fila in filas}
+    with _lock:
+        _versiones = (time.monotonic(), tabla)
+    return tabla
+
+
+# Portafolios de los que depende la respuesta: los de portafolio_id,
+# portafolio_ids y referencia_id, o todos si no viene ninguno.
+# La tabla se fija en la solicitud (las vistas async la leen antes, fuera del loop).
+def _alcance(request):
+    tabla = getattr(request, '_versiones_portafolios', None)
+    if tabla is None:
+        tabla = request._versiones_portafolios = versiones()
+    pedidos = [request.GET.get('portafolio_id'), request.GET.get('referencia_id'),
+               *request.GET.get('portafolio_ids', '').split(',')]
+    pedidos = [p for p in pedidos if p]
+    if not pedidos:
+        return tabla
+    try:
+        return {int(p): tabla[int(p)] for p in pedidos}
+    except (ValueError, KeyError):
+        return None
+
+
+# Dependencias extra para vistas que calculan en vivo desde tablas que no suben
+# version_datos (ver lectura_condicional(depende=...)): reciben la solicitud y el
+# alcance y devuelven algo que cambia cuando cambian esos datos.
+def dependencia_precios(request, alcance):
+    return firma_precios()
+
+
+def dependencia_pesos_objetivo(request, alcance):
+    return list(
+        PesoPortafolio.objects.filter(portafolio_id__in=list(alcance))
+        .order_by('portafolio_id', 'activo_id').values_list('portafolio_id', 'activo_id', 'peso_inicial')
+    )
+
+
+def _etag_con(depende):
+    def _etag(request, *args, **kwargs):
+        alcance = _alcance(request)
+        if alcance is None:
+            return None
+        h = hashlib.sha1(request.get_full_path().encode())
+        h.update(request.META.get('HTTP_ACCEPT', '').encode())
+        for pid, (_, fila) in sorted(alcance.items()):
+            h.update(fila.encode())
+        for dependencia in depende:
+            h.update(repr(dependencia(request, alcance)).encode())
+        return h.hexdigest()[:32]
+
+    return _etag
+
+
+# version_datos sigue al reloj en µs, así que la mayor es la última escritura
+def _ultima_modificacion(request, *args, **kwargs):
+    alcance = _alcance(request)
+    if not alcance:
+        return None
+    version = max(v for v, _ in alcance.values())
+    if version < 10 ** 15:
+        return None
+    return datetime.fromtimestamp(version / 10 ** 6, tz=timezone.utc)
+
+
+# Decorador para vistas GET de solo lectura: ETag/Last-Modified, 304 y Cache-Control.
+# Con `depende` el ETag incluye esas dependencias y no se envía Last-Modified,
+# porque version_datos ya no fecha todos los datos de la respuesta.
+def lectura_condicional(vista=None, *, depende=()):
+    if vista is None:
+        return functools.partial(lectura_condicional, depende=depende)
+    vista_condicional = condition(
+        etag_func=_etag_con(depende), last_modified_func=None if depende else _ultima_modificacion,
+    )(vista)
+
+    def cabeceras(request, respuesta):
+        if request.method in ('GET', 'HEAD') and respuesta.status_code in (200, 304):
+            patch_cache_control(
+                respuesta, public=True, must_revalidate=True,
+                max_age=getattr(settings, 'PORTFOLIO_HTTP_MAX_AGE', 0),
+            )
+            patch_vary_headers(respuesta, ['Accept'])
+        return respuesta
+
+    if iscoroutinefunction(vista):
+        @functools.wraps(vista)
+        async def envoltura_async(request, *args, **kwargs):
+            request._versiones_portafolios = await sync_to_async(versiones)()
+            return cabeceras(request, await vista_condicional(request, *args, **kwargs))
+
+        return envoltura_async
+
+    @functools.wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        return cabeceras(request, vista_condicional(request, *args, **kwargs))
+
+    return envoltura
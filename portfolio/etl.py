@@ -1,72 +1,231 @@
+import contextlib
+import hashlib
+import time
 import pandas as pd
-from datetime import datetime, date
-from decimal import Decimal, InvalidOperation, getcontext
+from datetime import date
+from decimal import Decimal, getcontext
 from django.db import transaction
-from django.db.models import Q
 
 from .models import (
-    Activo, Portafolio, Precio, PesoPortafolio,
-    CantidadActivo, PesoActivo, ValorPortafolio
+    Activo, CargaEtl, HuellaFecha, Portafolio, Precio, PesoPortafolio, CantidadActivo,
+    PesoActivo, ValorPortafolio,
 )
+from .almacen import reconstruir_almacen, verificar_almacen
+from .metricas import medir_etapa
+from .paralelo import calcular_en_paralelo
+from .valuacion import escribir_filas, matriz_precios, valorizar_portafolio
 
 getcontext().prec = 28
 
-def to_decimal(x, default='0'):
-    if pd.isna(x):
-        return Decimal(default)
-    s = str(x).strip()
-    if s == '':
-        return Decimal(default)
-    # Permitir coma decimal si no hay punto
-    if s.count(',') == 1 and s.count('.') == 0:
-        s = s.replace(',', '.')
+TAMANO_LOTE = 2000
+CUATRO_DECIMALES = Decimal('0.0001')
+
+# Convierte una columna a float: acepta coma decimal si no
+# hay punto y deja en NaN lo que no sea un número finito.
+def a_numero(serie):
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        numeros = serie.astype(float)
+    else:
+        texto = serie.astype('string').str.strip()
+        coma = (texto.str.count(',') == 1) & (texto.str.count(r'\.') == 0)
+        texto = texto.where(~coma.fillna(False), texto.str.replace(',', '.', regex=False))
+        numeros = pd.to_numeric(texto, errors='coerce').astype(float)
+    return numeros.where(numeros.abs() != float('inf'))
+
+# Decimal con los mismos dígitos que imprime Python para el float
+def float_a_decimal(x):
+    return Decimal(repr(float(x)))
+
+def cargar_precios_bulk(df_p, activos_p, asset_by_code, tamano_lote=TAMANO_LOTE):
+    # Hoja ancha (Fecha x activo) -> filas largas (activo, fecha, precio)
+    largo = df_p.melt(id_vars='Fecha', value_vars=activos_p, var_name='codigo', value_name='raw')
+    largo = largo[largo['raw'].notna()].drop_duplicates(subset=['codigo', 'Fecha'], keep='last')
+    largo['precio'] = a_numero(largo['raw'])
+    for code, d, raw in largo.loc[largo['precio'].isna(), ['codigo', 'Fecha', 'raw']].itertuples(index=False):
+        print(f"[ETL] Precio inválido para {code} en {d}: {raw!r}")
+    largo = largo[largo['precio'].notna()]
+
+    existentes = {}
+    if not largo.empty:
+        qs = Precio.objects.filter(
+            activo__in=[asset_by_code[c] for c in activos_p],
+            fecha__gte=largo['Fecha'].min(),
+            fecha__lte=largo['Fecha'].max(),
+        ).values_list('activo_id', 'fecha', 'precio')
+        existentes = {(a, f): p for a, f, p in qs.iterator(chunk_size=tamano_lote)}
+
+    conteo = {'insertados': 0, 'actualizados': 0, 'sin_cambios': 0}
+    cambios = []
+    for code, d, precio in zip(largo['codigo'], largo['Fecha'], largo['precio'].tolist()):
+        price_dec = float_a_decimal(precio).quantize(CUATRO_DECIMALES)
+        activo_id = asset_by_code[code].id
+        anterior = existentes.get((activo_id, d))
+        if anterior is None:
+            conteo['insertados'] += 1
+        elif anterior != price_dec:
+            conteo['actualizados'] += 1
+        else:
+            conteo['sin_cambios'] += 1
+            continue
+        cambios.append(Precio(activo_id=activo_id, fecha=d, precio=price_dec))
+
+    Precio.objects.bulk_create(
+        cambios, batch_size=tamano_lote,
+        update_conflicts=True,
+        unique_fields=['activo', 'fecha'],
+        update_fields=['precio'],
+    )
+    return conteo
+
+def huella_archivos(*paths):
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloque)
+    return h.hexdigest()
+
+# Con 0 o negativos no se cargaría ningún lote y la carga quedaría completada
+def validar_lote_dias(lote_dias):
+    if lote_dias is not None and lote_dias <= 0:
+        raise ValueError(f"lote_dias debe ser un entero positivo (recibido {lote_dias})")
+
+# Carga los precios en lotes de `lote_dias` fechas, cada uno en su propia
+# transacción, y deja en CargaEtl la última fecha confirmada. Si hay una carga
+# sin terminar de los mismos archivos, sigue después de esa fecha.
+def cargar_precios_por_lotes(df_p, activos_p, asset_by_code, lote_dias, huella, origen):
+    validar_lote_dias(lote_dias)
+    carga = CargaEtl.objects.filter(huella=huella, completada=False).order_by('-id').first()
+    if carga is not None and carga.ultima_fecha and not Precio.objects.filter(fecha=carga.ultima_fecha).exists():
+        carga = None  # el checkpoint ya no corresponde a la BD (p. ej. tras resetear_ids)
+    if carga is None:
+        carga = CargaEtl.objects.create(huella=huella, origen=origen)
+    elif carga.ultima_fecha:
+        print(f"[ETL] Retomando carga de {origen} después de {carga.ultima_fecha}")
+
+    fechas = sorted(set(df_p['Fecha'].dropna()))
+    if carga.ultima_fecha:
+        fechas = [f for f in fechas if f > carga.ultima_fecha]
+
+    total = {'insertados': 0, 'actualizados': 0, 'sin_cambios': 0}
+    for k in range(0, len(fechas), lote_dias):
+        lote = fechas[k:k + lote_dias]
+        with transaction.atomic():
+            conteo = cargar_precios_bulk(df_p[df_p['Fecha'].isin(lote)], activos_p, asset_by_code)
+            carga.ultima_fecha = lote[-1]
+            carga.save(update_fields=['ultima_fecha', 'actualizada'])
+        for clave in total:
+            total[clave] += conteo[clave]
+        print(f"[ETL] Lote {lote[0]} a {lote[-1]}: {conteo['insertados']} insertados, "
+              f"{conteo['actualizados']} actualizados, {conteo['sin_cambios']} sin cambios.")
+
+    carga.completada = True
+    carga.save(update_fields=['completada', 'actualizada'])
+    return total
+
+HOJAS_REQUERIDAS = ('weights', 'Precios')
+
+class ErrorLectura(Exception):
+    pass
+
+def _hoja_streaming(ws):
+    filas = ws.iter_rows(values_only=True)
+    encabezado = next(filas, None)
+    if encabezado is None:
+        return pd.DataFrame()
+    columnas = [c if c is not None else f'Unnamed: {k}' for k, c in enumerate(encabezado)]
+    return pd.DataFrame.from_records(list(filas), columns=columnas).dropna(how='all')
+
+# Lee las hojas weights y Precios parseando el libro una sola vez; con `streaming`
+# se recorren con openpyxl en modo read_only en lugar de pasar por read_excel.
+def leer_libro(path_xlsx, streaming=False):
     try:
-        return Decimal(s)
-    except (InvalidOperation, ValueError):
-        return Decimal(default)
-
-def to_date(x):
-    if isinstance(x, date):
-        return x
-    if hasattr(x, 'date'):
-        try:
-            return x.date()
-        except Exception:
-            pass
+        if streaming:
+            from openpyxl import load_workbook
+            libro = load_workbook(path_xlsx, read_only=True, data_only=True)
+            hojas = libro.sheetnames
+        else:
+            libro = pd.ExcelFile(path_xlsx)
+            hojas = libro.sheet_names
+    except Exception as e:
+        raise ErrorLectura(f"No se pudo abrir {path_xlsx}: {e}")
+
     try:
-        return pd.to_datetime(x).date()
-    except Exception:
-        raise ValueError(f"No se pudo convertir a fecha: {x!r}")
+        if not set(HOJAS_REQUERIDAS).issubset(hojas):
+            raise ErrorLectura(f"El Excel debe tener hojas {set(HOJAS_REQUERIDAS)}. Hojas encontradas: {hojas}")
+        if streaming:
+            return tuple(_hoja_streaming(libro[h]) for h in HOJAS_REQUERIDAS)
+        return tuple(libro.parse(h) for h in HOJAS_REQUERIDAS)
+    finally:
+        libro.close()
 
-def cargar_datos_excel(path_xlsx, v0_value=Decimal('1000000000.00'), v0_date=None):
+def _leer_tabla(path):
+    extension = str(path).lower().rsplit('.', 1)[-1]
     try:
-        xls = pd.ExcelFile(path_xlsx)
+        if extension == 'csv':
+            return pd.read_csv(path)
+        if extension in ('parquet', 'pq'):
+            return pd.read_parquet(path)
+    except ImportError as e:
+        raise ErrorLectura(f"Leer {path} requiere pyarrow o fastparquet: {e}")
     except Exception as e:
-        print(f"[ETL] No se pudo abrir {path_xlsx}: {e}")
-        return False
+        raise ErrorLectura(f"No se pudo leer {path}: {e}")
+    raise ErrorLectura(f"Formato no soportado para {path}; use .csv o .parquet")
+
+# Alternativa al Excel: las mismas dos tablas (weights y Precios) en CSV o Parquet
+def leer_tablas(path_pesos, path_precios):
+    return _leer_tabla(path_pesos), _leer_tabla(path_precios)
 
-    required = {'weights', 'Precios'}
-    if not required.issubset(set(xls.sheet_names)):
-        print(f"[ETL] El Excel debe tener hojas {required}. Hojas encontradas: {xls.sheet_names}")
+@medir_etapa('cargar_datos_excel')
+def cargar_datos_excel(path_xlsx, v0_value=Decimal('1000000000.00'), v0_date=None, streaming=False,
+                       lote_dias=None):
+    try:
+        df_w, df_p = leer_libro(path_xlsx, streaming=streaming)
+    except ErrorLectura as e:
+        print(f"[ETL] {e}")
         return False
+    carga = (huella_archivos(path_xlsx), str(path_xlsx)) if lote_dias else None
+    olvidar_huellas()
+    return cargar_hojas(df_w, df_p, v0_value, v0_date, lote_dias, carga)
 
-    df_w = pd.read_excel(path_xlsx, sheet_name='weights')
-    df_p = pd.read_excel(path_xlsx, sheet_name='Precios')
+@medir_etapa('cargar_datos_tablas')
+def cargar_datos_tablas(path_pesos, path_precios, v0_value=Decimal('1000000000.00'), v0_date=None,
+                        lote_dias=None):
+    try:
+        df_w, df_p = leer_tablas(path_pesos, path_precios)
+    except ErrorLectura as e:
+        print(f"[ETL] {e}")
+        return False
+    carga = (huella_archivos(path_pesos, path_precios), f"{path_pesos} + {path_precios}") if lote_dias else None
+    olvidar_huellas()
+    return cargar_hojas(df_w, df_p, v0_value, v0_date, lote_dias, carga)
 
+# Valida las columnas y normaliza Fecha (la hoja Precios puede traerla como Dates)
+def preparar_hojas(df_w, df_p):
     if 'Dates' in df_p.columns:
         df_p = df_p.rename(columns={'Dates': 'Fecha'})
 
     for col in ['Fecha', 'activos', 'portafolio 1', 'portafolio 2']:
         if col not in df_w.columns:
-            print(f"[ETL] Falta columna '{col}' en hoja weights")
-            return False
+            raise ErrorLectura(f"Falta columna '{col}' en hoja weights")
 
     if 'Fecha' not in df_p.columns:
-        print("[ETL] Falta columna 'Fecha' en hoja Precios")
-        return False
+        raise ErrorLectura("Falta columna 'Fecha' en hoja Precios")
 
-    df_w['Fecha'] = pd.to_datetime(df_w['Fecha']).dt.date
-    df_p['Fecha'] = pd.to_datetime(df_p['Fecha']).dt.date
+    return (
+        df_w.assign(Fecha=pd.to_datetime(df_w['Fecha']).dt.date),
+        df_p.assign(Fecha=pd.to_datetime(df_p['Fecha']).dt.date),
+    )
+
+# Con `lote_dias` los precios se cargan fuera de la transacción principal, en
+# lotes confirmados uno a uno; `carga` es (huella, origen) para el checkpoint.
+def cargar_hojas(df_w, df_p, v0_value=Decimal('1000000000.00'), v0_date=None, lote_dias=None, carga=None):
+    validar_lote_dias(lote_dias)
+    try:
+        df_w, df_p = preparar_hojas(df_w, df_p)
+    except ErrorLectura as e:
+        print(f"[ETL] {e}")
+        return False
 
     if v0_date is None:
         if df_w.empty:
@@ -112,59 +271,60 @@ def cargar_datos_excel(path_xlsx, v0_value=Decimal('1000000000.00'), v0_date=Non
             if code not in asset_by_code:
                 asset_by_code[code] = Activo.objects.create(codigo=code, nombre=code)
 
-        precios_creados = 0
-        for i, row in df_p.iterrows():
-            d = row['Fecha']
-            for code in activos_p:
-                raw = row[code]
-                if pd.isna(raw):
-                    continue
-                price_dec = to_decimal(raw, default=None)
-                if price_dec is None:
-                    print(f"[ETL] Precio inválido para {code} en {d}: {raw!r}")
-                    continue
-                act = asset_by_code[code]
-                obj, created = Precio.objects.update_or_create(
-                    activo=act, fecha=d,
-                    defaults={'precio': price_dec}
-                )
-                if created:
-                    precios_creados += 1
-        print(f"[ETL] Precios upsert: {precios_creados} nuevas filas (resto actualizadas/ya existentes).")
-
-        df_w0 = df_w[df_w['Fecha'] == v0_date].copy()
+        if not lote_dias:
+            conteo = cargar_precios_bulk(df_p, activos_p, asset_by_code)
+            print(f"[ETL] Precios: {conteo['insertados']} insertados, {conteo['actualizados']} actualizados, "
+                  f"{conteo['sin_cambios']} sin cambios.")
+
+        df_w0 = df_w[df_w['Fecha'] == v0_date]
         if df_w0.empty:
             print(f"[ETL] No hay pesos en weights para {v0_date}")
             return False
 
-        pesos_creados = 0
-        for _, r in df_w0.iterrows():
-            code = str(r['activos']).strip()
-            w1 = to_decimal(r['portafolio 1'], default='0')
-            w2 = to_decimal(r['portafolio 2'], default='0')
-
-            act = asset_by_code.get(code)
-            if not act:
-                print(f"[ETL] Activo '{code}' no está en cache; se creará.")
-                act, _ = Activo.objects.get_or_create(codigo=code, defaults={'nombre': code})
-                asset_by_code[code] = act
-
-            obj1, _ = PesoPortafolio.objects.update_or_create(
-                portafolio=p1, activo=act,
-                defaults={'peso_inicial': w1}
-            )
-            obj2, _ = PesoPortafolio.objects.update_or_create(
-                portafolio=p2, activo=act,
-                defaults={'peso_inicial': w2}
-            )
-            pesos_creados += 1
+        # Filas sin código de activo (celda vacía) no tienen a qué activo asignarse
+        sin_codigo = int(df_w0['activos'].isna().sum())
+        if sin_codigo:
+            print(f"[ETL] {sin_codigo} filas de weights en {v0_date} sin activo; se omiten")
+            df_w0 = df_w0[df_w0['activos'].notna()]
+
+        df_w0 = pd.DataFrame({
+            'codigo': df_w0['activos'].astype(str).str.strip(),
+            'w1': a_numero(df_w0['portafolio 1']).fillna(0.0),
+            'w2': a_numero(df_w0['portafolio 2']).fillna(0.0),
+        })
+        pesos_creados = len(df_w0)
+        df_w0 = df_w0.drop_duplicates(subset='codigo', keep='last')
+        PesoPortafolio.objects.bulk_create(
+            [
+                PesoPortafolio(portafolio=pf, activo=asset_by_code[code], peso_inicial=float_a_decimal(w))
+                for code, w1, w2 in zip(df_w0['codigo'], df_w0['w1'], df_w0['w2'])
+                for pf, w in ((p1, w1), (p2, w2))
+            ],
+            update_conflicts=True,
+            unique_fields=['portafolio', 'activo'],
+            update_fields=['peso_inicial'],
+        )
 
         print(f"[ETL] Pesos iniciales (v0) upsert: {pesos_creados} activos.")
 
+    if lote_dias:
+        conteo = cargar_precios_por_lotes(df_p, activos_p, asset_by_code, lote_dias, *carga)
+        print(f"[ETL] Precios: {conteo['insertados']} insertados, {conteo['actualizados']} actualizados, "
+              f"{conteo['sin_cambios']} sin cambios.")
+
+    almacen = reconstruir_almacen()
+    if almacen is not None:
+        estado = 'consistente' if verificar_almacen() else 'NO coincide'
+        print(f"[ETL] Matriz de precios en disco: {len(almacen.fechas)} fechas x "
+              f"{len(almacen.activo_ids)} activos ({estado} con Precio)")
+
     print("[ETL] Carga completada OK.")
     return True
 
-def calcular_cantidades_iniciales(v0_date=date(2022, 2, 15)):
+FECHA_V0 = date(2022, 2, 15)
+
+@medir_etapa('calcular_cantidades_iniciales')
+def calcular_cantidades_iniciales(v0_date=FECHA_V0):
     try:
         with transaction.atomic():
             for portafolio in Portafolio.objects.all():
@@ -195,49 +355,143 @@ def calcular_cantidades_iniciales(v0_date=date(2022, 2, 15)):
         import traceback; traceback.print_exc()
         return False
 
-def calcular_valores_historicos():
+@medir_etapa('calcular_valores_historicos')
+def calcular_valores_historicos(trabajadores=1, transaccion_unica=True, fecha_desde=None):
+    # Sin transacción única cada portafolio se confirma por separado; con
+    # `fecha_desde` solo se recalculan las series desde esa fecha
     try:
-        with transaction.atomic():
-            fechas = list(Precio.objects.values_list('fecha', flat=True).distinct().order_by('fecha'))
-            if not fechas:
+        with transaction.atomic() if transaccion_unica else contextlib.nullcontext():
+            precios = matriz_precios(fecha_desde=fecha_desde)
+            if not precios[0]:
                 print("[VAL] No hay precios cargados.")
                 return False
-            for f in fechas:
-                print(f"[VAL] Fecha: {f}")
-                for pf in Portafolio.objects.all():
-                    Vt = Decimal('0')
-                    for peso_pf in pf.pesos.select_related('activo').all():
-                        a = peso_pf.activo
-                        try:
-                            p_it = Precio.objects.get(activo=a, fecha=f).precio
-                        except Precio.DoesNotExist:
-                            continue
-                        c_obj = CantidadActivo.objects.filter(
-                            portafolio=pf, activo=a, fecha__lte=f
-                        ).order_by('-fecha').first()
-                        if not c_obj:
-                            continue
-                        c_it = c_obj.cantidad
-
-                        x_it = c_it * p_it
-                        Vt += x_it
-
-                        PesoActivo.objects.update_or_create(
-                            portafolio=pf, activo=a, fecha=f,
-                            defaults={'valor_activo': x_it, 'peso': Decimal('0')}
-                        )
-
-                    if Vt > 0:
-                        ValorPortafolio.objects.update_or_create(
-                            portafolio=pf, fecha=f,
-                            defaults={'valor_total': Vt}
-                        )
-                        for pa in PesoActivo.objects.filter(portafolio=pf, fecha=f):
-                            pa.peso = (pa.valor_activo / Vt) if Vt else Decimal('0')
-                            pa.save()
+            print(f"[VAL] Matriz de precios: {len(precios[0])} fechas x {len(precios[1])} activos")
+            nombres = dict(Portafolio.objects.values_list('id', 'nombre'))
+            if trabajadores > 1:
+                # Cálculo en procesos; las escrituras siguen en este proceso
+                print(f"[VAL] Valorizando {len(nombres)} portafolios con {trabajadores} procesos")
+                for pid, filas in calcular_en_paralelo(list(nombres), precios, trabajadores):
+                    n_valores, n_pesos = (0, 0) if filas is None else escribir_filas(pid, *filas)
+                    print(f"[VAL] {nombres[pid]}: {n_valores} valores, {n_pesos} pesos")
+            else:
+                for pid, nombre in nombres.items():
+                    n_valores, n_pesos = valorizar_portafolio(pid, precios=precios)
+                    print(f"[VAL] {nombre}: {n_valores} valores, {n_pesos} pesos")
             print("[VAL] Series históricas recalculadas.")
             return True
     except Exception as e:
         print(f"[VAL] Error: {e}")
         import traceback; traceback.print_exc()
         return False
+
+# Huella por fecha de una hoja: hash vectorizado de cada fila (incluye los nombres
+# de columna, así que agregar un activo cambia todas las fechas) combinado por fecha.
+def huellas_por_fecha(df):
+    if df.empty:
+        return {}
+    columnas = [c for c in df.columns if c != 'Fecha']
+    filas = pd.util.hash_pandas_object(df[columnas], index=False).tolist()
+    huellas = {}
+    for fecha, h in zip(df['Fecha'].tolist(), filas):
+        huellas[fecha] = (huellas.get(fecha, 0) * 1000003 + h) % (1 << 64)
+    encabezado = hashlib.md5('\x1f'.join(map(str, columnas)).encode()).hexdigest()[:16]
+    return {f: f"{encabezado}{h:016x}" for f, h in huellas.items() if not pd.isna(f)}
+
+# Una carga completa reemplaza lo que registraron las recargas incrementales: la
+# siguiente recarga vuelve a comparar todas las fechas.
+def olvidar_huellas():
+    with transaction.atomic():
+        HuellaFecha.objects.all().delete()
+        CargaEtl.objects.filter(valorizada=True).update(valorizada=False)
+
+# Fechas que desaparecieron de la hoja Precios: sus precios y las filas de las series
+# en esas fechas (las señales de ValorPortafolio/PesoActivo suben version_datos).
+def borrar_fechas(fechas):
+    with transaction.atomic():
+        Precio.objects.filter(fecha__in=fechas).delete()
+        ValorPortafolio.objects.filter(fecha__in=fechas).delete()
+        PesoActivo.objects.filter(fecha__in=fechas).delete()
+
+# Recarga diaria: compara las huellas por fecha con las de la última carga, carga
+# solo las fechas nuevas o cambiadas y recalcula las series desde la primera de
+# ellas. Si los archivos son idénticos a la última recarga completa no los lee.
+def recargar_incremental(path_xlsx=None, tablas=None, streaming=False, trabajadores=1):
+    inicio = time.perf_counter()
+    archivos = list(tablas) if tablas else [path_xlsx]
+    origen = ' + '.join(str(a) for a in archivos)
+    huella = huella_archivos(*archivos)
+    # Solo la última carga completa describe lo que hay en la base
+    ultima = CargaEtl.objects.filter(completada=True).order_by('-id').first()
+    if ultima is not None and ultima.huella == huella and ultima.valorizada:
+        print(f"[ETL] {origen} sin cambios desde la última carga ({time.perf_counter() - inicio:.3f} s)")
+        return True
+
+    try:
+        df_w, df_p = leer_tablas(*tablas) if tablas else leer_libro(path_xlsx, streaming=streaming)
+        df_w, df_p = preparar_hojas(df_w, df_p)
+    except ErrorLectura as e:
+        print(f"[ETL] {e}")
+        return False
+
+    nuevas = {'Precios': huellas_por_fecha(df_p), 'weights': huellas_por_fecha(df_w)}
+    guardadas = {hoja: {} for hoja in nuevas}
+    for hoja, fecha, valor in HuellaFecha.objects.filter(hoja__in=list(nuevas)).values_list('hoja', 'fecha', 'huella'):
+        guardadas[hoja][fecha] = valor
+    cambiadas = {
+        hoja: sorted(f for f, valor in nuevas[hoja].items() if guardadas[hoja].get(f) != valor)
+        for hoja in nuevas
+    }
+    eliminadas = {hoja: sorted(f for f in guardadas[hoja] if f not in nuevas[hoja]) for hoja in nuevas}
+    print(f"[ETL] Fechas nuevas o cambiadas: {len(cambiadas['Precios'])} en Precios, "
+          f"{len(cambiadas['weights'])} en weights")
+    if eliminadas['Precios'] or eliminadas['weights']:
+        print(f"[ETL] Fechas eliminadas: {len(eliminadas['Precios'])} en Precios, "
+              f"{len(eliminadas['weights'])} en weights")
+
+    if cambiadas['Precios'] or cambiadas['weights'] or eliminadas['Precios'] or eliminadas['weights']:
+        # Antes de cargar_hojas, para que el almacén se reconstruya sin esas fechas
+        if eliminadas['Precios']:
+            borrar_fechas(eliminadas['Precios'])
+        df_cambios = df_p[df_p['Fecha'].isin(cambiadas['Precios'])]
+        if not cargar_hojas(df_w, df_cambios):
+            return False
+
+        # Cambios en v0 (pesos iniciales o precios de ese día) alteran c_i,0 y toda la
+        # historia. v0 es la primera fecha de weights, la que usó cargar_hojas.
+        v0_date = df_w['Fecha'].iloc[0]
+        # Si se eliminó la v0 anterior, la nueva v0 cambia todas las cantidades
+        if (v0_date in cambiadas['weights'] or v0_date in cambiadas['Precios']
+                or any(f < v0_date for f in eliminadas['weights'])):
+            if not calcular_cantidades_iniciales(v0_date):
+                return False
+            fecha_desde = None
+        else:
+            fecha_desde = min(cambiadas['Precios'][:1] + eliminadas['Precios'][:1], default=False)
+            # Si solo se eliminaron las últimas fechas no queda nada que recalcular
+            if fecha_desde is not False and not any(f >= fecha_desde for f in nuevas['Precios']):
+                fecha_desde = False
+        if fecha_desde is not False:
+            print(f"[ETL] Recalculando series desde {fecha_desde or 'el inicio'}")
+            if not calcular_valores_historicos(trabajadores=trabajadores, fecha_desde=fecha_desde):
+                return False
+
+    with transaction.atomic():
+        for hoja, fechas in eliminadas.items():
+            if fechas:
+                HuellaFecha.objects.filter(hoja=hoja, fecha__in=fechas).delete()
+        HuellaFecha.objects.bulk_create(
+            [
+                HuellaFecha(hoja=hoja, fecha=f, huella=nuevas[hoja][f])
+                for hoja, fechas in cambiadas.items() for f in fechas
+            ],
+            batch_size=TAMANO_LOTE,
+            update_conflicts=True,
+            unique_fields=['hoja', 'fecha'],
+            update_fields=['huella'],
+        )
+        CargaEtl.objects.create(
+            huella=huella, origen=origen, completada=True, valorizada=True,
+            ultima_fecha=max(nuevas['Precios'], default=None),
+        )
+    print(f"[ETL] Recarga incremental lista ({time.perf_counter() - inicio:.3f} s)")
+    return True
@@ -0,0 +1,211 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from datetime import datetime, timedelta
+from ...etl import cargar_datos_excel, calcular_cantidades_iniciales, calcular_valores_historicos
+from ...models import Activo, Portafolio
+from ...perfil_bd import pragmas_actuales
+from ...sintetico import FECHA_INICIO, crear_portafolios, generar_libro
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+
+SALIDA = os.path.join('.bench', 'resultados.json')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark del ETL, la valorización y las APIs sobre datos sintéticos en una BD temporal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activos', type=int, default=17, help='Número de activos')
+        parser.add_argument('--dias', type=int, default=365, help='Número de días de precios')
+        parser.add_argument('--portafolios', type=int, default=2,
+                            help='Número total de portafolios (mínimo 2, los del libro)')
+        parser.add_argument('--ordenes', type=int, default=100,
+                            help='Órdenes por llamada a las APIs de transacción')
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Procesos para calcular_valores_historicos')
+        parser.add_argument('--salida', type=str, default=SALIDA,
+                            help='Archivo JSON donde se agregan los resultados (por defecto en .bench/, ignorado por git)')
+        parser.add_argument('--concurrencia', action='store_true',
+                            help='Medir lecturas de la API mientras otro hilo recarga y revaloriza')
+        parser.add_argument('--sin-perfil-sqlite', action='store_true',
+                            help='Desactivar PORTFOLIO_SQLITE_PRAGMAS y WAL para comparar')
+
+    def handle(self, *args, **options):
+        # La BD del bench es temporal, así que WAL no toca la del proyecto
+        perfil = override_settings(PORTFOLIO_SQLITE_PRAGMAS=None, PORTFOLIO_SQLITE_WAL=False) \
+            if options['sin_perfil_sqlite'] else override_settings(PORTFOLIO_SQLITE_WAL=True)
+        with perfil, tempfile.TemporaryDirectory() as tmp:
+            libro = generar_libro(
+                os.path.join(tmp, 'bench.xlsx'), options['activos'], options['dias'], semilla=options['semilla']
+            )
+            with self.bd_temporal(tmp):
+                resultados = self.ejecutar(libro, options)
+                if options['concurrencia']:
+                    recarga = generar_libro(
+                        os.path.join(tmp, 'recarga.xlsx'), options['activos'], options['dias'],
+                        semilla=options['semilla'] + 1,
+                    )
+                    resultados.append(self.lecturas_durante_carga(recarga, options))
+
+        registro = {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'commit': self.commit_actual(),
+            'parametros': {k: options[k] for k in (
+                'activos', 'dias', 'portafolios', 'ordenes', 'semilla', 'workers', 'concurrencia', 'sin_perfil_sqlite'
+            )},
+            'resultados': resultados,
+        }
+        historial = []
+        if os.path.exists(options['salida']):
+            with open(options['salida'], encoding='utf-8') as f:
+                historial = json.load(f)
+        historial.append(registro)
+        os.makedirs(os.path.dirname(options['salida']) or '.', exist_ok=True)
+        with open(options['salida'], 'w', encoding='utf-8') as f:
+            json.dump(historial, f, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Resultados agregados a {options['salida']}"))
+
+    # BD SQLite desechable dentro de `tmp`; la configurada no se toca
+    @contextlib.contextmanager
+    def bd_temporal(self, tmp):
+        nombre_original = connection.settings_dict['NAME']
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+    def ejecutar(self, libro, options):
+        resultados = []
+
+        def medir(etapa, fn, filas=None):
+            salida = io.StringIO()
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as consultas, contextlib.redirect_stdout(salida):
+                inicio = time.perf_counter()
+                valor = fn()
+                segundos = time.perf_counter() - inicio
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            r = {
+                'etapa': etapa,
+                'segundos': round(segundos, 4),
+                'consultas': len(consultas),
+                'memoria_pico_kb': pico // 1024,
+            }
+            if filas:
+                r['por_segundo'] = round(filas / segundos, 1)
+            resultados.append(r)
+            self.stdout.write(
+                f"{etapa:<32} {r['segundos']:>9.3f} s {r['consultas']:>8} consultas {r['memoria_pico_kb']:>9} KB"
+            )
+            return valor
+
+        fin = FECHA_INICIO + timedelta(days=options['dias'] - 1)
+        medir('cargar_datos_excel', lambda: cargar_datos_excel(libro, v0_date=FECHA_INICIO))
+        crear_portafolios(max(options['portafolios'] - 2, 0), semilla=options['semilla'])
+        medir('calcular_cantidades_iniciales', lambda: calcular_cantidades_iniciales(v0_date=FECHA_INICIO))
+        medir('calcular_valores_historicos', lambda: calcular_valores_historicos(trabajadores=options['workers']))
+
+        cliente = Client(HTTP_HOST='localhost')
+        pf = Portafolio.objects.order_by('id').first()
+        codigos = list(Activo.objects.values_list('codigo', flat=True))
+        rng = random.Random(options['semilla'])
+        fecha_orden = str(FECHA_INICIO + timedelta(days=options['dias'] // 2))
+
+        def ordenes():
+            return [
+                {'activo_codigo': rng.choice(codigos), 'tipo': rng.choice(['COMPRA', 'VENTA']),
+                 'monto': rng.randint(1000, 100000)}
+                for _ in range(options['ordenes'])
+            ]
+
+        def post(url):
+            datos = {'portafolio_id': pf.id, 'fecha': fecha_orden, 'transacciones': ordenes()}
+            return lambda: cliente.post(url, datos, content_type='application/json')
+
+        rango = {'fecha_inicio': str(FECHA_INICIO), 'fecha_fin': str(fin)}
+        medir('api_transaccion', post('/api/transaccion/'), filas=options['ordenes'])
+        medir('api_transaccion_lote', post('/api/transaccion/lote/'), filas=options['ordenes'])
+        graficos = dict(rango, portafolio_id=pf.id)
+        medir('api_datos_graficos_frio', lambda: cliente.get('/api/datos-graficos/', graficos))
+        medir('api_datos_graficos_caliente', lambda: cliente.get('/api/datos-graficos/', graficos))
+        medir('api_datos_portafolio', lambda: cliente.get('/api/datos-portafolio/', rango))
+        return resultados
+
+    # Un hilo recarga precios distintos y revaloriza todo (transacciones de
+    # escritura largas) mientras este hilo consulta datos-portafolio sin pausa.
+    def lecturas_durante_carga(self, libro, options):
+        # Consulta típica del dashboard: un portafolio, últimos 30 días
+        fin = FECHA_INICIO + timedelta(days=options['dias'] - 1)
+        rango = {
+            'fecha_inicio': str(fin - timedelta(days=30)), 'fecha_fin': str(fin),
+            'portafolio_id': Portafolio.objects.order_by('id').values_list('id', flat=True).first(),
+        }
+        cliente = Client(HTTP_HOST='localhost')
+        errores_carga = []
+
+        def recargar():
+            try:
+                cargar_datos_excel(libro, v0_date=FECHA_INICIO)
+                calcular_valores_historicos(trabajadores=options['workers'])
+            except Exception as e:
+                errores_carga.append(repr(e))
+            finally:
+                connection.close()
+
+        latencias, fallidas = [], 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            hilo = threading.Thread(target=recargar)
+            inicio = time.perf_counter()
+            hilo.start()
+            while hilo.is_alive():
+                t0 = time.perf_counter()
+                try:
+                    ok = cliente.get('/api/datos-portafolio/', rango).status_code == 200
+                except Exception:
+                    ok = False
+                if ok:
+                    latencias.append(time.perf_counter() - t0)
+                else:
+                    fallidas += 1
+            segundos = time.perf_counter() - inicio
+
+        ms = sorted(x * 1000 for x in latencias)
+        percentil = lambda q: round(ms[min(len(ms) - 1, int(q * len(ms)))], 2) if ms else None
+        r = {
+            'etapa': 'lecturas_durante_carga',
+            'segundos': round(segundos, 4),
+            'lecturas': len(ms),
+            'fallidas': fallidas,
+            'p50_ms': percentil(0.5),
+            'p95_ms': percentil(0.95),
+            'max_ms': round(ms[-1], 2) if ms else None,
+            'journal_mode': pragmas_actuales(connection, ['journal_mode'])['journal_mode'],
+            'errores_carga': errores_carga,
+        }
+        self.stdout.write(
+            f"{r['etapa']:<32} {r['segundos']:>9.3f} s {r['lecturas']:>8} lecturas ({r['fallidas']} fallidas, "
+            f"p50 {r['p50_ms']} ms, p95 {r['p95_ms']} ms, máx {r['max_ms']} ms, {r['journal_mode']})"
+        )
+        return r
+
+    def commit_actual(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
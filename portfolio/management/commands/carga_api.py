@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import AsyncClient, Client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from ...models import Portafolio, ValorPortafolio
+import asyncio
+import time
+
+ENDPOINTS = {
+    'portafolios': ('/api/portafolios/', '/api/async/portafolios/'),
+    'datos-portafolio': ('/api/datos-portafolio/', '/api/async/datos-portafolio/'),
+    'datos-graficos': ('/api/datos-graficos/', '/api/async/datos-graficos/'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Prueba de carga en proceso de las APIs de lectura: vistas WSGI con un hilo por '
+            'cliente contra las variantes async con un solo event loop, sobre la BD configurada')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='datos-portafolio')
+        parser.add_argument('--clientes', type=int, default=20, help='Solicitudes simultáneas')
+        parser.add_argument('--solicitudes', type=int, default=200, help='Solicitudes por modo')
+        parser.add_argument('--dias', type=int, default=30, help='Días de datos pedidos (desde la última fecha)')
+
+    def handle(self, *args, **options):
+        ultima = ValorPortafolio.objects.order_by('-fecha').values_list('fecha', flat=True).first()
+        pf = Portafolio.objects.order_by('id').first()
+        if ultima is None or pf is None:
+            raise CommandError('No hay series calculadas; ejecute cargar_datos primero')
+        params = {
+            'fecha_inicio': str(ultima - timedelta(days=options['dias'])),
+            'fecha_fin': str(ultima),
+            'portafolio_id': pf.id,
+        }
+        url_wsgi, url_asgi = ENDPOINTS[options['endpoint']]
+        n, clientes = options['solicitudes'], options['clientes']
+
+        for modo, medir in (('wsgi', self.wsgi), ('asgi', self.asgi)):
+            inicio = time.perf_counter()
+            latencias = medir(url_wsgi if modo == 'wsgi' else url_asgi, params, n, clientes)
+            segundos = time.perf_counter() - inicio
+            ms = sorted(x * 1000 for x in latencias)
+            self.stdout.write(
+                f"{modo}: {n / segundos:8.1f} req/s  p50 {ms[len(ms) // 2]:7.1f} ms  "
+                f"p95 {ms[min(len(ms) - 1, int(len(ms) * 0.95))]:7.1f} ms  ({n} solicitudes, {clientes} clientes)"
+            )
+
+    # Un hilo por cliente, como un servidor WSGI con hilos
+    def wsgi(self, url, params, n, clientes):
+        def una(_):
+            t0 = time.perf_counter()
+            respuesta = Client(HTTP_HOST='localhost').get(url, params)
+            close_old_connections()
+            if respuesta.status_code != 200:
+                raise CommandError(f'{url}: {respuesta.status_code}')
+            return time.perf_counter() - t0
+
+        with ThreadPoolExecutor(max_workers=clientes) as pool:
+            return list(pool.map(una, range(n)))
+
+    # Todos los clientes en un event loop, como un worker ASGI
+    def asgi(self, url, params, n, clientes):
+        async def todas():
+            pendientes = iter(range(n))
+            latencias = []
+
+            async def cliente():
+                c = AsyncClient(HTTP_HOST='localhost')
+                for _ in pendientes:
+                    t0 = time.perf_counter()
+                    respuesta = await c.get(url, params)
+                    if respuesta.status_code != 200:
+                        raise CommandError(f'{url}: {respuesta.status_code}')
+                    latencias.append(time.perf_counter() - t0)
+
+            await asyncio.gather(*(cliente() for _ in range(clientes)))
+            return latencias
+
+        return asyncio.run(todas())
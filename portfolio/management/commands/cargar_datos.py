@@ -1,7 +1,21 @@
+import argparse
 from django.core.management.base import BaseCommand
-from ...etl import cargar_datos_excel, calcular_cantidades_iniciales, calcular_valores_historicos
+from ...etl import (
+    cargar_datos_excel, cargar_datos_tablas, calcular_cantidades_iniciales, calcular_valores_historicos,
+    recargar_incremental
+)
+from ...metricas import exportar_etl
 import os
 
+def entero_positivo(valor):
+    try:
+        n = int(valor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{valor}' no es un entero")
+    if n <= 0:
+        raise argparse.ArgumentTypeError(f"debe ser mayor que 0 (recibido {n})")
+    return n
+
 class Command(BaseCommand):
     help = 'Cargar datos desde el archivo Excel y calcular valores iniciales'
     
@@ -12,19 +26,90 @@ class Command(BaseCommand):
             help='Ruta al archivo Excel con los datos',
             default='datos.xlsx'
         )
+        parser.add_argument(
+            '--streaming',
+            action='store_true',
+            help='Leer el Excel fila a fila con openpyxl en modo read_only'
+        )
+        parser.add_argument(
+            '--pesos',
+            type=str,
+            help='Tabla weights en CSV o Parquet (en lugar del Excel; requiere --precios)'
+        )
+        parser.add_argument(
+            '--precios',
+            type=str,
+            help='Tabla Precios en CSV o Parquet (en lugar del Excel; requiere --pesos)'
+        )
+        parser.add_argument(
+            '--lote-dias',
+            type=entero_positivo,
+            help='Confirmar los precios en lotes de N fechas, retomando cargas interrumpidas'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Cargar solo las fechas nuevas o cambiadas desde la última recarga y revalorizar desde ellas'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Procesos para valorizar los portafolios en paralelo',
+            default=1
+        )
+        parser.add_argument(
+            '--metricas',
+            type=str,
+            help='Escribir al terminar las métricas de las etapas del ETL en este archivo (formato Prometheus)'
+        )
     
     def handle(self, *args, **options):
+        try:
+            self.cargar(options)
+        finally:
+            # Las etapas se midieron en este proceso; el /metrics del servidor no las ve
+            if options['metricas']:
+                exportar_etl(options['metricas'])
+
+    def cargar(self, options):
         archivo = options['archivo']
+        pesos, precios = options['pesos'], options['precios']
         
-        if not os.path.exists(archivo):
+        if bool(pesos) != bool(precios):
             self.stdout.write(
-                self.style.ERROR(f'El archivo {archivo} no existe')
+                self.style.ERROR('Use --pesos y --precios juntos')
             )
             return
         
+        for ruta in ([pesos, precios] if pesos else [archivo]):
+            if not os.path.exists(ruta):
+                self.stdout.write(
+                    self.style.ERROR(f'El archivo {ruta} no existe')
+                )
+                return
+        
         self.stdout.write('Iniciando carga de datos...')
         
-        if cargar_datos_excel(archivo):
+        if options['incremental']:
+            if recargar_incremental(
+                path_xlsx=archivo, tablas=(pesos, precios) if pesos else None,
+                streaming=options['streaming'], trabajadores=options['workers']
+            ):
+                self.stdout.write(
+                    self.style.SUCCESS('¡Proceso completado exitosamente!')
+                )
+            else:
+                self.stdout.write(
+                    self.style.ERROR('Error en la recarga incremental')
+                )
+            return
+        
+        if pesos:
+            cargado = cargar_datos_tablas(pesos, precios, lote_dias=options['lote_dias'])
+        else:
+            cargado = cargar_datos_excel(archivo, streaming=options['streaming'], lote_dias=options['lote_dias'])
+        
+        if cargado:
             self.stdout.write(
                 self.style.SUCCESS('Datos del Excel cargados exitosamente')
             )
@@ -44,7 +129,9 @@ class Command(BaseCommand):
             )
             return
         
-        if calcular_valores_historicos():
+        if calcular_valores_historicos(
+            trabajadores=options['workers'], transaccion_unica=not options['lote_dias']
+        ):
             self.stdout.write(
                 self.style.SUCCESS('Valores históricos calculados')
             )
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.db import connection
+from ...cache import vaciar
 from ...models import *
 
 class Command(BaseCommand):
@@ -32,6 +33,9 @@ class Command(BaseCommand):
         Precio.objects.all().delete()
         Activo.objects.all().delete()
         Portafolio.objects.all().delete()
+        CargaEtl.objects.all().delete()
+        HuellaFecha.objects.all().delete()
+        vaciar()
         
         with connection.cursor() as cursor:
             cursor.execute("DELETE FROM sqlite_sequence WHERE name='portfolio_portafolio'")
@@ -42,6 +46,8 @@ class Command(BaseCommand):
             cursor.execute("DELETE FROM sqlite_sequence WHERE name='portfolio_valorportafolio'")
             cursor.execute("DELETE FROM sqlite_sequence WHERE name='portfolio_pesoactivo'")
             cursor.execute("DELETE FROM sqlite_sequence WHERE name='portfolio_transaccion'")
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name='portfolio_cargaetl'")
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name='portfolio_huellafecha'")
         
         self.stdout.write(self.style.SUCCESS('Datos borrados y secuencias reseteadas'))
         self.stdout.write('Ahora ejecute: python manage.py cargar_datos --archivo datos.xlsx')
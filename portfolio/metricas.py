@@ -0,0 +1,272 @@
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger('portfolio.metricas')
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Acumula tiempo de pared, consultas y tiempo de BD de un tramo; se instala
+# como connection.execute_wrapper, así que funciona también con DEBUG=False.
+class Medicion:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.segundos_bd = 0.0
+        self.filas = 0
+        self.bytes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.segundos_bd += time.perf_counter() - inicio
+
+    def segundos(self):
+        return time.perf_counter() - self.inicio
+
+
+_actual = contextvars.ContextVar('medicion_portfolio', default=None)
+
+
+# Las vistas informan cuántas filas serializan; no hace nada sin medición activa
+def contar_filas(n):
+    medicion = _actual.get()
+    if medicion is not None:
+        medicion.filas += n
+
+
+# Wrapper instalado en cada conexión (ver apps.py): suma la consulta a la
+# medición de la solicitud en curso. La medición viaja en un ContextVar, así que
+# también cuenta las consultas que una vista async hace con sync_to_async desde
+# otro hilo (y con otra conexión).
+def medir_consulta(execute, sql, params, many, context):
+    medicion = _actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    return medicion(execute, sql, params, many, context)
+
+
+def instalar_medidor(sender, connection, **kwargs):
+    if medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_consulta)
+
+
+def _etiquetas(**kw):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in kw.items()) + '}'
+
+
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self._vistas = {}
+            self._estados = {}
+            self._etapas = {}
+
+    def observar_vista(self, vista, metodo, estado, medicion, segundos):
+        with self._lock:
+            self._estados[(vista, metodo, estado)] = self._estados.get((vista, metodo, estado), 0) + 1
+            v = self._vistas.setdefault((vista, metodo), {
+                'cubetas': [0] * len(LIMITES_SEGUNDOS), 'n': 0, 'segundos': 0.0,
+                'consultas': 0, 'segundos_bd': 0.0, 'filas': 0, 'bytes': 0,
+            })
+            for i, limite in enumerate(LIMITES_SEGUNDOS):
+                if segundos <= limite:
+                    v['cubetas'][i] += 1
+            v['n'] += 1
+            v['segundos'] += segundos
+            v['consultas'] += medicion.consultas
+            v['segundos_bd'] += medicion.segundos_bd
+            v['filas'] += medicion.filas
+            v['bytes'] += medicion.bytes
+
+    def observar_etapa(self, etapa, medicion, segundos):
+        with self._lock:
+            e = self._etapas.setdefault(etapa, {'n': 0, 'segundos': 0.0, 'ultima': 0.0, 'consultas': 0})
+            e['n'] += 1
+            e['segundos'] += segundos
+            e['ultima'] = segundos
+            e['consultas'] += medicion.consultas
+
+    # Formato de exposición de texto de Prometheus (version 0.0.4). Con
+    # solo_etl=True se exportan solo las etapas del ETL (ver exportar_etl).
+    def prometheus(self, solo_etl=False):
+        with self._lock:
+            vistas = {k: dict(v, cubetas=list(v['cubetas'])) for k, v in self._vistas.items()}
+            estados = dict(self._estados)
+            etapas = {k: dict(v) for k, v in self._etapas.items()}
+
+        lineas = []
+
+        def metrica(nombre, tipo, ayuda, muestras):
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            lineas.extend(f'{n}{e} {v}' for n, e, v in muestras)
+
+        if not solo_etl:
+            self._prometheus_http(metrica, vistas, estados)
+        for campo, nombre, tipo, ayuda in (
+            ('n', 'portfolio_etl_ejecuciones_total', 'counter', 'Ejecuciones por etapa del ETL'),
+            ('segundos', 'portfolio_etl_segundos_total', 'counter', 'Tiempo acumulado por etapa del ETL'),
+            ('ultima', 'portfolio_etl_ultima_duracion_segundos', 'gauge', 'Duración de la última ejecución'),
+            ('consultas', 'portfolio_etl_consultas_total', 'counter', 'Consultas SQL por etapa del ETL'),
+        ):
+            metrica(nombre, tipo, ayuda, [
+                (nombre, _etiquetas(etapa=k), d[campo]) for k, d in sorted(etapas.items())
+            ])
+        return '\n'.join(lineas) + '\n'
+
+    @staticmethod
+    def _prometheus_http(metrica, vistas, estados):
+        metrica('portfolio_http_solicitudes_total', 'counter', 'Solicitudes atendidas por vista y estado', [
+            ('portfolio_http_solicitudes_total', _etiquetas(vista=v, metodo=m, estado=s), n)
+            for (v, m, s), n in sorted(estados.items())
+        ])
+        muestras = []
+        for (v, m), d in sorted(vistas.items()):
+            for limite, n in zip(LIMITES_SEGUNDOS, d['cubetas']):
+                muestras.append(('portfolio_http_duracion_segundos_bucket', _etiquetas(vista=v, metodo=m, le=limite), n))
+            muestras.append(('portfolio_http_duracion_segundos_bucket', _etiquetas(vista=v, metodo=m, le='+Inf'), d['n']))
+            muestras.append(('portfolio_http_duracion_segundos_sum', _etiquetas(vista=v, metodo=m), d['segundos']))
+            muestras.append(('portfolio_http_duracion_segundos_count', _etiquetas(vista=v, metodo=m), d['n']))
+        metrica('portfolio_http_duracion_segundos', 'histogram', 'Tiempo de pared por vista', muestras)
+        for campo, nombre, ayuda in (
+            ('consultas', 'portfolio_http_consultas_total', 'Consultas SQL ejecutadas por vista'),
+            ('segundos_bd', 'portfolio_http_bd_segundos_total', 'Tiempo en la base de datos por vista'),
+            ('filas', 'portfolio_http_filas_serializadas_total', 'Filas serializadas por vista'),
+            ('bytes', 'portfolio_http_respuesta_bytes_total', 'Bytes de respuesta por vista'),
+        ):
+            metrica(nombre, 'counter', ayuda, [
+                (nombre, _etiquetas(vista=v, metodo=m), d[campo]) for (v, m), d in sorted(vistas.items())
+            ])
+
+
+registro = Registro()
+
+
+# Las etapas del ETL se miden en el proceso que las ejecuta (p. ej. manage.py
+# cargar_datos), no en el del servidor web, así que no aparecen en su /metrics.
+# Esto las escribe en `ruta` para el textfile collector de node_exporter u otro
+# scraper de archivos; se reemplaza de forma atómica.
+def exportar_etl(ruta):
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directorio, suffix='.tmp', delete=False, encoding='utf-8') as f:
+        f.write(registro.prometheus(solo_etl=True))
+    os.replace(f.name, ruta)
+
+
+# Tramo medido de una etapa del ETL; sirve como `with` o como decorador
+@contextmanager
+def medir_etapa(etapa):
+    medicion = Medicion()
+    with connection.execute_wrapper(medicion):
+        try:
+            yield medicion
+        finally:
+            segundos = medicion.segundos()
+            registro.observar_etapa(etapa, medicion, segundos)
+            if getattr(settings, 'PORTFOLIO_METRICAS_LOG', False):
+                logger.info(json.dumps({
+                    'etapa': etapa, 'ms': round(segundos * 1000, 2), 'consultas': medicion.consultas,
+                    'bd_ms': round(medicion.segundos_bd * 1000, 2),
+                }))
+
+
+# Opcional: se activa con PORTFOLIO_METRICAS = True y, con PORTFOLIO_METRICAS_LOG,
+# emite una línea JSON por solicitud en el logger portfolio.metricas.
+# Funciona con WSGI y ASGI: bajo ASGI no fuerza las vistas async a pasar por
+# un adaptador síncrono. Las consultas se cuentan con medir_consulta.
+class MetricasMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PORTFOLIO_METRICAS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.log = getattr(settings, 'PORTFOLIO_METRICAS_LOG', False)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        medicion = Medicion()
+        token = _actual.set(medicion)
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            _actual.reset(token)
+        return self._terminar(request, respuesta, medicion)
+
+    async def __acall__(self, request):
+        medicion = Medicion()
+        token = _actual.set(medicion)
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            _actual.reset(token)
+        return self._terminar(request, respuesta, medicion)
+
+    def _terminar(self, request, respuesta, medicion):
+        if respuesta.streaming:
+            # Las consultas y filas de una respuesta en streaming ocurren al iterarla
+            flujo = self._medir_flujo_async if respuesta.is_async else self._medir_flujo
+            respuesta.streaming_content = flujo(request, respuesta, respuesta.streaming_content, medicion)
+        else:
+            medicion.bytes = len(respuesta.content)
+            self._cerrar(request, respuesta, medicion)
+        return respuesta
+
+    def _medir_flujo(self, request, respuesta, contenido, medicion):
+        previa = _actual.get()
+        _actual.set(medicion)
+        try:
+            for trozo in contenido:
+                medicion.bytes += len(trozo)
+                yield trozo
+        finally:
+            _actual.set(previa)
+            self._cerrar(request, respuesta, medicion)
+
+    async def _medir_flujo_async(self, request, respuesta, contenido, medicion):
+        previa = _actual.get()
+        _actual.set(medicion)
+        try:
+            async for trozo in contenido:
+                medicion.bytes += len(trozo)
+                yield trozo
+        finally:
+            _actual.set(previa)
+            self._cerrar(request, respuesta, medicion)
+
+    def _cerrar(self, request, respuesta, medicion):
+        segundos = medicion.segundos()
+        match = request.resolver_match
+        vista = (match.view_name if match else None) or 'sin_ruta'
+        registro.observar_vista(vista, request.method, respuesta.status_code, medicion, segundos)
+        if self.log:
+            logger.info(json.dumps({
+                'vista': vista, 'metodo': request.method, 'ruta': request.path,
+                'estado': respuesta.status_code, 'ms': round(segundos * 1000, 2),
+                'consultas': medicion.consultas, 'bd_ms': round(medicion.segundos_bd * 1000, 2),
+                'filas': medicion.filas, 'bytes': medicion.bytes,
+            }))
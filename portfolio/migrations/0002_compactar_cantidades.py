@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+# Deja CantidadActivo como función escalón: borra las filas cuya cantidad es
+# igual a la fila anterior del mismo (portafolio, activo).
+def compactar_cantidades(apps, schema_editor):
+    CantidadActivo = apps.get_model('portfolio', 'CantidadActivo')
+    filas = CantidadActivo.objects.order_by('portafolio_id', 'activo_id', 'fecha') \
+        .values_list('id', 'portafolio_id', 'activo_id', 'cantidad')
+
+    redundantes = []
+    anterior = None
+    for id_, portafolio_id, activo_id, cantidad in filas.iterator(chunk_size=2000):
+        clave = (portafolio_id, activo_id)
+        if anterior is not None and anterior[0] == clave and anterior[1] == cantidad:
+            redundantes.append(id_)
+        anterior = (clave, cantidad)
+
+    for i in range(0, len(redundantes), 500):
+        CantidadActivo.objects.filter(id__in=redundantes[i:i + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(compactar_cantidades, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0002_compactar_cantidades'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portafolio',
+            name='version_datos',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
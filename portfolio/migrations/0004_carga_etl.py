@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0003_portafolio_version_datos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CargaEtl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('huella', models.CharField(max_length=64)),
+                ('origen', models.CharField(max_length=500)),
+                ('ultima_fecha', models.DateField(blank=True, null=True)),
+                ('completada', models.BooleanField(default=False)),
+                ('iniciada', models.DateTimeField(auto_now_add=True)),
+                ('actualizada', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Cargas ETL',
+            },
+        ),
+    ]
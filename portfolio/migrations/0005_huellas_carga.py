@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0004_carga_etl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cargaetl',
+            name='valorizada',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='HuellaFecha',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hoja', models.CharField(max_length=20)),
+                ('fecha', models.DateField()),
+                ('huella', models.CharField(max_length=32)),
+            ],
+            options={
+                'unique_together': {('hoja', 'fecha')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0005_huellas_carga'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cantidadactivo',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='pesoactivo',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='precio',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='valorportafolio',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='cantidadactivo',
+            index=models.Index(fields=['portafolio', 'fecha', 'activo', 'cantidad'], name='cantidad_pf_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pesoactivo',
+            index=models.Index(fields=['portafolio', 'fecha'], name='pesoactivo_pf_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='precio',
+            index=models.Index(fields=['fecha', 'activo', 'precio'], name='precio_fecha_activo_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+# Fila única que sube el ORM con cada escritura de Precio (models.PrecioQuerySet)
+def crear_version(apps, schema_editor):
+    VersionPrecios = apps.get_model('portfolio', 'VersionPrecios')
+    VersionPrecios.objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0006_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionPrecios',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Versión de precios',
+            },
+        ),
+        migrations.RunPython(crear_version, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from decimal import Decimal
 
 class Activo(models.Model):
@@ -17,18 +18,43 @@ class Portafolio(models.Model):
     valor_inicial = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('1000000000.00'))
     fecha_inicio = models.DateField()
     descripcion = models.TextField(blank=True, null=True)
+    version_datos = models.PositiveBigIntegerField(default=0)  # sube con cada escritura de sus series
     
     def __str__(self):
         return self.nombre
 
+# Las escrituras masivas de Precio suben VersionPrecios una vez por llamada (no
+# por fila); las de una instancia lo hacen por señal (ver apps.py)
+class PrecioQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        creados = super().bulk_create(objs, *args, **kwargs)
+        if creados:
+            subir_version_precios()
+        return creados
+
+    def update(self, **kwargs):
+        filas = super().update(**kwargs)
+        if filas:
+            subir_version_precios()
+        return filas
+
+    def delete(self):
+        resultado = super().delete()
+        if resultado[0]:
+            subir_version_precios()
+        return resultado
+
 class Precio(models.Model):
     activo = models.ForeignKey(Activo, on_delete=models.CASCADE, related_name='precios')
     fecha = models.DateField()
     precio = models.DecimalField(max_digits=12, decimal_places=4)
     
+    objects = PrecioQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('activo', 'fecha')
-        ordering = ['fecha']
+        # Rangos y fechas distintas sin leer la tabla (cubre fecha, activo y precio)
+        indexes = [models.Index(fields=['fecha', 'activo', 'precio'], name='precio_fecha_activo_idx')]
     
     def __str__(self):
         return f"{self.activo.codigo} - {self.fecha}: {self.precio}"
@@ -52,7 +78,8 @@ class CantidadActivo(models.Model):
     
     class Meta:
         unique_together = ('portafolio', 'activo', 'fecha')
-        ordering = ['fecha']
+        # Índice de cantidades de un portafolio hasta una fecha (cubre toda la fila)
+        indexes = [models.Index(fields=['portafolio', 'fecha', 'activo', 'cantidad'], name='cantidad_pf_fecha_idx')]
     
     def __str__(self):
         return f"{self.portafolio.nombre} - {self.activo.codigo} - {self.fecha}: {self.cantidad}"
@@ -64,7 +91,6 @@ class ValorPortafolio(models.Model):
     
     class Meta:
         unique_together = ('portafolio', 'fecha')
-        ordering = ['fecha']
     
     def __str__(self):
         return f"{self.portafolio.nombre} - {self.fecha}: {self.valor_total}"
@@ -78,7 +104,8 @@ class PesoActivo(models.Model):
     
     class Meta:
         unique_together = ('portafolio', 'activo', 'fecha')
-        ordering = ['fecha']
+        # Pesos de un portafolio en un rango de fechas
+        indexes = [models.Index(fields=['portafolio', 'fecha'], name='pesoactivo_pf_fecha_idx')]
     
     def __str__(self):
         return f"{self.portafolio.nombre} - {self.activo.codigo} - {self.fecha}: {self.peso}"
@@ -101,4 +128,46 @@ class Transaccion(models.Model):
         ordering = ['fecha']
     
     def __str__(self):
-        return f"{self.tipo} - {self.portafolio.nombre} - {self.activo.codigo} - {self.fecha}"
\ No newline at end of file
+        return f"{self.tipo} - {self.portafolio.nombre} - {self.activo.codigo} - {self.fecha}"
+
+class CargaEtl(models.Model):
+    huella = models.CharField(max_length=64)  # sha256 de los archivos de entrada
+    origen = models.CharField(max_length=500)
+    ultima_fecha = models.DateField(null=True, blank=True)  # último lote de precios confirmado
+    completada = models.BooleanField(default=False)
+    valorizada = models.BooleanField(default=False)  # la recarga incremental también recalculó las series
+    iniciada = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Cargas ETL"
+    
+    def __str__(self):
+        return f"{self.origen} ({self.huella[:12]}) hasta {self.ultima_fecha}"
+
+class HuellaFecha(models.Model):
+    hoja = models.CharField(max_length=20)  # 'Precios' o 'weights'
+    fecha = models.DateField()
+    huella = models.CharField(max_length=32)  # hash de las filas de esa fecha en la hoja
+    
+    class Meta:
+        unique_together = ('hoja', 'fecha')
+    
+    def __str__(self):
+        return f"{self.hoja} - {self.fecha}: {self.huella}"
+
+# Versión del contenido de Precio (una sola fila, id=1): sube con cada escritura
+# hecha por el ORM y es la firma del almacén de precios (almacen.firma_precios).
+# El SQL directo no la sube; eso lo detecta almacen.verificar_almacen.
+class VersionPrecios(models.Model):
+    version = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = "Versión de precios"
+    
+    def __str__(self):
+        return f"Precios v{self.version}"
+
+def subir_version_precios():
+    if not VersionPrecios.objects.filter(id=1).update(version=F('version') + 1):
+        VersionPrecios.objects.get_or_create(id=1, defaults={'version': 1})
\ No newline at end of file
@@ -0,0 +1,70 @@
+import numpy as np
+
+# Reducción de series para los gráficos: los rangos largos se agregan en el
+# servidor en vez de enviar (y dibujar) un punto por día.
+FRECUENCIAS = ('D', 'W', 'M')
+LUNES = np.datetime64('1970-01-05', 'D')
+
+
+# Índice del último día de cada semana (lunes a domingo), mes o trimestre presente
+# en `fechas` (los gráficos usan FRECUENCIAS; el trimestre es para rebalanceo.py)
+def fin_de_periodo(fechas, freq):
+    if freq == 'D' or len(fechas) == 0:
+        return np.arange(len(fechas))
+    if freq == 'W':
+        periodo = (fechas - LUNES).astype(np.int64) // 7
+    elif freq == 'M':
+        periodo = fechas.astype('datetime64[M]').astype(np.int64)
+    elif freq == 'Q':
+        periodo = fechas.astype('datetime64[M]').astype(np.int64) // 3
+    else:
+        raise ValueError(f'Frecuencia no soportada: {freq}')
+    return np.flatnonzero(np.r_[periodo[1:] != periodo[:-1], True])
+
+
+# Muestreo a fin de tramo: divide los índices en `n` tramos de igual tamaño y
+# se queda con el último de cada uno (siempre incluye el primero y el último)
+def fin_de_tramo(total, n):
+    if total <= n:
+        return np.arange(total)
+    finales = np.ceil(np.arange(1, n) * (total - 1) / (n - 1)).astype(np.int64)
+    return np.r_[0, finales]
+
+
+# Largest-Triangle-Three-Buckets (Steinarsson, 2013): elige `n` índices que
+# conservan la forma de la línea. Los promedios de cada tramo se calculan de una
+# vez; solo la elección del punto depende del anterior.
+def lttb(x, y, n):
+    total = len(y)
+    if n >= total or n < 3:
+        return np.arange(total)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    limites = np.floor(np.arange(n - 1) * (total - 2) / (n - 2)).astype(np.int64) + 1
+    limites[-1] = total - 1
+    largos = np.diff(limites)
+    prom_x = np.r_[np.add.reduceat(x[1:-1], limites[:-1] - 1) / largos, x[-1]]
+    prom_y = np.r_[np.add.reduceat(y[1:-1], limites[:-1] - 1) / largos, y[-1]]
+
+    elegidos = np.empty(n, dtype=np.int64)
+    elegidos[0] = a = 0
+    for k in range(n - 2):
+        i, j = limites[k], limites[k + 1]
+        area = np.abs(
+            (x[a] - prom_x[k + 1]) * (y[i:j] - y[a]) - (x[a] - x[i:j]) * (prom_y[k + 1] - y[a])
+        )
+        a = i + int(area.argmax())
+        elegidos[k + 1] = a
+    elegidos[-1] = total - 1
+    return elegidos
+
+
+# Índices a enviar de la línea y de los pesos según `freq` y `max_points`
+def reducir(fechas_linea, valores, fechas_pesos, freq='D', max_points=None):
+    idx_linea = fin_de_periodo(fechas_linea, freq)
+    idx_pesos = fin_de_periodo(fechas_pesos, freq)
+    if max_points is not None:
+        x = fechas_linea[idx_linea].astype(np.int64)
+        idx_linea = idx_linea[lttb(x, valores[idx_linea], max_points)]
+        idx_pesos = idx_pesos[fin_de_tramo(len(idx_pesos), max_points)]
+    return idx_linea, idx_pesos
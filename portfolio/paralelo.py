@@ -0,0 +1,35 @@
+import django
+from concurrent.futures import ProcessPoolExecutor
+
+# Los trabajadores no abren conexiones a la BD: reciben la matriz de precios una
+# sola vez al iniciar y las filas de cantidades de cada portafolio, y devuelven
+# las filas ya formateadas. Los módulos con modelos se importan después de django.setup() para
+# que también funcione con los métodos de arranque spawn/forkserver.
+_precios = None
+
+
+def _iniciar(precios):
+    global _precios
+    django.setup()
+    _precios = precios
+
+
+def _calcular(tarea):
+    from .cantidades import IndiceCantidades
+    from .valuacion import calcular_portafolio, filas_series
+    portafolio_id, filas = tarea
+    series = calcular_portafolio(IndiceCantidades(filas), _precios)
+    if series is None:
+        return portafolio_id, None
+    return portafolio_id, filas_series(portafolio_id, _precios[0], *series)
+
+
+# Reparte los portafolios entre `trabajadores` procesos y entrega (id, filas) en
+# orden a medida que terminan; quien llama es el único que escribe en la BD.
+def calcular_en_paralelo(portafolio_ids, precios, trabajadores):
+    from .cantidades import IndiceCantidades
+    filas = IndiceCantidades.filas_por_portafolio(portafolio_ids, fecha_hasta=precios[0][-1])
+    tareas = [(pid, filas[pid]) for pid in portafolio_ids]
+    lote = max(1, len(tareas) // (trabajadores * 4))
+    with ProcessPoolExecutor(max_workers=trabajadores, initializer=_iniciar, initargs=(precios,)) as pool:
+        yield from pool.map(_calcular, tareas, chunksize=lote)
@@ -0,0 +1,24 @@
+from django.conf import settings
+
+# Cambia el modo del archivo de la BD (persistente), por eso va aparte de
+# PORTFOLIO_SQLITE_PRAGMAS y solo se aplica con PORTFOLIO_SQLITE_WAL
+PRAGMAS_WAL = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+
+# Perfil de rendimiento de SQLite: los PRAGMA de PORTFOLIO_SQLITE_PRAGMAS se
+# aplican a cada conexión nueva (señal connection_created). Se ejecutan sobre la
+# conexión DB-API para no aparecer en las mediciones de consultas.
+def aplicar_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'PORTFOLIO_SQLITE_PRAGMAS', None) or {})
+    if getattr(settings, 'PORTFOLIO_SQLITE_WAL', False):
+        pragmas = {**PRAGMAS_WAL, **pragmas}
+    for nombre, valor in pragmas.items():
+        connection.connection.execute(f'PRAGMA {nombre} = {valor}')
+
+
+# Valores vigentes en la conexión, para verificar el perfil
+def pragmas_actuales(connection, nombres=None):
+    connection.ensure_connection()
+    nombres = nombres or list(getattr(settings, 'PORTFOLIO_SQLITE_PRAGMAS', None) or {})
+    return {n: connection.connection.execute(f'PRAGMA {n}').fetchone()[0] for n in nombres}
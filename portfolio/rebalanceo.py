@@ -0,0 +1,139 @@
+import numpy as np
+from decimal import Decimal
+
+from .almacen import matriz_precios
+from .analitica import max_drawdown
+from .cantidades import indice_cantidades
+from .models import Activo, PesoPortafolio, Precio
+from .muestreo import fin_de_periodo
+from .simulacion import simular
+from .transacciones import ErrorLote, procesar_lote
+from .valuacion import seleccionar_columnas
+
+FRECUENCIAS_REBALANCEO = ('M', 'Q')
+TOLERANCIA_SUMA = 1e-4
+# Diferencias menores no generan orden (restos del redondeo de cantidades a 4 decimales)
+MONTO_MINIMO = 1.0
+
+
+# Pesos objetivo {codigo: peso} como (activo_ids, codigos, w); sin `pesos` se
+# usan los PesoPortafolio.peso_inicial del portafolio. Lanza ErrorLote.
+def pesos_objetivo(portafolio, pesos=None):
+    if pesos is None:
+        filas = list(PesoPortafolio.objects.filter(portafolio=portafolio)
+                     .order_by('activo_id').values_list('activo_id', 'activo__codigo', 'peso_inicial'))
+        if not filas:
+            raise ErrorLote([{'error': 'El portafolio no tiene pesos iniciales; envíe pesos'}])
+    else:
+        ids = dict(Activo.objects.filter(codigo__in=list(pesos)).values_list('codigo', 'id'))
+        errores = [{'activo': c, 'error': 'Activo no encontrado'} for c in pesos if c not in ids]
+        if errores:
+            raise ErrorLote(errores)
+        filas = sorted((ids[c], c, w) for c, w in pesos.items())
+
+    activo_ids = [a for a, _, _ in filas]
+    codigos = [c for _, c, _ in filas]
+    try:
+        w = np.array([float(p) for _, _, p in filas])
+    except (TypeError, ValueError):
+        raise ErrorLote([{'error': 'Pesos inválidos'}])
+    if (w < 0).any() or not np.isfinite(w).all() or abs(w.sum() - 1) > TOLERANCIA_SUMA:
+        raise ErrorLote([{'error': f'Los pesos deben ser no negativos y sumar 1 (suman {w.sum():.6f})'}])
+    return activo_ids, codigos, w
+
+
+# Órdenes (formato de procesar_lote) que llevan el portafolio a los pesos
+# objetivo en `fecha`: x = c * p, V = Σx, monto_i = w_i * V - x_i. Los activos
+# con tenencia que no están en el objetivo se venden completos.
+def ordenes_rebalanceo(portafolio, fecha, pesos=None):
+    objetivo_ids, _, w_objetivo = pesos_objetivo(portafolio, pesos)
+    indice = indice_cantidades(portafolio)
+    tenidos = [a for a in indice.activos() if indice.cantidad_al(a, fecha, Decimal('0')) != 0]
+    activo_ids = sorted(set(objetivo_ids) | set(tenidos))
+    codigos = dict(Activo.objects.filter(id__in=activo_ids).values_list('id', 'codigo'))
+    precios = dict(Precio.objects.filter(activo_id__in=activo_ids, fecha=fecha).values_list('activo_id', 'precio'))
+
+    w = np.zeros(len(activo_ids))
+    w[[activo_ids.index(a) for a in objetivo_ids]] = w_objetivo
+    c = np.nan_to_num(indice.matriz([fecha], activo_ids)[0])
+    p = np.array([float(precios[a]) if precios.get(a) else np.nan for a in activo_ids])
+    sin_precio = np.isnan(p) & ((c != 0) | (w > 0))
+    if sin_precio.any():
+        raise ErrorLote([
+            {'activo': codigos[activo_ids[k]], 'error': f'No hay precio para {fecha}'}
+            for k in np.flatnonzero(sin_precio).tolist()
+        ])
+
+    x = np.nan_to_num(c * p)
+    montos = w * x.sum() - x
+    return [
+        {
+            'activo_codigo': codigos[a],
+            'tipo': 'COMPRA' if m > 0 else 'VENTA',
+            'monto': f'{abs(m):.2f}',
+        }
+        for a, m in zip(activo_ids, montos.tolist()) if abs(m) >= MONTO_MINIMO
+    ]
+
+
+# Genera las órdenes y las aplica como un lote atómico (una revalorización
+# incremental), o solo las simula en memoria con `simulado=True`
+def rebalancear(portafolio, fecha, pesos=None, simulado=False):
+    ordenes = ordenes_rebalanceo(portafolio, fecha, pesos)
+    if simulado:
+        return ordenes, simular(portafolio, fecha, ordenes)
+    return ordenes, procesar_lote(portafolio, fecha, ordenes) if ordenes else []
+
+
+# Backtest de rebalanceo periódico sobre toda la matriz de precios, sin bucles
+# por fecha: entre rebalanceos las cantidades son fijas, así que en el tramo k
+# V_t = V_rk * Σ_i w_i p_i,t / p_i,rk, y V_rk es el producto de los
+# crecimientos de los tramos anteriores. Se rebalancea el último día de cada
+# mes o trimestre y se compara contra comprar y mantener los mismos pesos.
+def backtest(portafolio, freq='M', pesos=None, fecha_inicio=None, fecha_fin=None):
+    if freq not in FRECUENCIAS_REBALANCEO:
+        raise ValueError(f'Frecuencia no soportada: {freq}')
+    activo_ids, codigos, w = pesos_objetivo(portafolio, pesos)
+    fechas, ids_matriz, matriz = matriz_precios(fecha_inicio, fecha_fin, activo_ids)
+    # Solo fechas con precio para todos los activos del objetivo
+    p = seleccionar_columnas(matriz, ids_matriz, activo_ids)
+    completas = ~np.isnan(p).any(axis=1)
+    fechas = np.array(fechas, dtype='datetime64[D]')[completas]
+    p = p[completas]
+    v0 = float(portafolio.valor_inicial)
+    if len(fechas) == 0:
+        return {'portafolio': portafolio.nombre, 'frecuencia': freq, 'activos': codigos, 'fechas': [],
+                'valor_rebalanceado': [], 'valor_sin_rebalanceo': [], 'rebalanceos': [], 'resumen': None}
+
+    inicios = np.unique(np.r_[0, fin_de_periodo(fechas, freq)[:-1]])
+    tramo = np.searchsorted(inicios, np.arange(len(fechas)), side='right') - 1
+    crecimiento = (p / p[inicios[tramo]]) @ w
+    relativos = p[inicios[1:]] / p[inicios[:-1]]
+    por_tramo = relativos @ w
+    rebalanceado = v0 * np.r_[1.0, np.cumprod(por_tramo)][tramo] * crecimiento
+    sin_rebalanceo = v0 * (p / p[0]) @ w
+    # Rotación de cada rebalanceo: mitad de Σ|w derivado - w objetivo|
+    derivados = w * relativos / por_tramo[:, None]
+    rotacion = 0.5 * np.abs(derivados - w).sum(axis=1)
+
+    def resumen(valores):
+        caida, pico, valle = max_drawdown(valores)
+        return {
+            'retorno_total': round(float(valores[-1] / valores[0] - 1), 8),
+            'max_drawdown': round(caida, 8),
+            'pico': str(fechas[pico]), 'valle': str(fechas[valle]),
+        }
+
+    return {
+        'portafolio': portafolio.nombre,
+        'frecuencia': freq,
+        'activos': codigos,
+        'fechas': [str(f) for f in fechas.tolist()],
+        'valor_rebalanceado': np.round(rebalanceado, 2).tolist(),
+        'valor_sin_rebalanceo': np.round(sin_rebalanceo, 2).tolist(),
+        'rebalanceos': [
+            {'fecha': str(fechas[i]), 'rotacion': round(r, 6)}
+            for i, r in zip(inicios[1:].tolist(), rotacion.tolist())
+        ],
+        'resumen': {'rebalanceado': resumen(rebalanceado), 'sin_rebalanceo': resumen(sin_rebalanceo)},
+    }
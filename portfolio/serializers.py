@@ -1,6 +1,18 @@
+from collections.abc import Mapping
 from rest_framework import serializers
+from django.db.models import F
 from .models import Activo, Portafolio, PesoActivo, ValorPortafolio
 
+def anotar_pesos(queryset):
+    return queryset.annotate(
+        activo_codigo=F('activo__codigo'),
+        activo_nombre=F('activo__nombre'),
+        portafolio_nombre=F('portafolio__nombre'),
+    )
+
+def anotar_valores(queryset):
+    return queryset.annotate(portafolio_nombre=F('portafolio__nombre'))
+
 class ActivoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Activo
@@ -11,10 +23,35 @@ class PortafolioSerializer(serializers.ModelSerializer):
         model = Portafolio
         fields = ['id', 'nombre', 'valor_inicial', 'fecha_inicio', 'descripcion']
 
+# Campo leído de una anotación del queryset (ver anotar_pesos / anotar_valores)
+# para no consultar por fila. Una instancia sin la anotación sigue la relación
+# `origen` (una consulta por fila); un dict de .values() sin la clave falla en
+# vez de omitir el campo en silencio.
+class CampoAnotado(serializers.CharField):
+    def __init__(self, origen, **kwargs):
+        self.origen = origen
+        super().__init__(read_only=True, **kwargs)
+
+    def get_attribute(self, instance):
+        if isinstance(instance, Mapping):
+            if self.field_name in instance:
+                return instance[self.field_name]
+            if self.origen in instance:
+                return instance[self.origen]
+            raise KeyError(
+                f"Falta '{self.field_name}' en la fila; anote el queryset con anotar_pesos/anotar_valores"
+            )
+        if hasattr(instance, self.field_name):
+            return getattr(instance, self.field_name)
+        valor = instance
+        for parte in self.origen.split('__'):
+            valor = getattr(valor, parte)
+        return valor
+
 class PesoActivoSerializer(serializers.ModelSerializer):
-    activo_codigo = serializers.CharField(source='activo.codigo', read_only=True)
-    activo_nombre = serializers.CharField(source='activo.nombre', read_only=True)
-    portafolio_nombre = serializers.CharField(source='portafolio.nombre', read_only=True)
+    activo_codigo = CampoAnotado('activo__codigo')
+    activo_nombre = CampoAnotado('activo__nombre')
+    portafolio_nombre = CampoAnotado('portafolio__nombre')
     
     class Meta:
         model = PesoActivo
@@ -22,7 +59,7 @@ class PesoActivoSerializer(serializers.ModelSerializer):
                  'fecha', 'peso', 'valor_activo']
 
 class ValorPortafolioSerializer(serializers.ModelSerializer):
-    portafolio_nombre = serializers.CharField(source='portafolio.nombre', read_only=True)
+    portafolio_nombre = CampoAnotado('portafolio__nombre')
     
     class Meta:
         model = ValorPortafolio
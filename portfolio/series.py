@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import time
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .cache import obtener
+from .condicional import olvidar_versiones
+from .models import Portafolio, PesoActivo, ValorPortafolio
+
+
+# Series de un portafolio en arreglos contiguos ordenados por fecha:
+# V_t (fechas_valor, valores) y w_i,t (fechas_peso x activos).
+class SeriePortafolio:
+    def __init__(self, fechas_valor, valores, fechas_peso, activos, pesos, presentes):
+        self.fechas_valor = fechas_valor
+        self.valores = valores
+        self.fechas_peso = fechas_peso
+        self.activos = activos
+        self.pesos = pesos
+        self.presentes = presentes
+
+    @classmethod
+    def cargar(cls, portafolio_id):
+        filas_v = list(ValorPortafolio.objects.filter(portafolio_id=portafolio_id)
+                       .order_by('fecha').values_list('fecha', 'valor_total'))
+        fechas_valor = np.array([f for f, _ in filas_v], dtype='datetime64[D]')
+        valores = np.array([v for _, v in filas_v], dtype=float)
+
+        filas_p = list(PesoActivo.objects.filter(portafolio_id=portafolio_id)
+                       .values_list('fecha', 'activo__codigo', 'peso'))
+        if not filas_p:
+            vacio = np.empty((0, 0))
+            return cls(fechas_valor, valores, np.array([], dtype='datetime64[D]'), [], vacio, vacio.astype(bool))
+        df = pd.DataFrame(filas_p, columns=['fecha', 'codigo', 'peso'])
+        df['peso'] = df['peso'].astype(float)
+        tabla = df.pivot(index='fecha', columns='codigo', values='peso').sort_index()
+        tabla = tabla.reindex(columns=sorted(tabla.columns))
+        pesos = tabla.to_numpy(dtype=float, copy=True)
+        presentes = ~np.isnan(pesos)
+        pesos[~presentes] = 0.0
+        fechas_peso = np.array(list(tabla.index), dtype='datetime64[D]')
+        return cls(fechas_valor, valores, fechas_peso, list(tabla.columns), pesos, presentes)
+
+    @staticmethod
+    def _tramo(fechas, fecha_inicio, fecha_fin):
+        i = int(np.searchsorted(fechas, np.datetime64(fecha_inicio, 'D'), side='left'))
+        j = int(np.searchsorted(fechas, np.datetime64(fecha_fin, 'D'), side='right'))
+        return i, j
+
+    def linea(self, fecha_inicio, fecha_fin):
+        i, j = self._tramo(self.fechas_valor, fecha_inicio, fecha_fin)
+        return self.fechas_valor[i:j], self.valores[i:j]
+
+    # Pesos del rango; los activos van en el orden en que aparecen por primera vez
+    # dentro del rango y, a igual fecha, por código.
+    def pesos_rango(self, fecha_inicio, fecha_fin):
+        i, j = self._tramo(self.fechas_peso, fecha_inicio, fecha_fin)
+        presentes = self.presentes[i:j]
+        if i == j:
+            return self.fechas_peso[i:j], [], self.pesos[i:j][:, :0]
+        con_datos = np.nonzero(presentes.any(axis=0))[0]
+        primera = presentes[:, con_datos].argmax(axis=0)
+        orden = [int(con_datos[k]) for k in np.lexsort((con_datos, primera))]
+        return self.fechas_peso[i:j], [self.activos[k] for k in orden], self.pesos[i:j][:, orden]
+
+
+# Serie en caché del portafolio; se recarga cuando cambia su version_datos
+def obtener_serie(portafolio):
+    return obtener('serie', portafolio, lambda: SeriePortafolio.cargar(portafolio.id))
+
+
+# Llamar tras escribir ValorPortafolio/PesoActivo/CantidadActivo: las entradas
+# del cache (ver cache.obtener) quedan en una versión vieja y se olvidan los
+# ETags locales. La versión sigue al reloj (en µs) para que un portafolio
+# recreado con el mismo id no coincida con una entrada antigua.
+def marcar_cambio(portafolio_ids):
+    portafolio_ids = list(portafolio_ids)
+    ahora = time.time_ns() // 1000
+    Portafolio.objects.filter(id__in=portafolio_ids).update(
+        version_datos=Greatest(F('version_datos') + 1, Value(ahora))
+    )
+    olvidar_versiones()
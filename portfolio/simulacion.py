@@ -0,0 +1,58 @@
+import numpy as np
+
+from .almacen import matriz_precios
+from .cantidades import indice_cantidades
+from .models import Activo
+from .transacciones import deltas_por_activo, preparar_lote
+from .valuacion import calcular_portafolio
+
+
+# Redondeo de ValorPortafolio (ver valuacion.filas_series), para que la serie
+# simulada coincida con la que se guardaría al aplicar el lote
+def _centavos(totales):
+    return [float(f'{v:.2f}') for v in totales.tolist()]
+
+
+# Simulación de un lote de transacciones sin escribir en la BD: valida el lote
+# igual que procesar_lote (lanza ErrorLote), aplica los deltas sobre una copia
+# del índice de cantidades en caché y valoriza en memoria con la matriz de
+# precios desde `fecha`, antes y después del lote. Cada llamada trabaja sobre
+# su propia copia, así que las simulaciones concurrentes no se pisan.
+def simular(portafolio, fecha, transacciones, fecha_fin=None):
+    ordenes = preparar_lote(fecha, transacciones)
+    actual = indice_cantidades(portafolio)
+    simulado = actual.copia()
+    cambios = actual.cambios(fecha, deltas_por_activo(ordenes))
+    simulado.aplicar_cambios(fecha, cambios)
+
+    precios = matriz_precios(fecha_desde=fecha, fecha_hasta=fecha_fin)
+    fechas = precios[0]
+    antes = calcular_portafolio(actual, precios)
+    despues = calcular_portafolio(simulado, precios)
+
+    codigos = dict(Activo.objects.filter(id__in=simulado.activos()).values_list('id', 'codigo'))
+    if despues is not None:
+        activo_ids, valores, totales, pesos = despues
+        # Columnas sin valor en todo el rango (activo sin precio o sin cantidad) se omiten
+        con_datos = ~np.isnan(valores).all(axis=0)
+        pesos_simulados = {
+            codigos[a]: np.round(pesos[:, k], 6).tolist()
+            for k, a in enumerate(activo_ids) if con_datos[k]
+        }
+    else:
+        totales = np.zeros(len(fechas))
+        pesos_simulados = {}
+    totales_antes = antes[2] if antes is not None else np.zeros(len(fechas))
+
+    return {
+        'portafolio': portafolio.nombre,
+        'fecha': str(fecha),
+        'cambios': [
+            {'activo': codigos[a], 'cantidad_anterior': str(anterior), 'nueva_cantidad': str(nueva)}
+            for a, (anterior, nueva) in cambios.items()
+        ],
+        'fechas': [str(f) for f in fechas],
+        'valor_actual': _centavos(totales_antes),
+        'valor_simulado': _centavos(totales),
+        'pesos_simulados': pesos_simulados,
+    }
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from datetime import date
+from decimal import Decimal
+
+from .models import Activo, Portafolio, PesoPortafolio
+
+FECHA_INICIO = date(2022, 2, 15)
+
+
+def codigos_activos(n_activos):
+    return [f'ACT{i:03d}' for i in range(n_activos)]
+
+
+# Libro con el mismo formato que datos.xlsx (hojas weights y Precios) con
+# precios de un paseo aleatorio geométrico y pesos iniciales aleatorios.
+def generar_libro(path, n_activos=17, n_dias=365, fecha_inicio=FECHA_INICIO, semilla=0):
+    rng = np.random.default_rng(semilla)
+    codigos = codigos_activos(n_activos)
+    retornos = rng.normal(0.0003, 0.01, size=(n_dias, n_activos))
+    retornos[0] = 0
+    precios = np.exp(np.cumsum(retornos, axis=0)) * rng.uniform(10, 10000, n_activos)
+
+    df_p = pd.DataFrame(np.round(precios, 2), columns=codigos)
+    df_p.insert(0, 'Dates', pd.date_range(fecha_inicio, periods=n_dias, freq='D'))
+
+    pesos = rng.dirichlet(np.ones(n_activos), size=2)
+    df_w = pd.DataFrame({
+        'Fecha': pd.Timestamp(fecha_inicio),
+        'activos': codigos,
+        'portafolio 1': np.round(pesos[0], 6),
+        'portafolio 2': np.round(pesos[1], 6),
+    })
+
+    with pd.ExcelWriter(path) as writer:
+        df_w.to_excel(writer, sheet_name='weights', index=False)
+        df_p.to_excel(writer, sheet_name='Precios', index=False)
+    return path
+
+
+# Portafolios adicionales a los dos del libro, con pesos aleatorios sobre los activos cargados
+def crear_portafolios(n_portafolios, fecha_inicio=FECHA_INICIO, semilla=0):
+    rng = np.random.default_rng(semilla + 1)
+    activos = list(Activo.objects.order_by('codigo'))
+    creados = []
+    for k in range(n_portafolios):
+        pf, _ = Portafolio.objects.get_or_create(
+            nombre=f'Sintético {k + 1}',
+            defaults={'fecha_inicio': fecha_inicio, 'descripcion': 'Portafolio sintético de benchmark'}
+        )
+        pesos = rng.dirichlet(np.ones(len(activos)))
+        PesoPortafolio.objects.bulk_create([
+            PesoPortafolio(portafolio=pf, activo=a, peso_inicial=Decimal(f"{w:.6f}"))
+            for a, w in zip(activos, pesos)
+        ], update_conflicts=True, unique_fields=['portafolio', 'activo'], update_fields=['peso_inicial'])
+        creados.append(pf)
+    return creados
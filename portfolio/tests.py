@@ -1,3 +1,1294 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import threading
+from unittest import mock, skipUnless
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from pathlib import Path
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+import numpy as np
+import pandas as pd
+from django.apps import apps as django_apps
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .almacen import (
+    abrir_almacen, firma_precios, matriz_desde_bd, matriz_precios, precargar_almacen, reconstruir_almacen,
+    verificar_almacen,
+)
+from .cantidades import IndiceCantidades, registrar_cambio_cantidad
+from .condicional import olvidar_versiones
+from . import almacen, analitica, etl
+from .etl import (
+    a_numero, calcular_valores_historicos, cargar_datos_excel, cargar_datos_tablas, leer_libro,
+    recargar_incremental
+)
+from .metricas import MetricasMiddleware, exportar_etl, medir_etapa, registro
+from .muestreo import lttb
+from .perfil_bd import pragmas_actuales
+from .models import (
+    Activo, CantidadActivo, CargaEtl, HuellaFecha, PesoActivo, PesoPortafolio, Portafolio, Precio, Transaccion, ValorPortafolio,
+)
+from .serializers import PesoActivoSerializer, ValorPortafolioSerializer, anotar_pesos
+from .management.commands import bench
+from .sintetico import codigos_activos, crear_portafolios as crear_portafolios_sinteticos, generar_libro
+from .valuacion import valorizar_portafolio
+
+INICIO = date(2022, 1, 3)
+
+
+def crear_portafolios(n_activos=3, n_portafolios=2):
+    activos = [Activo.objects.create(codigo=f'A{i}', nombre=f'Activo {i}') for i in range(n_activos)]
+    portafolios = []
+    for k in range(n_portafolios):
+        pf = Portafolio.objects.create(nombre=f'Portafolio {k}', fecha_inicio=INICIO)
+        CantidadActivo.objects.bulk_create([
+            CantidadActivo(portafolio=pf, activo=a, fecha=INICIO, cantidad=Decimal('10'))
+            for a in activos
+        ])
+        portafolios.append(pf)
+    return activos, portafolios
+
+
+def agregar_precios(activos, portafolios, desde, n_fechas):
+    Precio.objects.bulk_create([
+        Precio(activo=a, fecha=INICIO + timedelta(days=d), precio=Decimal(100 + i + d))
+        for d in range(desde, desde + n_fechas) for i, a in enumerate(activos)
+    ])
+    for pf in portafolios:
+        valorizar_portafolio(pf.id)
+
+
+def volcar_series():
+    return (
+        list(ValorPortafolio.objects.order_by('portafolio_id', 'fecha').values_list('portafolio_id', 'fecha', 'valor_total')),
+        list(PesoActivo.objects.order_by('portafolio_id', 'fecha', 'activo_id').values_list(
+            'portafolio_id', 'fecha', 'activo_id', 'peso', 'valor_activo')),
+    )
+
+
+class ConsultasPorEndpointTests(TestCase):
+    # El número de consultas de los endpoints de lectura no puede crecer con las filas devueltas
+    RANGO = {'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31'}
+
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios()
+
+    def consultas(self, nombre, params):
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get(reverse(nombre), params)
+            contenido = b''.join(respuesta.streaming_content) if respuesta.streaming else respuesta.content
+        self.assertEqual(respuesta.status_code, 200)
+        return len(ctx), len(contenido)
+
+    def assertConsultasConstantes(self, nombre, params=None):
+        params = params or {}
+        agregar_precios(self.activos, self.portafolios, 0, 5)
+        consultas_pocas, bytes_pocas = self.consultas(nombre, params)
+        agregar_precios(self.activos, self.portafolios, 5, 60)
+        consultas_muchas, bytes_muchas = self.consultas(nombre, params)
+        self.assertEqual(consultas_pocas, consultas_muchas)
+        return bytes_pocas, bytes_muchas
+
+    def test_lista_portafolios(self):
+        self.assertConsultasConstantes('portafolio-list')
+
+    def test_datos_portafolio(self):
+        pocas, muchas = self.assertConsultasConstantes('datos-portafolio', self.RANGO)
+        self.assertGreater(muchas, pocas)
+
+    def test_exportar_ndjson(self):
+        pocas, muchas = self.assertConsultasConstantes('exportar-datos-portafolio', self.RANGO)
+        self.assertGreater(muchas, pocas)
+
+    def test_exportar_csv(self):
+        params = dict(self.RANGO, formato='csv')
+        pocas, muchas = self.assertConsultasConstantes('exportar-datos-portafolio', params)
+        self.assertGreater(muchas, pocas)
+
+    def exportar(self, **params):
+        agregar_precios(self.activos, self.portafolios, 0, 1)
+        pf = self.portafolios[0]
+        respuesta = self.client.get(reverse('exportar-datos-portafolio'), dict(self.RANGO, portafolio_id=pf.id, **params))
+        self.assertEqual(respuesta.status_code, 200)
+        return pf, respuesta, b''.join(respuesta.streaming_content).decode('utf-8')
+
+    def test_exportar_ndjson_contenido(self):
+        pf, respuesta, cuerpo = self.exportar()
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual(
+            respuesta['Content-Disposition'], 'attachment; filename="portafolios_2022-01-01_2022-12-31.ndjson"'
+        )
+        self.assertTrue(cuerpo.endswith('\n'))
+        base = {'portafolio_id': pf.id, 'portafolio': 'Portafolio 0', 'fecha': '2022-01-03'}
+        # x = 10 * (100 + i); V = 3030; w = x / V
+        self.assertEqual([json.loads(linea) for linea in cuerpo.splitlines()], [
+            dict(base, tipo='valor', valor_total='3030.00'),
+            dict(base, tipo='peso', activo_codigo='A0', peso='0.330033', valor_activo='1000.00'),
+            dict(base, tipo='peso', activo_codigo='A1', peso='0.333333', valor_activo='1010.00'),
+            dict(base, tipo='peso', activo_codigo='A2', peso='0.336634', valor_activo='1020.00'),
+        ])
+
+    def test_exportar_csv_contenido(self):
+        pf, respuesta, cuerpo = self.exportar(formato='csv')
+        self.assertEqual(respuesta['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            respuesta['Content-Disposition'], 'attachment; filename="portafolios_2022-01-01_2022-12-31.csv"'
+        )
+        self.assertEqual(cuerpo.split('\r\n'), [
+            'tipo,portafolio_id,portafolio,fecha,activo_codigo,peso,valor_activo,valor_total',
+            f'valor,{pf.id},Portafolio 0,2022-01-03,,,,3030.00',
+            f'peso,{pf.id},Portafolio 0,2022-01-03,A0,0.330033,1000.00,',
+            f'peso,{pf.id},Portafolio 0,2022-01-03,A1,0.333333,1010.00,',
+            f'peso,{pf.id},Portafolio 0,2022-01-03,A2,0.336634,1020.00,',
+            '',
+        ])
+
+    def test_datos_graficos(self):
+        params = dict(self.RANGO, portafolio_id=self.portafolios[0].id)
+        pocas, muchas = self.assertConsultasConstantes('datos-graficos', params)
+        self.assertGreater(muchas, pocas)
+
+    def test_datos_portafolio_async(self):
+        pocas, muchas = self.assertConsultasConstantes('datos-portafolio-async', self.RANGO)
+        self.assertGreater(muchas, pocas)
+
+    def test_datos_graficos_async(self):
+        params = dict(self.RANGO, portafolio_id=self.portafolios[0].id)
+        pocas, muchas = self.assertConsultasConstantes('datos-graficos-async', params)
+        self.assertGreater(muchas, pocas)
+
+    def test_comparar_portafolios(self):
+        params = dict(self.RANGO, portafolio_ids=','.join(str(p.id) for p in self.portafolios))
+        pocas, muchas = self.assertConsultasConstantes('comparar-portafolios', params)
+        self.assertGreater(muchas, pocas)
+
+    def test_analitica(self):
+        params = dict(self.RANGO, portafolio_id=self.portafolios[0].id, referencia_id=self.portafolios[1].id)
+        pocas, muchas = self.assertConsultasConstantes('analitica', params)
+        self.assertGreater(muchas, pocas)
+
+    def test_backtest_rebalanceo(self):
+        PesoPortafolio.objects.bulk_create([
+            PesoPortafolio(portafolio=self.portafolios[0], activo=a, peso_inicial=Decimal(w))
+            for a, w in zip(self.activos, ['0.5', '0.25', '0.25'])
+        ])
+        params = {'portafolio_id': self.portafolios[0].id, 'freq': 'M'}
+        pocas, muchas = self.assertConsultasConstantes('backtest-rebalanceo', params)
+        self.assertGreater(muchas, pocas)
+
+    def test_serializadores_sin_anotaciones(self):
+        agregar_precios(self.activos, self.portafolios, 0, 1)
+        peso = PesoActivo.objects.first()
+        # Sin anotación se sigue la relación
+        self.assertEqual(PesoActivoSerializer(peso).data['activo_codigo'], peso.activo.codigo)
+        self.assertEqual(PesoActivoSerializer(anotar_pesos(PesoActivo.objects.all()).first()).data['activo_codigo'],
+                         peso.activo.codigo)
+        # Un dict de .values() sin la clave falla en vez de omitir el campo
+        with self.assertRaisesMessage(KeyError, 'portafolio_nombre'):
+            ValorPortafolioSerializer(ValorPortafolio.objects.values('id', 'fecha', 'valor_total').first()).data
+
+
+class MuestreoGraficosTests(TestCase):
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios(n_portafolios=1)
+        agregar_precios(self.activos, self.portafolios, 0, 120)
+
+    def graficos(self, **params):
+        params = dict(fecha_inicio='2022-01-01', fecha_fin='2022-12-31', portafolio_id=self.portafolios[0].id, **params)
+        return self.client.get(reverse('datos-graficos'), params)
+
+    def test_max_points_y_freq(self):
+        completo = self.graficos().json()
+        reducido = self.graficos(max_points=20).json()
+        self.assertEqual(len(reducido['datos_linea']), 20)
+        self.assertLessEqual(len(reducido['datos_stacked']), 20)
+        for clave in ('datos_linea', 'datos_stacked'):
+            self.assertEqual(reducido[clave][0], completo[clave][0])
+            self.assertEqual(reducido[clave][-1], completo[clave][-1])
+            self.assertTrue(all(p in completo[clave] for p in reducido[clave]))
+
+        mensual = self.graficos(freq='M').json()
+        self.assertEqual([p['fecha'] for p in mensual['datos_linea']],
+                         ['2022-01-31', '2022-02-28', '2022-03-31', '2022-04-30', '2022-05-02'])
+        self.assertEqual(self.graficos(freq='X').status_code, 400)
+        self.assertEqual(self.graficos(max_points=2).status_code, 400)
+
+    def test_lttb_conserva_picos(self):
+        y = np.zeros(1000)
+        y[437] = 5.0
+        y[801] = -3.0
+        elegidos = lttb(np.arange(1000), y, 12)
+        self.assertEqual(len(elegidos), 12)
+        self.assertIn(437, elegidos)
+        self.assertIn(801, elegidos)
+        self.assertTrue(np.all(np.diff(elegidos) > 0))
+
+
+class GetCondicionalTests(TestCase):
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios()
+        agregar_precios(self.activos, self.portafolios, 0, 5)
+
+    def test_304_sin_consultas_y_etag_nuevo_tras_escribir(self):
+        params = {'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31', 'portafolio_id': self.portafolios[0].id}
+        for nombre in ('portafolio-list', 'datos-portafolio', 'datos-graficos'):
+            url = reverse(nombre)
+            respuesta = self.client.get(url, params)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertIn('public', respuesta['Cache-Control'])
+            self.assertTrue(respuesta.has_header('Last-Modified'))
+            with self.assertNumQueries(0):
+                condicional = self.client.get(url, params, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+            self.assertEqual(condicional.status_code, 304)
+
+            agregar_precios(self.activos, self.portafolios, len(nombre) * 10, 1)
+            nueva = self.client.get(url, params, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+            self.assertEqual(nueva.status_code, 200)
+            self.assertNotEqual(nueva['ETag'], respuesta['ETag'])
+
+    def test_editar_portafolio_cambia_etag(self):
+        url = reverse('portafolio-list')
+        etag = self.client.get(url)['ETag']
+        Portafolio.objects.filter(id=self.portafolios[1].id).update(descripcion='x')
+        olvidar_versiones()
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+        self.portafolios[0].nombre = 'Renombrado'
+        self.portafolios[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+    def assertEtagCambia(self, url, params, escribir):
+        respuesta = self.client.get(url, params)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(respuesta.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+        escribir()
+        nueva = self.client.get(url, params, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(nueva.status_code, 200)
+        self.assertNotEqual(nueva.content, respuesta.content)
+        self.assertNotEqual(nueva['ETag'], respuesta['ETag'])
+
+    def editar_precio(self, dias, precio):
+        fila = Precio.objects.get(activo=self.activos[0], fecha=INICIO + timedelta(days=dias))
+        fila.precio = Decimal(precio)
+        fila.save()
+
+    # Vistas calculadas en vivo desde Precio/PesoPortafolio, que no suben version_datos
+    def test_etag_de_backtest_sigue_precios_y_pesos(self):
+        PesoPortafolio.objects.bulk_create([
+            PesoPortafolio(portafolio=self.portafolios[0], activo=a, peso_inicial=Decimal(w))
+            for a, w in zip(self.activos, ('0.5', '0.25', '0.25'))
+        ])
+        url, params = reverse('backtest-rebalanceo'), {'portafolio_id': self.portafolios[0].id}
+        self.assertEtagCambia(url, params, lambda: self.editar_precio(4, '150'))
+        self.assertEtagCambia(url, params, lambda: PesoPortafolio.objects.filter(
+            portafolio=self.portafolios[0]).update(peso_inicial=Decimal('1') / 3))
+
+    def test_etag_de_analitica_sigue_precios(self):
+        params = {'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31', 'portafolio_id': self.portafolios[0].id}
+        self.assertEtagCambia(reverse('analitica'), params, lambda: self.editar_precio(2, '150'))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN de SQLite')
+class PlanesConsultaTests(TestCase):
+    # Las consultas calientes deben buscar por índice (SEARCH), sin recorrer la
+    # tabla (SCAN) ni ordenar en un árbol temporal
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios()
+        agregar_precios(self.activos, self.portafolios, 0, 30)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsaIndice(self, qs, indice=None):
+        plan = qs.explain()
+        self.assertNotRegex(plan, r'SCAN portfolio_', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertIn('INDEX', plan)
+        if indice:
+            self.assertIn(indice, plan)
+
+    def test_consultas_calientes(self):
+        pid, activo = self.portafolios[0].id, self.activos[0].id
+        desde, hasta = INICIO + timedelta(days=5), INICIO + timedelta(days=20)
+        self.assertUsaIndice(
+            CantidadActivo.objects.filter(portafolio_id=pid, fecha__lte=hasta).values_list('fecha', 'activo_id', 'cantidad'),
+            'cantidad_pf_fecha_idx',
+        )
+        self.assertUsaIndice(
+            CantidadActivo.objects.filter(portafolio_id=pid, activo_id=activo, fecha__lte=hasta).order_by('-fecha')
+        )
+        self.assertUsaIndice(
+            PesoActivo.objects.filter(portafolio_id=pid, fecha__gte=desde, fecha__lte=hasta).values_list('fecha', 'activo_id', 'peso'),
+            'pesoactivo_pf_fecha_idx',
+        )
+        self.assertUsaIndice(
+            ValorPortafolio.objects.filter(portafolio_id=pid, fecha__gte=desde, fecha__lte=hasta)
+            .order_by('fecha').values_list('fecha', 'valor_total')
+        )
+        self.assertUsaIndice(
+            Precio.objects.filter(fecha__gte=desde).values_list('fecha', flat=True).distinct(),
+            'precio_fecha_activo_idx',
+        )
+        self.assertUsaIndice(
+            Precio.objects.filter(fecha__gte=desde, fecha__lte=hasta).values_list('fecha', 'activo_id', 'precio'),
+            'precio_fecha_activo_idx',
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'PRAGMAs de SQLite')
+class PerfilSqliteTests(TestCase):
+    def test_pragmas_en_conexiones_nuevas(self):
+        # La BD de tests está en memoria: journal_mode no aplica, el resto sí
+        self.assertEqual(
+            pragmas_actuales(connection, ['temp_store', 'cache_size']),
+            {'temp_store': 2, 'cache_size': -65536},
+        )
+        with tempfile.TemporaryDirectory() as directorio:
+            conexion = connection.copy()
+            conexion.settings_dict = dict(conexion.settings_dict, NAME=f'{directorio}/bd.sqlite3')
+            try:
+                # Sin PORTFOLIO_SQLITE_WAL el archivo queda en el modo por defecto
+                self.assertEqual(
+                    pragmas_actuales(conexion, ['journal_mode', 'synchronous']),
+                    {'journal_mode': 'delete', 'synchronous': 2},
+                )
+                with override_settings(PORTFOLIO_SQLITE_WAL=True):
+                    conexion.close()
+                    conexion.settings_dict['NAME'] = f'{directorio}/otra.sqlite3'
+                    self.assertEqual(
+                        pragmas_actuales(conexion, ['journal_mode', 'synchronous']),
+                        {'journal_mode': 'wal', 'synchronous': 1},
+                    )
+            finally:
+                conexion.close()
+
+
+class VistasAsyncTests(TestCase):
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios()
+        agregar_precios(self.activos, self.portafolios, 0, 20)
+
+    async def test_mismas_respuestas_que_wsgi(self):
+        rango = {'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31'}
+        casos = [
+            ('portafolio-list', {}),
+            ('datos-portafolio', rango),
+            ('datos-portafolio', dict(rango, portafolio_id=self.portafolios[1].id)),
+            ('datos-graficos', dict(rango, portafolio_id=self.portafolios[0].id, max_points=5)),
+            ('datos-graficos', {'fecha_inicio': '2022-01-01'}),
+        ]
+        for nombre, params in casos:
+            sincrona = await sync_to_async(self.client.get)(reverse(nombre), params)
+            asincrona = await self.async_client.get(reverse(f'{nombre}-async'), params)
+            self.assertEqual(asincrona.status_code, sincrona.status_code)
+            self.assertEqual(asincrona.json(), sincrona.json())
+            if sincrona.status_code == 200:
+                condicional = await self.async_client.get(
+                    reverse(f'{nombre}-async'), params, headers={'if-none-match': asincrona['ETag']}
+                )
+                self.assertEqual(condicional.status_code, 304)
+
+
+class ComparacionTests(TestCase):
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios(n_portafolios=4)
+        CantidadActivo.objects.filter(portafolio=self.portafolios[1]).update(cantidad=Decimal('30'))
+        agregar_precios(self.activos, self.portafolios, 0, 10)
+
+    def comparar(self, portafolios, **params):
+        params = dict(fecha_inicio='2022-01-01', fecha_fin='2022-12-31', **params)
+        params['portafolio_ids'] = ','.join(str(p.id) for p in portafolios)
+        return self.client.get(reverse('comparar-portafolios'), params)
+
+    def test_series_alineadas(self):
+        self.comparar(self.portafolios)
+        with CaptureQueriesContext(connection) as dos:
+            self.assertEqual(self.comparar(self.portafolios[:2]).status_code, 200)
+        with CaptureQueriesContext(connection) as cuatro:
+            datos = self.comparar(self.portafolios[::-1]).json()
+        self.assertEqual(len(dos), len(cuatro))
+
+        self.assertEqual([p['id'] for p in datos['portafolios']], [p.id for p in self.portafolios[::-1]])
+        self.assertEqual(len(datos['fechas']), 10)
+        valores = ValorPortafolio.objects.filter(portafolio=self.portafolios[1]).order_by('fecha')
+        self.assertEqual(datos['valores'][2], [float(v.valor_total) for v in valores])
+        for k in range(4):
+            self.assertEqual(datos['normalizados'][k][0], 1.0)
+            self.assertAlmostEqual(datos['retornos_acumulados'][k][-1], datos['normalizados'][k][-1] - 1)
+        # El portafolio 1 tiene el triple de cantidades: la mitad del total
+        self.assertAlmostEqual(datos['pesos_relativos'][2][0], 0.5)
+        self.assertAlmostEqual(sum(col[5] for col in datos['pesos_relativos']), 1.0, places=5)
+
+    def test_validaciones(self):
+        self.assertEqual(len(self.comparar(self.portafolios, max_points=3).json()['fechas']), 3)
+        self.assertEqual(self.comparar([]).status_code, 400)
+        self.assertEqual(self.comparar(self.portafolios, freq='X').status_code, 400)
+        ValorPortafolio.objects.filter(portafolio=self.portafolios[3]).delete()
+        self.assertEqual(self.comparar(self.portafolios).json()['fechas'], [])
+        Portafolio.objects.filter(id=self.portafolios[3].id).delete()
+        self.assertEqual(self.comparar(self.portafolios).status_code, 404)
+
+
+class AnaliticaTests(TestCase):
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios()
+        CantidadActivo.objects.filter(portafolio=self.portafolios[1], activo=self.activos[0]).update(cantidad=Decimal('50'))
+        agregar_precios(self.activos, self.portafolios, 0, 30)
+
+    def analitica(self, portafolio, **params):
+        params = dict(fecha_inicio='2022-01-01', fecha_fin='2022-12-31', portafolio_id=portafolio.id, **params)
+        return self.client.get(reverse('analitica'), params)
+
+    def test_metricas(self):
+        datos = self.analitica(self.portafolios[0], ventana=10, referencia_id=self.portafolios[1].id).json()
+        valores = np.array([float(v) for v in ValorPortafolio.objects.filter(portafolio=self.portafolios[0])
+                            .order_by('fecha').values_list('valor_total', flat=True)])
+        r = valores[1:] / valores[:-1] - 1
+        self.assertEqual(len(datos['retornos']), 29)
+        np.testing.assert_allclose(datos['retornos'], r, atol=1e-8)
+        self.assertAlmostEqual(datos['volatilidad']['diaria'], r.std(ddof=1), places=7)
+        self.assertEqual(datos['sharpe_movil']['valores'][:9], [None] * 9)
+        self.assertEqual(datos['max_drawdown']['valor'], 0.0)
+        self.assertGreater(datos['beta']['valor'], 0)
+        self.assertEqual(datos['beta']['fechas_comunes'], 30)
+        # Sin transacciones el retorno diario es la suma de las contribuciones
+        self.assertAlmostEqual(sum(c['contribucion'] for c in datos['contribuciones']), r.sum(), places=6)
+
+        contra_si = self.analitica(self.portafolios[0], referencia_id=self.portafolios[0].id).json()
+        self.assertAlmostEqual(contra_si['beta']['valor'], 1.0)
+        self.assertEqual(self.analitica(self.portafolios[0], ventana=1).status_code, 400)
+        self.assertEqual(self.analitica(self.portafolios[0], referencia_id=9999).status_code, 404)
+
+    def test_cache_por_version(self):
+        with mock.patch('portfolio.analitica.calcular', wraps=analitica.calcular) as calcular:
+            self.analitica(self.portafolios[0])
+            self.analitica(self.portafolios[0])
+            self.assertEqual(calcular.call_count, 1)
+            self.analitica(self.portafolios[0], ventana=5)
+            self.assertEqual(calcular.call_count, 2)
+
+            dia = INICIO + timedelta(days=15)
+            Precio.objects.filter(fecha=dia).update(precio=Decimal('50'))
+            valorizar_portafolio(self.portafolios[0].id)
+            datos = self.analitica(self.portafolios[0]).json()
+            self.assertEqual(calcular.call_count, 3)
+        self.assertLess(datos['max_drawdown']['valor'], -0.4)
+        self.assertEqual(datos['max_drawdown']['valle'], str(dia))
+
+
+class TransaccionLoteTests(TestCase):
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios(n_portafolios=1)
+        agregar_precios(self.activos, self.portafolios, 0, 30)
+
+    def enviar(self, transacciones):
+        return self.client.post(reverse('transaccion-lote-api'), {
+            'portafolio_id': self.portafolios[0].id,
+            'fecha': str(INICIO + timedelta(days=10)),
+            'transacciones': transacciones,
+        }, content_type='application/json')
+
+    def ordenes(self, n):
+        return [
+            {'activo_codigo': self.activos[i % len(self.activos)].codigo, 'tipo': 'COMPRA', 'monto': 1000}
+            for i in range(n)
+        ]
+
+    def test_consultas_no_crecen_con_el_lote(self):
+        with CaptureQueriesContext(connection) as pocas:
+            self.assertEqual(self.enviar(self.ordenes(3)).status_code, 200)
+        with CaptureQueriesContext(connection) as muchas:
+            self.assertEqual(self.enviar(self.ordenes(60)).status_code, 200)
+        self.assertEqual(len(pocas), len(muchas))
+        self.assertEqual(Transaccion.objects.count(), 63)
+
+    def test_lote_invalido_no_escribe(self):
+        cantidades = CantidadActivo.objects.count()
+        respuesta = self.enviar(self.ordenes(2) + [{'activo_codigo': 'NO', 'tipo': 'COMPRA', 'monto': 1}])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.json()['errores'][0]['indice'], 2)
+        self.assertEqual(Transaccion.objects.count(), 0)
+        self.assertEqual(CantidadActivo.objects.count(), cantidades)
+
+    def test_muchos_lotes_igual_a_valorizacion_completa(self):
+        for k in range(60):
+            fecha = INICIO + timedelta(days=(k * 7) % 29)
+            respuesta = self.client.post(reverse('transaccion-lote-api'), {
+                'portafolio_id': self.portafolios[0].id, 'fecha': str(fecha), 'transacciones': [
+                    {'activo_codigo': self.activos[k % 3].codigo, 'tipo': 'COMPRA', 'monto': 1234.567 + k},
+                    {'activo_codigo': self.activos[(k + 1) % 3].codigo, 'tipo': 'VENTA', 'monto': 333.33 + k},
+                ],
+            }, content_type='application/json')
+            self.assertEqual(respuesta.status_code, 200)
+        incremental = volcar_series()
+        valorizar_portafolio(self.portafolios[0].id)
+        self.assertEqual(incremental, volcar_series())
+
+    def transaccion(self, fecha, transacciones):
+        return self.client.post(reverse('transaccion-api'), {
+            'portafolio_id': self.portafolios[0].id, 'fecha': str(fecha), 'transacciones': transacciones,
+        }, content_type='application/json')
+
+    def test_transacciones_sueltas_igual_a_valorizacion_completa(self):
+        for k in range(20):
+            fecha = INICIO + timedelta(days=(k * 11) % 29)
+            respuesta = self.transaccion(fecha, [
+                {'activo_codigo': self.activos[k % 3].codigo, 'tipo': 'compra', 'monto': 987.65 + k},
+                {'activo_codigo': 'NO', 'tipo': 'VENTA', 'monto': 1},
+                {'activo_codigo': self.activos[(k + 2) % 3].codigo, 'tipo': 'VENTA', 'monto': 250.5 + k},
+            ])
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta.json()['resultados'][1]['error'], 'Activo no encontrado')
+        self.assertEqual(Transaccion.objects.count(), 40)
+        incremental = volcar_series()
+        valorizar_portafolio(self.portafolios[0].id)
+        self.assertEqual(incremental, volcar_series())
+
+    def test_transaccion_invalida_no_escribe(self):
+        cantidades = list(CantidadActivo.objects.values_list('fecha', 'activo_id', 'cantidad'))
+        series = volcar_series()
+        fecha = INICIO + timedelta(days=10)
+        orden = {'activo_codigo': self.activos[0].codigo, 'tipo': 'COMPRA', 'monto': 1000}
+        for invalida in ({'activo_codigo': self.activos[1].codigo, 'monto': 5},
+                         dict(orden, tipo='REGALO'), dict(orden, monto='mil')):
+            respuesta = self.transaccion(fecha, [orden, invalida])
+            self.assertEqual(respuesta.status_code, 400)
+            self.assertEqual(respuesta.json()['errores'][0]['indice'], 1)
+        # Un error a mitad de camino deshace también lo ya escrito
+        with mock.patch('portfolio.views.revalorizar_incremental', side_effect=RuntimeError('corte')):
+            with self.assertRaises(RuntimeError):
+                self.transaccion(fecha, [orden, orden])
+        self.assertEqual(Transaccion.objects.count(), 0)
+        self.assertEqual(list(CantidadActivo.objects.values_list('fecha', 'activo_id', 'cantidad')), cantidades)
+        self.assertEqual(volcar_series(), series)
+
+    def test_simulacion_no_escribe_y_coincide_con_el_lote(self):
+        fecha = INICIO + timedelta(days=10)
+        ordenes = self.ordenes(4) + [{'activo_codigo': self.activos[1].codigo, 'tipo': 'VENTA', 'monto': 500}]
+        version = Portafolio.objects.get(id=self.portafolios[0].id).version_datos
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.post(reverse('transaccion-simular-api'), {
+                'portafolio_id': self.portafolios[0].id, 'fecha': str(fecha), 'transacciones': ordenes,
+            }, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in ctx.captured_queries))
+        self.assertEqual(Portafolio.objects.get(id=self.portafolios[0].id).version_datos, version)
+        simulado = respuesta.json()
+
+        self.assertEqual(self.enviar(ordenes).status_code, 200)
+        valores = ValorPortafolio.objects.filter(portafolio=self.portafolios[0], fecha__gte=fecha).order_by('fecha')
+        self.assertEqual(simulado['fechas'][0], str(fecha))
+        self.assertEqual(simulado['valor_simulado'], [float(v.valor_total) for v in valores])
+        self.assertLess(simulado['valor_actual'][0], simulado['valor_simulado'][0])
+        self.assertEqual([c['nueva_cantidad'] for c in simulado['cambios']], [
+            str(CantidadActivo.objects.get(portafolio=self.portafolios[0], activo__codigo=c['activo'], fecha=fecha).cantidad)
+            for c in simulado['cambios']
+        ])
+
+
+class RebalanceoTests(TestCase):
+    PESOS = {'A0': 0.5, 'A1': 0.3, 'A2': 0.2}
+
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios(n_portafolios=1)
+        self.pf = self.portafolios[0]
+        PesoPortafolio.objects.bulk_create([
+            PesoPortafolio(portafolio=self.pf, activo=a, peso_inicial=Decimal(str(self.PESOS[a.codigo])))
+            for a in self.activos
+        ])
+        agregar_precios(self.activos, self.portafolios, 0, 120)
+
+    def rebalancear(self, **datos):
+        return self.client.post(reverse('rebalanceo-api'), dict(
+            portafolio_id=self.pf.id, fecha=str(INICIO + timedelta(days=40)), **datos
+        ), content_type='application/json')
+
+    def test_rebalanceo_en_un_lote(self):
+        simulado = self.rebalancear(simular=True).json()
+        self.assertEqual(Transaccion.objects.count(), 0)
+        self.assertEqual(len(simulado['transacciones']), 3)
+
+        respuesta = self.rebalancear()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['transacciones'], simulado['transacciones'])
+        self.assertEqual(Transaccion.objects.count(), 3)
+        pesos = dict(PesoActivo.objects.filter(portafolio=self.pf, fecha=INICIO + timedelta(days=40))
+                     .values_list('activo__codigo', 'peso'))
+        for codigo, peso in self.PESOS.items():
+            self.assertAlmostEqual(float(pesos[codigo]), peso, places=5)
+        # Ya en el objetivo no quedan órdenes
+        self.assertEqual(self.rebalancear().json()['transacciones'], [])
+
+        # Un activo fuera del objetivo se vende completo
+        self.rebalancear(pesos={'A0': 0.5, 'A1': 0.5})
+        cantidad = CantidadActivo.objects.get(portafolio=self.pf, activo=self.activos[2], fecha=INICIO + timedelta(days=40))
+        self.assertAlmostEqual(float(cantidad.cantidad), 0, places=3)
+
+    def test_pesos_invalidos(self):
+        self.assertEqual(self.rebalancear(pesos={'A0': 0.5, 'A1': 0.3}).status_code, 400)
+        self.assertEqual(self.rebalancear(pesos={'A0': 0.5, 'NO': 0.5}).status_code, 400)
+        self.assertEqual(self.rebalancear(pesos={'A0': 1.5, 'A1': -0.5}).status_code, 400)
+        self.assertEqual(Transaccion.objects.count(), 0)
+
+    def test_backtest_igual_a_rebalancear_dia_a_dia(self):
+        datos = self.client.get(reverse('backtest-rebalanceo'), {'portafolio_id': self.pf.id, 'freq': 'M'}).json()
+        precios = np.array([[100 + i + d for i in range(3)] for d in range(120)], dtype=float)
+        w = np.array([0.5, 0.3, 0.2])
+        fechas_rebalanceo = {r['fecha'] for r in datos['rebalanceos']}
+        cantidades = w * 1e9 / precios[0]
+        esperado = []
+        for d in range(120):
+            valor = cantidades @ precios[d]
+            esperado.append(valor)
+            if str(INICIO + timedelta(days=d)) in fechas_rebalanceo:
+                cantidades = w * valor / precios[d]
+        np.testing.assert_allclose(datos['valor_rebalanceado'], esperado, atol=0.01)
+        self.assertEqual(sorted(fechas_rebalanceo), ['2022-01-31', '2022-02-28', '2022-03-31', '2022-04-30'])
+        self.assertAlmostEqual(datos['valor_sin_rebalanceo'][-1], 1e9 * (w @ (precios[-1] / precios[0])), places=1)
+
+        trimestral = self.client.get(reverse('backtest-rebalanceo'), {
+            'portafolio_id': self.pf.id, 'freq': 'Q', 'pesos': 'A0:0.6,A2:0.4',
+        }).json()
+        self.assertEqual(trimestral['activos'], ['A0', 'A2'])
+        self.assertEqual([r['fecha'] for r in trimestral['rebalanceos']], ['2022-03-31'])
+
+
+class CacheResultadosTests(TestCase):
+    def setUp(self):
+        self.activos, self.portafolios = crear_portafolios(n_portafolios=1)
+        agregar_precios(self.activos, self.portafolios, 0, 30)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.backends = {
+            'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas'},
+            'archivo': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio.name},
+        }
+
+    def graficos(self):
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get(reverse('datos-graficos'), {
+                'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31', 'portafolio_id': self.portafolios[0].id,
+            })
+        return len(ctx), respuesta.json()['datos_linea']
+
+    def comprar(self, monto):
+        respuesta = self.client.post(reverse('transaccion-lote-api'), {
+            'portafolio_id': self.portafolios[0].id, 'fecha': str(INICIO + timedelta(days=10)),
+            'transacciones': [{'activo_codigo': 'A0', 'tipo': 'COMPRA', 'monto': monto}],
+        }, content_type='application/json')
+        return respuesta.json()['resultados'][0]
+
+    def test_backends(self):
+        for nombre, backend in self.backends.items():
+            with self.subTest(nombre), override_settings(CACHES={'default': backend, 'portfolio': backend}):
+                frio, linea = self.graficos()
+                caliente, linea_cache = self.graficos()
+                self.assertLess(caliente, frio)
+                self.assertEqual(linea_cache, linea)
+
+                # Las escrituras suben la versión: cantidades y series se releen
+                primera = self.comprar(1000)
+                segunda = self.comprar(1000)
+                self.assertEqual(segunda['cantidad_anterior'], primera['nueva_cantidad'])
+                _, linea_nueva = self.graficos()
+                self.assertNotEqual(linea_nueva, linea)
+                esperados = ValorPortafolio.objects.filter(portafolio=self.portafolios[0]).order_by('fecha')
+                self.assertEqual([p['valor'] for p in linea_nueva], [float(v.valor_total) for v in esperados])
+
+
+class BenchTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.dir = directorio.name
+
+    def test_libro_sintetico(self):
+        libro = generar_libro(f'{self.dir}/libro.xlsx', n_activos=4, n_dias=12, semilla=3)
+        df_w, df_p = leer_libro(libro)
+        self.assertEqual(df_p.shape, (12, 5))
+        self.assertEqual(list(df_w['activos']), codigos_activos(4))
+        for columna in ('portafolio 1', 'portafolio 2'):
+            self.assertAlmostEqual(df_w[columna].sum(), 1.0, places=4)
+        self.assertTrue((df_p.iloc[:, 1:] > 0).all().all())
+        # Misma semilla, mismo libro
+        df_w2, df_p2 = leer_libro(generar_libro(f'{self.dir}/otro.xlsx', n_activos=4, n_dias=12, semilla=3))
+        self.assertTrue(df_p.equals(df_p2))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            cargar_datos_excel(libro)
+        creados = crear_portafolios_sinteticos(2)
+        self.assertEqual(len(creados), 2)
+        for pf in creados:
+            self.assertAlmostEqual(sum(float(p.peso_inicial) for p in pf.pesos.all()), 1.0, places=4)
+
+    def test_formato_de_resultados(self):
+        salida = f'{self.dir}/sub/resultados.json'
+        # La BD de los tests hace de BD desechable
+        with mock.patch.object(bench.Command, 'bd_temporal', lambda self, tmp: contextlib.nullcontext()):
+            call_command('bench', activos=3, dias=15, ordenes=2, salida=salida, stdout=io.StringIO())
+        with open(salida, encoding='utf-8') as f:
+            historial = json.load(f)
+        self.assertEqual(len(historial), 1)
+        registro = historial[0]
+        self.assertEqual(set(registro), {'fecha', 'commit', 'parametros', 'resultados'})
+        self.assertEqual(registro['parametros']['activos'], 3)
+        self.assertEqual([r['etapa'] for r in registro['resultados']], [
+            'cargar_datos_excel', 'calcular_cantidades_iniciales', 'calcular_valores_historicos',
+            'api_transaccion', 'api_transaccion_lote', 'api_datos_graficos_frio',
+            'api_datos_graficos_caliente', 'api_datos_portafolio',
+        ])
+        for r in registro['resultados']:
+            self.assertTrue({'segundos', 'consultas', 'memoria_pico_kb'} <= set(r))
+        self.assertIn('por_segundo', registro['resultados'][3])
+
+
+@override_settings(PORTFOLIO_METRICAS=True)
+class MetricasTests(TestCase):
+    def setUp(self):
+        registro.reiniciar()
+        self.activos, self.portafolios = crear_portafolios(n_portafolios=1)
+        agregar_precios(self.activos, self.portafolios, 0, 10)
+
+    def metricas(self):
+        respuesta = self.client.get(reverse('metrics'))
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.content.decode()
+
+    def test_metricas_por_vista(self):
+        self.client.get(reverse('datos-graficos'), {
+            'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31', 'portafolio_id': self.portafolios[0].id
+        })
+        texto = self.metricas()
+        etiquetas = '{vista="datos-graficos",metodo="GET"}'
+        self.assertIn('portfolio_http_solicitudes_total{vista="datos-graficos",metodo="GET",estado="200"} 1', texto)
+        self.assertIn(f'portfolio_http_filas_serializadas_total{etiquetas} 20', texto)
+        self.assertIn(f'portfolio_http_duracion_segundos_count{etiquetas} 1', texto)
+        self.assertNotIn(f'portfolio_http_consultas_total{etiquetas} 0\n', texto)
+
+    def test_metricas_streaming(self):
+        respuesta = self.client.get(reverse('exportar-datos-portafolio'), {
+            'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31'
+        })
+        contenido = b''.join(respuesta.streaming_content)
+        texto = self.metricas()
+        etiquetas = '{vista="exportar-datos-portafolio",metodo="GET"}'
+        self.assertIn(f'portfolio_http_filas_serializadas_total{etiquetas} 40', texto)
+        self.assertIn(f'portfolio_http_respuesta_bytes_total{etiquetas} {len(contenido)}', texto)
+
+    def test_etapas_etl(self):
+        with medir_etapa('prueba'):
+            Activo.objects.count()
+        texto = self.metricas()
+        self.assertIn('portfolio_etl_ejecuciones_total{etapa="prueba"} 1', texto)
+        self.assertIn('portfolio_etl_consultas_total{etapa="prueba"} 1', texto)
+
+    def test_exportar_etapas_etl(self):
+        with medir_etapa('prueba'):
+            Activo.objects.count()
+        self.client.get(reverse('portafolio-list'))
+        with tempfile.TemporaryDirectory() as directorio:
+            exportar_etl(f'{directorio}/etl.prom')
+            with open(f'{directorio}/etl.prom', encoding='utf-8') as f:
+                texto = f.read()
+        self.assertIn('portfolio_etl_ejecuciones_total{etapa="prueba"} 1', texto)
+        self.assertNotIn('portfolio_http', texto)
+
+    async def test_vista_async(self):
+        async def vista(request):
+            pass
+        # Con una cadena async el middleware no la adapta a síncrona
+        self.assertTrue(iscoroutinefunction(MetricasMiddleware(vista)))
+        respuesta = await self.async_client.get(reverse('datos-graficos-async'), {
+            'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-12-31', 'portafolio_id': self.portafolios[0].id
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        texto = await sync_to_async(self.metricas)()
+        etiquetas = '{vista="datos-graficos-async",metodo="GET"}'
+        self.assertIn(f'portfolio_http_duracion_segundos_count{etiquetas} 1', texto)
+        # Las consultas corren en el hilo de sync_to_async y también se cuentan
+        self.assertNotIn(f'portfolio_http_consultas_total{etiquetas} 0\n', texto)
+
+
+class ValorizacionVectorialTests(TestCase):
+    # Valores esperados calculados fila por fila como la versión anterior de
+    # calcular_valores_historicos: x = c * p en Decimal, V = Σx y w = x (ya
+    # guardado en centavos) / V
+    ESPERADO_X = {
+        (0, 'A0'): '1051.30', (0, 'A1'): '1012.50',
+        (1, 'A0'): '1101.36', (1, 'A1'): '987.50', (1, 'A2'): '1025.00',
+        (2, 'A1'): '1290.00', (2, 'A2'): '1000.00',
+    }
+    ESPERADO_W = {
+        (0, 'A0'): '0.509401', (0, 'A1'): '0.490601',
+        (1, 'A0'): '0.353696', (1, 'A1'): '0.317131', (1, 'A2'): '0.329174',
+        (2, 'A1'): '0.563319', (2, 'A2'): '0.436681',
+    }
+    ESPERADO_V = ['2063.80', '3113.86', '2290.00']
+
+    def test_igual_al_calculo_por_fila(self):
+        activos = [Activo.objects.create(codigo=f'A{i}', nombre=f'Activo {i}') for i in range(3)]
+        pf = Portafolio.objects.create(nombre='Portafolio 0', fecha_inicio=INICIO)
+        # A0 sin precio el día 2, A2 sin precio el día 0 y sin cantidad hasta el día 1
+        precios = [('10.5', '20.25', None), ('11.0', '19.75', '5.125'), (None, '21.5', '5.0')]
+        Precio.objects.bulk_create([
+            Precio(activo=activos[i], fecha=INICIO + timedelta(days=d), precio=Decimal(p))
+            for d, fila in enumerate(precios) for i, p in enumerate(fila) if p is not None
+        ])
+        CantidadActivo.objects.bulk_create([
+            CantidadActivo(portafolio=pf, activo=activos[i], fecha=INICIO + timedelta(days=d), cantidad=Decimal(c))
+            for i, d, c in [(0, 0, '100.1234'), (1, 0, '50'), (1, 2, '60'), (2, 1, '200')]
+        ])
+        valorizar_portafolio(pf.id)
+
+        filas = PesoActivo.objects.filter(portafolio=pf).values_list('fecha', 'activo__codigo', 'valor_activo', 'peso')
+        self.assertEqual(
+            {((f - INICIO).days, a): str(x) for f, a, x, _ in filas},
+            self.ESPERADO_X,
+        )
+        self.assertEqual(
+            {((f - INICIO).days, a): str(w) for f, a, _, w in filas},
+            self.ESPERADO_W,
+        )
+        self.assertEqual(
+            [str(v) for v in ValorPortafolio.objects.filter(portafolio=pf).order_by('fecha')
+             .values_list('valor_total', flat=True)],
+            self.ESPERADO_V,
+        )
+
+
+class CantidadesTests(TestCase):
+    def dia(self, d):
+        return INICIO + timedelta(days=d)
+
+    def volcar(self, pf, activo):
+        return [
+            ((f - INICIO).days, str(c)) for f, c in
+            CantidadActivo.objects.filter(portafolio=pf, activo=activo).order_by('fecha').values_list('fecha', 'cantidad')
+        ]
+
+    def test_cantidad_al_es_escalon(self):
+        indice = IndiceCantidades([
+            (self.dia(5), 1, Decimal('4')), (self.dia(0), 1, Decimal('10')), (self.dia(2), 2, Decimal('7')),
+        ])
+        self.assertIsNone(indice.cantidad_al(1, self.dia(-1)))
+        self.assertEqual(indice.cantidad_al(1, self.dia(-1), Decimal('0')), Decimal('0'))
+        self.assertEqual(
+            [indice.cantidad_al(1, self.dia(d)) for d in (0, 3, 5, 30)],
+            [Decimal('10'), Decimal('10'), Decimal('4'), Decimal('4')],
+        )
+        self.assertIsNone(indice.cantidad_al(2, self.dia(1)))
+        self.assertEqual(indice.cantidad_al(2, self.dia(2)), Decimal('7'))
+        self.assertIsNone(indice.cantidad_al(3, self.dia(2)))
+        self.assertTrue(np.array_equal(
+            indice.matriz([self.dia(d) for d in (1, 2, 6)], [1, 2, 3]),
+            np.array([[10, np.nan, np.nan], [10, 7, np.nan], [4, 7, np.nan]]),
+            equal_nan=True,
+        ))
+
+    def test_cambio_retroactivo_se_propaga(self):
+        activos, portafolios = crear_portafolios(n_activos=2, n_portafolios=1)
+        pf, a = portafolios[0], activos[0]
+        CantidadActivo.objects.bulk_create([
+            CantidadActivo(portafolio=pf, activo=a, fecha=self.dia(d), cantidad=Decimal(c))
+            for d, c in [(10, '15'), (20, '5')]
+        ])
+        indice = IndiceCantidades.cargar(pf.id)
+
+        # Entre filas: nueva fila en el día 5 y el mismo delta en las posteriores
+        registrar_cambio_cantidad(pf.id, a.id, self.dia(5), Decimal('2.5'), indice)
+        self.assertEqual(self.volcar(pf, a), [(0, '10.0000'), (5, '12.5000'), (10, '17.5000'), (20, '7.5000')])
+        # Sobre una fila existente: se reemplaza y solo se ajustan las posteriores
+        registrar_cambio_cantidad(pf.id, a.id, self.dia(10), Decimal('-1'), indice)
+        self.assertEqual(self.volcar(pf, a), [(0, '10.0000'), (5, '12.5000'), (10, '16.5000'), (20, '6.5000')])
+        # El otro activo no cambia y el índice en memoria coincide con la BD
+        self.assertEqual(self.volcar(pf, activos[1]), [(0, '10.0000')])
+        self.assertEqual(
+            [indice.cantidad_al(a.id, self.dia(d)) for d in (0, 5, 10, 20)],
+            [Decimal(c) for c in ('10', '12.5', '16.5', '6.5')],
+        )
+
+    def test_compactacion_0002(self):
+        compactar = import_module('portfolio.migrations.0002_compactar_cantidades').compactar_cantidades
+        activos, portafolios = crear_portafolios(n_activos=2, n_portafolios=1)
+        pf, a, b = portafolios[0], activos[0], activos[1]
+        CantidadActivo.objects.bulk_create([
+            CantidadActivo(portafolio=pf, activo=activo, fecha=self.dia(d), cantidad=Decimal(c))
+            for activo, d, c in [(a, 1, '10'), (a, 2, '12'), (a, 3, '12'), (a, 4, '10'), (b, 1, '10'), (b, 2, '10')]
+        ])
+        compactar(django_apps, None)
+        self.assertEqual(self.volcar(pf, a), [(0, '10.0000'), (2, '12.0000'), (4, '10.0000')])
+        self.assertEqual(self.volcar(pf, b), [(0, '10.0000')])
+
+
+class ValorizacionParalelaTests(TestCase):
+    def test_paralelo_igual_a_serial(self):
+        activos, portafolios = crear_portafolios(n_portafolios=3)
+        CantidadActivo.objects.create(
+            portafolio=portafolios[1], activo=activos[0], fecha=INICIO + timedelta(days=5), cantidad=Decimal('25')
+        )
+        agregar_precios(activos, portafolios, 0, 20)
+        esperado = volcar_series()
+        ValorPortafolio.objects.all().delete()
+        PesoActivo.objects.all().delete()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(calcular_valores_historicos(trabajadores=2))
+        self.assertEqual(volcar_series(), esperado)
+
+
+class AlmacenPreciosTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(PORTFOLIO_MATRIZ_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.activos, self.portafolios = crear_portafolios(n_activos=4, n_portafolios=1)
+        agregar_precios(self.activos[:3], [], 0, 10)
+        agregar_precios(self.activos[3:], [], 5, 10)
+        self.directorio = Path(directorio.name)
+        reconstruir_almacen()
+
+    def assertMismaMatriz(self, **filtros):
+        fechas, ids, matriz = abrir_almacen().recortar(**filtros)
+        fechas_bd, ids_bd, matriz_bd = matriz_desde_bd(**filtros)
+        self.assertEqual((fechas, ids), (fechas_bd, ids_bd))
+        self.assertTrue(np.array_equal(matriz, matriz_bd, equal_nan=True))
+
+    def assertLeeDeLaBd(self):
+        self.assertIsNone(abrir_almacen())
+        fechas, ids, matriz = matriz_precios()
+        fechas_bd, ids_bd, matriz_bd = matriz_desde_bd()
+        self.assertEqual((fechas, ids), (fechas_bd, ids_bd))
+        self.assertTrue(np.array_equal(matriz, matriz_bd, equal_nan=True))
+
+    def versiones(self):
+        return sorted(d.name for d in self.directorio.glob('v*'))
+
+    def test_recortes_iguales_a_la_bd(self):
+        self.assertMismaMatriz()
+        self.assertMismaMatriz(fecha_desde=INICIO + timedelta(days=7))
+        self.assertMismaMatriz(fecha_hasta=INICIO + timedelta(days=3), activo_ids=[self.activos[3].id])
+        self.assertMismaMatriz(activo_ids=[self.activos[0].id, self.activos[3].id])
+
+    def test_lecturas_no_reconstruyen(self):
+        version = abrir_almacen()
+        agregar_precios(self.activos, [], 20, 1)
+        self.assertLeeDeLaBd()
+        self.assertFalse(verificar_almacen())
+        self.assertTrue(verificar_almacen(reconstruir=True))
+        self.assertIsNot(abrir_almacen(), version)
+        self.assertMismaMatriz()
+        # Un update masivo o un save() no cambian filas ni fechas, pero sí la versión de Precio
+        Precio.objects.filter(fecha=INICIO).update(precio=Decimal('1'))
+        self.assertLeeDeLaBd()
+        reconstruir_almacen()
+        self.assertMismaMatriz()
+        precio = Precio.objects.get(activo=self.activos[0], fecha=INICIO)
+        precio.precio = Decimal('2')
+        precio.save()
+        self.assertLeeDeLaBd()
+        self.assertTrue(verificar_almacen(reconstruir=True))
+
+    def test_una_version_por_escritura_masiva(self):
+        antes = firma_precios()
+        agregar_precios(self.activos, [], 30, 5)
+        self.assertEqual(firma_precios()[1], antes[1] + 1)
+
+    def test_conserva_la_version_anterior(self):
+        primera = self.versiones()
+        for k in range(3):
+            agregar_precios(self.activos, [], 20 + k, 1)
+            reconstruir_almacen()
+        self.assertEqual(len(self.versiones()), 2)
+        self.assertNotIn(primera[0], self.versiones())
+        # Misma firma: se reutiliza la versión publicada
+        vigentes = self.versiones()
+        reconstruir_almacen()
+        self.assertEqual(self.versiones(), vigentes)
+
+    def test_version_borrada_cae_a_la_bd(self):
+        almacen._abierto = None
+        for version in self.versiones():
+            shutil.rmtree(self.directorio / version)
+        self.assertLeeDeLaBd()
+
+    def test_reconstrucciones_concurrentes(self):
+        fechas, ids, matriz, codigos = almacen._leer_matriz()
+        contador = iter(range(1000))
+        errores = []
+
+        def reconstruir():
+            try:
+                almacen_nuevo = reconstruir_almacen()
+                almacen_nuevo.recortar()
+            except Exception as e:
+                errores.append(e)
+
+        # Sin BD en los hilos: cada reconstrucción ve una firma nueva
+        with mock.patch.object(almacen, 'firma_precios', lambda: ['version', next(contador)]), \
+                mock.patch.object(almacen, '_leer_matriz', lambda: (fechas, ids, matriz, codigos)):
+            hilos = [threading.Thread(target=reconstruir) for _ in range(8)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            self.assertEqual(errores, [])
+            self.assertEqual(len(self.versiones()), 2)
+            puntero = json.loads((self.directorio / almacen.PUNTERO).read_text(encoding='utf-8'))
+            self.assertEqual(puntero['version'], self.versiones()[-1])
+            self.assertIsNotNone(abrir_almacen(verificar=False))
+
+    def test_precarga_sin_consultas(self):
+        almacen._abierto = None
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(precargar_almacen())
+        # Ya mapeado: la primera lectura solo consulta la firma
+        with self.assertNumQueries(1):
+            matriz_precios()
+
+
+class IngestaTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.dir = directorio.name
+
+    def test_streaming_igual_a_pandas(self):
+        libro = generar_libro(f'{self.dir}/libro.xlsx', n_activos=4, n_dias=20)
+        for df, df_streaming in zip(leer_libro(libro), leer_libro(libro, streaming=True)):
+            self.assertEqual(list(df.columns), list(df_streaming.columns))
+            self.assertTrue(np.array_equal(
+                df.select_dtypes('number').to_numpy(), df_streaming.select_dtypes('number').to_numpy()
+            ))
+
+    def test_a_numero(self):
+        serie = pd.Series(['1,5', ' 2.25 ', 'x', None, '1,000.5', 'inf'], dtype=object)
+        self.assertEqual(a_numero(serie).fillna(-1).tolist(), [1.5, 2.25, -1, -1, -1, -1])
+
+    def test_carga_csv(self):
+        pd.DataFrame({
+            'Fecha': ['2022-01-03'] * 2, 'activos': ['A', 'B'],
+            'portafolio 1': ['0,4', '0,6'], 'portafolio 2': [0.5, 0.5],
+        }).to_csv(f'{self.dir}/pesos.csv', index=False)
+        pd.DataFrame({
+            'Dates': ['2022-01-03', '2022-01-04'], 'A': ['10,5', 'n/d'], 'B': [20, 21],
+        }).to_csv(f'{self.dir}/precios.csv', index=False)
+        with contextlib.redirect_stdout(io.StringIO()) as salida:
+            self.assertTrue(cargar_datos_tablas(f'{self.dir}/pesos.csv', f'{self.dir}/precios.csv'))
+        self.assertIn("Precio inválido para A en 2022-01-04: 'n/d'", salida.getvalue())
+        self.assertEqual(
+            sorted(Precio.objects.values_list('activo__codigo', 'fecha', 'precio')),
+            [('A', date(2022, 1, 3), Decimal('10.5')), ('B', date(2022, 1, 3), Decimal('20')),
+             ('B', date(2022, 1, 4), Decimal('21'))],
+        )
+        self.assertEqual(
+            sorted(Portafolio.objects.get(nombre='Portafolio 1').pesos.values_list('activo__codigo', 'peso_inicial')),
+            [('A', Decimal('0.4')), ('B', Decimal('0.6'))],
+        )
+
+    def test_carga_por_lotes_se_retoma(self):
+        libro = generar_libro(f'{self.dir}/libro.xlsx', n_activos=3, n_dias=10)
+        original = etl.cargar_precios_bulk
+        llamadas = []
+
+        def falla_en_el_tercero(df_p, *args, **kwargs):
+            llamadas.append(sorted(set(df_p['Fecha'])))
+            if len(llamadas) == 3:
+                raise RuntimeError('corte')
+            return original(df_p, *args, **kwargs)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with mock.patch.object(etl, 'cargar_precios_bulk', falla_en_el_tercero):
+                with self.assertRaises(RuntimeError):
+                    cargar_datos_excel(libro, lote_dias=3)
+            carga = CargaEtl.objects.get()
+            self.assertFalse(carga.completada)
+            self.assertEqual(carga.ultima_fecha, llamadas[1][-1])
+            self.assertEqual(Precio.objects.count(), 6 * 3)
+
+            with mock.patch.object(etl, 'cargar_precios_bulk', falla_en_el_tercero):
+                self.assertTrue(cargar_datos_excel(libro, lote_dias=3))
+        # Se retoma desde el lote que falló, sin repetir los confirmados
+        self.assertEqual(llamadas[3], llamadas[2])
+        self.assertEqual(len(llamadas), 5)
+        carga.refresh_from_db()
+        self.assertTrue(carga.completada)
+        self.assertEqual(Precio.objects.count(), 10 * 3)
+
+    def test_conteo_de_precios_bulk(self):
+        activos = {c: Activo.objects.create(codigo=c, nombre=c) for c in ('A', 'B')}
+        df_p = pd.DataFrame({'Fecha': [INICIO, INICIO + timedelta(days=1)], 'A': [10.5, 11.0], 'B': [20.0, None]})
+        self.assertEqual(
+            etl.cargar_precios_bulk(df_p, ['A', 'B'], activos),
+            {'insertados': 3, 'actualizados': 0, 'sin_cambios': 0},
+        )
+        df_p.loc[1, 'A'] = 11.25
+        df_p.loc[1, 'B'] = 19.5
+        self.assertEqual(
+            etl.cargar_precios_bulk(df_p, ['A', 'B'], activos),
+            {'insertados': 1, 'actualizados': 1, 'sin_cambios': 2},
+        )
+        self.assertEqual(
+            etl.cargar_precios_bulk(df_p, ['A', 'B'], activos),
+            {'insertados': 0, 'actualizados': 0, 'sin_cambios': 4},
+        )
+        self.assertEqual(
+            sorted((p.activo.codigo, (p.fecha - INICIO).days, str(p.precio)) for p in Precio.objects.all()),
+            [('A', 0, '10.5000'), ('A', 1, '11.2500'), ('B', 0, '20.0000'), ('B', 1, '19.5000')],
+        )
+
+    def test_pesos_sin_activo_se_omiten(self):
+        df_w = pd.DataFrame({
+            'Fecha': [INICIO] * 3, 'activos': ['A', None, 'B'],
+            'portafolio 1': [0.5, 0.1, 0.5], 'portafolio 2': [0.25, 0.1, 0.75],
+        })
+        df_p = pd.DataFrame({'Fecha': [INICIO], 'A': [10.0], 'B': [20.0]})
+        with contextlib.redirect_stdout(io.StringIO()) as salida:
+            self.assertTrue(etl.cargar_hojas(df_w, df_p))
+        self.assertIn('1 filas de weights', salida.getvalue())
+        self.assertEqual(sorted(Activo.objects.values_list('codigo', flat=True)), ['A', 'B'])
+        self.assertEqual(
+            sorted(PesoPortafolio.objects.values_list('portafolio__nombre', 'activo__codigo', 'peso_inicial')),
+            [('Portafolio 1', 'A', Decimal('0.5')), ('Portafolio 1', 'B', Decimal('0.5')),
+             ('Portafolio 2', 'A', Decimal('0.25')), ('Portafolio 2', 'B', Decimal('0.75'))],
+        )
+
+    def test_lote_dias_invalido(self):
+        libro = generar_libro(f'{self.dir}/libro.xlsx', n_activos=3, n_dias=10)
+        for lote_dias in ('0', '-2'):
+            with self.assertRaises(CommandError):
+                call_command('cargar_datos', f'--archivo={libro}', f'--lote-dias={lote_dias}')
+        for lote_dias in (0, -2):
+            with self.assertRaises(ValueError):
+                cargar_datos_excel(libro, lote_dias=lote_dias)
+            with self.assertRaises(ValueError):
+                etl.cargar_precios_por_lotes(pd.DataFrame({'Fecha': []}), [], {}, lote_dias, 'h', 'o')
+        self.assertFalse(CargaEtl.objects.exists())
+        self.assertFalse(Precio.objects.exists())
+
+    def test_recarga_incremental(self):
+        libro = generar_libro(f'{self.dir}/libro.xlsx', n_activos=3, n_dias=10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(recargar_incremental(libro))
+        completa = sorted(ValorPortafolio.objects.values_list('portafolio__nombre', 'fecha', 'valor_total'))
+        self.assertEqual(len(completa), 2 * 10)
+
+        # Mismo archivo: no se lee ni se escribe nada
+        with CaptureQueriesContext(connection) as consultas:
+            with contextlib.redirect_stdout(io.StringIO()) as salida:
+                self.assertTrue(recargar_incremental(libro))
+        self.assertIn('sin cambios', salida.getvalue())
+        self.assertEqual(len(consultas), 1)
+
+        # Cambia solo el último día: se carga esa fecha y se revaloriza desde ella
+        df_w, df_p = leer_libro(libro)
+        df_p.iloc[-1, 1:] = df_p.iloc[-1, 1:] * 1.1
+        with pd.ExcelWriter(libro) as escritor:
+            df_w.to_excel(escritor, sheet_name='weights', index=False)
+            df_p.to_excel(escritor, sheet_name='Precios', index=False)
+        with mock.patch.object(etl, 'calcular_valores_historicos', wraps=etl.calcular_valores_historicos) as valorizar:
+            with contextlib.redirect_stdout(io.StringIO()) as salida:
+                self.assertTrue(recargar_incremental(libro))
+        self.assertIn('1 en Precios, 0 en weights', salida.getvalue())
+        ultima = df_p['Dates'].iloc[-1].date()
+        self.assertEqual(valorizar.call_args.kwargs['fecha_desde'], ultima)
+        recargada = sorted(ValorPortafolio.objects.values_list('portafolio__nombre', 'fecha', 'valor_total'))
+        self.assertEqual([f for f in recargada if f[1] != ultima], [f for f in completa if f[1] != ultima])
+        self.assertNotEqual(recargada, completa)
+
+    def _reescribir(self, origen, destino, cambiar):
+        df_w, df_p = leer_libro(origen)
+        df_p = cambiar(df_p)
+        with pd.ExcelWriter(destino) as escritor:
+            df_w.to_excel(escritor, sheet_name='weights', index=False)
+            df_p.to_excel(escritor, sheet_name='Precios', index=False)
+        return destino
+
+    def _estado(self):
+        return (
+            sorted(Precio.objects.values_list('activo__codigo', 'fecha', 'precio')),
+            sorted(ValorPortafolio.objects.values_list('portafolio__nombre', 'fecha', 'valor_total')),
+        )
+
+    def _doblar_ultimo_dia(self, df_p):
+        df_p.iloc[-1, 1:] = df_p.iloc[-1, 1:] * 2
+        return df_p
+
+    def test_recarga_incremental_vuelve_al_libro_anterior(self):
+        libro_a = generar_libro(f'{self.dir}/a.xlsx', n_activos=3, n_dias=10)
+        libro_b = self._reescribir(libro_a, f'{self.dir}/b.xlsx', self._doblar_ultimo_dia)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(recargar_incremental(libro_a))
+        estado_a = self._estado()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(recargar_incremental(libro_b))
+        self.assertNotEqual(self._estado(), estado_a)
+
+        # A ya se cargó antes, pero la base tiene B: hay que recargar la fecha
+        with contextlib.redirect_stdout(io.StringIO()) as salida:
+            self.assertTrue(recargar_incremental(libro_a))
+        self.assertNotIn('sin cambios desde', salida.getvalue())
+        self.assertIn('1 en Precios, 0 en weights', salida.getvalue())
+        self.assertEqual(self._estado(), estado_a)
+
+    def test_carga_completa_invalida_huellas(self):
+        libro_a = generar_libro(f'{self.dir}/a.xlsx', n_activos=3, n_dias=10)
+        libro_b = self._reescribir(libro_a, f'{self.dir}/b.xlsx', self._doblar_ultimo_dia)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(recargar_incremental(libro_a))
+        estado_a = self._estado()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(cargar_datos_excel(libro_b))
+            self.assertTrue(calcular_valores_historicos())
+        self.assertFalse(HuellaFecha.objects.exists())
+
+        with contextlib.redirect_stdout(io.StringIO()) as salida:
+            self.assertTrue(recargar_incremental(libro_a))
+        self.assertNotIn('sin cambios desde', salida.getvalue())
+        self.assertEqual(self._estado(), estado_a)
+
+    def test_recarga_incremental_borra_fechas_eliminadas(self):
+        libro = generar_libro(f'{self.dir}/a.xlsx', n_activos=3, n_dias=10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(recargar_incremental(libro))
+        ultima = Precio.objects.latest('fecha').fecha
+        corto = self._reescribir(libro, f'{self.dir}/corto.xlsx', lambda df_p: df_p.iloc[:-1])
+        with contextlib.redirect_stdout(io.StringIO()) as salida:
+            self.assertTrue(recargar_incremental(corto))
+        self.assertIn('Fechas eliminadas: 1 en Precios', salida.getvalue())
+        self.assertFalse(Precio.objects.filter(fecha=ultima).exists())
+        self.assertFalse(ValorPortafolio.objects.filter(fecha=ultima).exists())
+        self.assertFalse(PesoActivo.objects.filter(fecha=ultima).exists())
+        self.assertFalse(HuellaFecha.objects.filter(hoja='Precios', fecha=ultima).exists())
+        self.assertEqual(ValorPortafolio.objects.count(), 2 * 9)
+
+    def test_recarga_incremental_toma_v0_del_libro(self):
+        v0 = date(2023, 3, 1)
+        libro = generar_libro(f'{self.dir}/libro.xlsx', n_activos=3, n_dias=10, fecha_inicio=v0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(recargar_incremental(libro))
+        self.assertEqual(set(CantidadActivo.objects.values_list('fecha', flat=True)), {v0})
+        self.assertEqual(CantidadActivo.objects.count(), 2 * 3)
+        for valor in ValorPortafolio.objects.filter(fecha=v0).values_list('valor_total', flat=True):
+            self.assertAlmostEqual(float(valor), 1e9, delta=1e4)  # pesos redondeados a 6 decimales
+
+        # Cambian los precios de v0: se recalculan las cantidades iniciales en esa fecha
+        df_w, df_p = leer_libro(libro)
+        df_p.iloc[0, 1:] = df_p.iloc[0, 1:] * 2
+        with pd.ExcelWriter(libro) as escritor:
+            df_w.to_excel(escritor, sheet_name='weights', index=False)
+            df_p.to_excel(escritor, sheet_name='Precios', index=False)
+        with mock.patch.object(etl, 'calcular_cantidades_iniciales',
+                               wraps=etl.calcular_cantidades_iniciales) as cantidades:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertTrue(recargar_incremental(libro))
+        cantidades.assert_called_once_with(v0)
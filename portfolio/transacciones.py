@@ -0,0 +1,103 @@
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+
+from .cantidades import indice_cantidades, registrar_cambios_cantidad
+from .models import Activo, Precio, Transaccion
+from .valuacion import revalorizar_incremental
+
+TIPOS = ('COMPRA', 'VENTA')
+
+
+class ErrorLote(Exception):
+    def __init__(self, errores):
+        super().__init__(f"{len(errores)} transacciones inválidas")
+        self.errores = errores
+
+
+# Valida el lote completo con dos consultas (activos y precios del día) y
+# devuelve las órdenes normalizadas; cualquier error invalida todo el lote.
+def preparar_lote(fecha, transacciones):
+    codigos = {t.get('activo_codigo') for t in transacciones}
+    activos = dict(Activo.objects.filter(codigo__in=codigos).values_list('codigo', 'id'))
+    precios = dict(Precio.objects.filter(
+        activo_id__in=list(activos.values()), fecha=fecha
+    ).values_list('activo_id', 'precio'))
+
+    ordenes, errores = [], []
+    for i, t in enumerate(transacciones):
+        codigo = t.get('activo_codigo')
+        tipo = str(t.get('tipo', '')).upper()
+        try:
+            monto = Decimal(str(t.get('monto', '0')))
+        except InvalidOperation:
+            errores.append({'indice': i, 'activo': codigo, 'error': 'Monto inválido'})
+            continue
+        if codigo not in activos:
+            errores.append({'indice': i, 'activo': codigo, 'error': 'Activo no encontrado'})
+            continue
+        if tipo not in TIPOS:
+            errores.append({'indice': i, 'activo': codigo, 'error': f'Tipo inválido: {tipo}'})
+            continue
+        precio = precios.get(activos[codigo])
+        if not precio:
+            errores.append({'indice': i, 'activo': codigo, 'error': f'No hay precio para {fecha}'})
+            continue
+
+        delta = monto / precio
+        if tipo == 'VENTA':
+            delta = -delta
+        ordenes.append({
+            'activo_codigo': codigo, 'activo_id': activos[codigo], 'tipo': tipo,
+            'monto': monto, 'precio': precio, 'delta': delta,
+        })
+
+    if errores:
+        raise ErrorLote(errores)
+    return ordenes
+
+
+# {activo_id: delta} con las órdenes del mismo activo acumuladas
+def deltas_por_activo(ordenes):
+    deltas = {}
+    for o in ordenes:
+        deltas[o['activo_id']] = deltas.get(o['activo_id'], Decimal('0')) + o['delta']
+    return deltas
+
+
+# Aplica el lote de forma atómica: transacciones y cantidades con escrituras
+# masivas y una única revalorización incremental para todos los activos.
+def aplicar_lote(portafolio, fecha, ordenes):
+    deltas = deltas_por_activo(ordenes)
+
+    with transaction.atomic():
+        cantidades_antes = indice_cantidades(portafolio)
+        cantidades = cantidades_antes.copia()
+        Transaccion.objects.bulk_create([
+            Transaccion(
+                portafolio=portafolio,
+                activo_id=o['activo_id'],
+                fecha=fecha,
+                tipo=o['tipo'],
+                monto=o['monto'],
+                precio_unitario=o['precio'],
+                cantidad=abs(o['delta']),
+            )
+            for o in ordenes
+        ])
+        cambios = registrar_cambios_cantidad(portafolio.id, fecha, deltas, cantidades)
+        revalorizar_incremental(portafolio.id, fecha, cantidades_antes, list(deltas), cantidades)
+    return cambios
+
+
+def procesar_lote(portafolio, fecha, transacciones):
+    ordenes = preparar_lote(fecha, transacciones)
+    cambios = aplicar_lote(portafolio, fecha, ordenes)
+    codigos = {o['activo_id']: o['activo_codigo'] for o in ordenes}
+    return [
+        {
+            "activo": codigos[activo_id],
+            "cantidad_anterior": str(anterior),
+            "nueva_cantidad": str(nueva),
+        }
+        for activo_id, (anterior, nueva) in cambios.items()
+    ]
@@ -1,14 +1,27 @@
 from django.urls import path
-from . import views
+from . import views, vistas_async
 
 urlpatterns = [
     # API endpoints
     path('api/portafolios/', views.PortafolioListView.as_view(), name='portafolio-list'),
     path('api/datos-portafolio/', views.obtener_datos_portafolio, name='datos-portafolio'),
+    path('api/datos-portafolio/exportar/', views.exportar_datos_portafolio, name='exportar-datos-portafolio'),
     path('api/transaccion/', views.TransaccionApi.as_view(), name='transaccion-api'),
+    path('api/transaccion/lote/', views.TransaccionLoteApi.as_view(), name='transaccion-lote-api'),
+    path('api/transaccion/simular/', views.TransaccionSimulacionApi.as_view(), name='transaccion-simular-api'),
+    path('api/rebalanceo/', views.RebalanceoApi.as_view(), name='rebalanceo-api'),
+    path('api/rebalanceo/backtest/', views.backtest_rebalanceo, name='backtest-rebalanceo'),
     path('api/transaccion-legacy/', views.procesar_transaccion_legacy, name='procesar-transaccion'),
     path('api/datos-graficos/', views.datos_graficos, name='datos-graficos'),
+    path('api/comparar-portafolios/', views.comparar_portafolios, name='comparar-portafolios'),
+    path('api/analitica/', views.analitica_portafolio, name='analitica'),
+    
+    # Variantes async de las lecturas (servir con ASGI)
+    path('api/async/portafolios/', vistas_async.portafolios, name='portafolio-list-async'),
+    path('api/async/datos-portafolio/', vistas_async.datos_portafolio, name='datos-portafolio-async'),
+    path('api/async/datos-graficos/', vistas_async.datos_graficos, name='datos-graficos-async'),
     
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('test-api/', views.test_api_view, name='test-api'),
+    path('metrics', views.metricas_view, name='metrics'),
 ]
\ No newline at end of file
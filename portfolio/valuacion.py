@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+
+from .almacen import matriz_precios
+from .cantidades import IndiceCantidades
+from .models import PesoActivo, ValorPortafolio
+from .series import marcar_cambio
+
+TAMANO_LOTE = 2000
+
+
+# x_i,t = c_i,t * p_i,t ; V_t = sum_i x_i,t ; w_i,t = x_i,t / V_t
+# Las celdas sin precio o sin cantidad quedan en NaN y no suman.
+def calcular_series(precios, cantidades):
+    valores = cantidades * precios
+    validos = ~np.isnan(valores)
+    totales = np.where(validos, valores, 0.0).sum(axis=1)
+    pesos = np.zeros_like(valores)
+    # El peso se calcula sobre x_i,t ya redondeado a centavos, igual que al leerlo de la BD
+    np.divide(np.round(valores, 2), totales[:, None], out=pesos,
+              where=validos & (totales[:, None] > 0))
+    return valores, totales, pesos
+
+
+# Filas listas para escribir, con fechas y decimales ya formateados:
+# (portafolio_id, activo_id, fecha, peso, valor_activo) y (portafolio_id, fecha, valor_total).
+# Es la parte cara en Python; la valorización paralela la ejecuta en los trabajadores.
+def filas_series(portafolio_id, fechas, activo_ids, valores, totales, pesos):
+    fechas = [str(f) for f in fechas]
+    filas_i, cols_j = np.nonzero(~np.isnan(valores))
+    filas_pesos = [
+        (portafolio_id, activo_ids[j], fechas[i], f"{pesos[i, j]:.6f}", f"{valores[i, j]:.2f}")
+        for i, j in zip(filas_i.tolist(), cols_j.tolist())
+    ]
+    filas_valores = [
+        (portafolio_id, fechas[i], f"{totales[i]:.2f}")
+        for i in np.nonzero(totales > 0)[0].tolist()
+    ]
+    return filas_pesos, filas_valores
+
+
+# INSERT ... ON CONFLICT DO UPDATE con executemany: equivale a bulk_create con
+# update_conflicts pero sin construir instancias del modelo por fila.
+def _upsert(modelo, campos, unicos, filas):
+    if not filas:
+        return
+    q = connection.ops.quote_name
+    columnas = {c: modelo._meta.get_field(c).column for c in campos}
+    sql = (
+        f"INSERT INTO {q(modelo._meta.db_table)} ({', '.join(q(columnas[c]) for c in campos)}) "
+        f"VALUES ({', '.join(['%s'] * len(campos))}) "
+        f"ON CONFLICT ({', '.join(q(columnas[c]) for c in unicos)}) DO UPDATE SET "
+        + ', '.join(f"{q(columnas[c])} = EXCLUDED.{q(columnas[c])}" for c in campos if c not in unicos)
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, filas)
+
+
+def escribir_filas(portafolio_id, filas_pesos, filas_valores):
+    with transaction.atomic():
+        _upsert(PesoActivo, ['portafolio', 'activo', 'fecha', 'peso', 'valor_activo'],
+                ['portafolio', 'activo', 'fecha'], filas_pesos)
+        _upsert(ValorPortafolio, ['portafolio', 'fecha', 'valor_total'], ['portafolio', 'fecha'], filas_valores)
+        marcar_cambio([portafolio_id])
+    return len(filas_valores), len(filas_pesos)
+
+
+def persistir_series(portafolio_id, fechas, activo_ids, valores, totales, pesos):
+    return escribir_filas(portafolio_id, *filas_series(portafolio_id, fechas, activo_ids, valores, totales, pesos))
+
+
+def seleccionar_columnas(matriz, activo_ids_matriz, activo_ids):
+    posicion = {a: j for j, a in enumerate(activo_ids_matriz)}
+    salida = np.full((matriz.shape[0], len(activo_ids)), np.nan)
+    for k, a in enumerate(activo_ids):
+        j = posicion.get(a)
+        if j is not None:
+            salida[:, k] = matriz[:, j]
+    return salida
+
+
+# Recalcula ValorPortafolio/PesoActivo desde `fecha_desde` (o toda la historia).
+# `precios` permite compartir entre portafolios una matriz ya cargada.
+def valorizar_portafolio(portafolio_id, fecha_desde=None, precios=None):
+    if precios is None:
+        precios = matriz_precios(fecha_desde=fecha_desde)
+    fechas, activo_ids_matriz, matriz = precios
+    if fecha_desde is not None and fechas:
+        inicio = int(np.searchsorted(np.array(fechas, dtype='datetime64[D]'),
+                                     np.datetime64(fecha_desde, 'D')))
+        fechas, matriz = fechas[inicio:], matriz[inicio:]
+    if not fechas:
+        return 0, 0
+
+    indice = IndiceCantidades.cargar(portafolio_id, fecha_hasta=fechas[-1])
+    series = calcular_portafolio(indice, (fechas, activo_ids_matriz, matriz))
+    if series is None:
+        return 0, 0
+    return persistir_series(portafolio_id, fechas, *series)
+
+
+# Parte sin BD de la valorización: (activo_ids, valores, totales, pesos) sobre
+# la matriz de precios, o None si el portafolio no tiene activos.
+def calcular_portafolio(indice, precios):
+    fechas, activo_ids_matriz, matriz = precios
+    activo_ids = indice.activos()
+    if not fechas or not activo_ids:
+        return None
+    p = seleccionar_columnas(matriz, activo_ids_matriz, activo_ids)
+    c = indice.matriz(fechas, activo_ids)
+    return (activo_ids, *calcular_series(p, c))
+
+
+# Tras una transacción solo cambian las fechas desde `fecha_desde` en las que
+# cambia la cantidad de algún activo operado. Esas filas se recalculan completas
+# (x_j,t = c_j,t * p_j,t de todos los activos y V_t = Σ x_j,t) con las mismas
+# operaciones que calcular_portafolio, así que el resultado es idéntico a una
+# valorización completa y no arrastra redondeos de lo guardado; solo se
+# reescriben las celdas cuyo valor guardado cambia.
+# `indice_antes` es el IndiceCantidades leído antes de escribir; `indice_despues`
+# se relee de la BD si no se entrega.
+def revalorizar_incremental(portafolio_id, fecha_desde, indice_antes, activo_ids, indice_despues=None):
+    activo_ids = sorted(set(activo_ids))
+    if not activo_ids:
+        return 0, 0
+    if indice_despues is None:
+        indice_despues = IndiceCantidades.cargar(portafolio_id)
+    todos = indice_despues.activos()
+    fechas, activo_ids_matriz, matriz = matriz_precios(fecha_desde=fecha_desde, activo_ids=todos)
+    if not fechas:
+        return 0, 0
+
+    p = seleccionar_columnas(matriz, activo_ids_matriz, todos)
+    cols = [todos.index(a) for a in activo_ids]
+    c_despues = indice_despues.matriz(fechas, todos)
+    x_antes = indice_antes.matriz(fechas, activo_ids) * p[:, cols]
+    x_despues = c_despues[:, cols] * p[:, cols]
+    cambian = ((np.nan_to_num(x_despues) != np.nan_to_num(x_antes)).any(axis=1)
+               | (np.isnan(x_antes) != np.isnan(x_despues)).any(axis=1))
+    if not cambian.any():
+        return 0, 0
+    idx = np.nonzero(cambian)[0]
+    fechas = [fechas[i] for i in idx.tolist()]
+    x, totales, pesos = calcular_series(p[idx], c_despues[idx])
+
+    # Estado guardado de esas fechas, para no reescribir celdas iguales
+    filas_x = list(PesoActivo.objects.filter(
+        portafolio_id=portafolio_id, fecha__gte=fechas[0], fecha__lte=fechas[-1]
+    ).values_list('fecha', 'activo_id', 'valor_activo', 'peso'))
+    x_guardado = np.full(x.shape, np.nan)
+    w_guardado = np.full(x.shape, np.nan)
+    if filas_x:
+        df = pd.DataFrame(filas_x, columns=['fecha', 'activo_id', 'valor_activo', 'peso'])
+        tabla = df.astype({'valor_activo': float, 'peso': float}) \
+                  .pivot(index='fecha', columns='activo_id').reindex(index=fechas)
+        x_guardado = tabla['valor_activo'].reindex(columns=todos).to_numpy(dtype=float, copy=True)
+        w_guardado = tabla['peso'].reindex(columns=todos).to_numpy(dtype=float, copy=True)
+
+    sin_cambio = (np.round(x, 2) == x_guardado) & (np.round(pesos, 6) == w_guardado)
+    return persistir_series(portafolio_id, fechas, todos, np.where(sin_cambio, np.nan, x), totales, pesos)
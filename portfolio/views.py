@@ -2,235 +2,206 @@ from rest_framework import generics, status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
 from django.db import transaction
 from datetime import datetime
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+import csv
+import json
 from .models import (
     Portafolio, PesoActivo, ValorPortafolio, Activo, 
-    CantidadActivo, Precio, Transaccion
+    Precio, Transaccion
 )
 from .serializers import (
-    PortafolioDetalleSerializer, PesoActivoSerializer, 
-    ValorPortafolioSerializer, PortafolioSerializer
+    PesoActivoSerializer, 
+    ValorPortafolioSerializer, PortafolioSerializer,
+    anotar_pesos, anotar_valores
 )
+from .cantidades import indice_cantidades, registrar_cambio_cantidad
+from .analitica import analitica
+from .comparacion import comparar
+from .condicional import dependencia_pesos_objetivo, dependencia_precios, lectura_condicional
+from .metricas import contar_filas, registro
+from .muestreo import FRECUENCIAS, reducir
+from .rebalanceo import FRECUENCIAS_REBALANCEO, backtest, rebalancear
+from .series import obtener_serie
+from .simulacion import simular
+from .transacciones import TIPOS, ErrorLote, procesar_lote
+from .valuacion import revalorizar_incremental
 
+@method_decorator(lectura_condicional, name='dispatch')
 class PortafolioListView(generics.ListAPIView):
     queryset = Portafolio.objects.all()
     serializer_class = PortafolioSerializer
 
-@api_view(['GET'])
-def obtener_datos_portafolio(request):
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
-    portafolio_id = request.GET.get('portafolio_id')
+# Valida los parámetros de datos-portafolio: ((fecha_inicio, fecha_fin, portafolio_id), None)
+# o (None, mensaje de error)
+def parametros_datos(params):
+    fecha_inicio = params.get('fecha_inicio')
+    fecha_fin = params.get('fecha_fin')
+    portafolio_id = params.get('portafolio_id')
     
     if not fecha_inicio or not fecha_fin:
-        return Response({
-            'error': 'Debe proporcionar fecha_inicio y fecha_fin en formato YYYY-MM-DD'
-        }, status=status.HTTP_400_BAD_REQUEST)
+        return None, 'Debe proporcionar fecha_inicio y fecha_fin en formato YYYY-MM-DD'
     
     try:
         fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
         fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
     except ValueError:
-        return Response({
-            'error': 'Formato de fecha inválido. Use YYYY-MM-DD'
-        }, status=status.HTTP_400_BAD_REQUEST)
+        return None, 'Formato de fecha inválido. Use YYYY-MM-DD'
     
-    portafolios_query = Portafolio.objects.all()
     if portafolio_id:
         try:
-            portafolios_query = portafolios_query.filter(id=int(portafolio_id))
+            portafolio_id = int(portafolio_id)
         except ValueError:
-            return Response({
-                'error': 'portafolio_id debe ser un número entero'
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return None, 'portafolio_id debe ser un número entero'
+    return (fecha_inicio, fecha_fin, portafolio_id or None), None
+
+# Las tres consultas de datos-portafolio (portafolios, valores y pesos),
+# compartidas por la vista síncrona y la async
+def consultas_datos(fecha_inicio, fecha_fin, portafolio_id=None):
+    portafolios = Portafolio.objects.order_by('id')
+    valores = ValorPortafolio.objects.filter(fecha__gte=fecha_inicio, fecha__lte=fecha_fin)
+    pesos = PesoActivo.objects.filter(fecha__gte=fecha_inicio, fecha__lte=fecha_fin)
+    if portafolio_id is not None:
+        portafolios = portafolios.filter(id=portafolio_id)
+        valores = valores.filter(portafolio_id=portafolio_id)
+        pesos = pesos.filter(portafolio_id=portafolio_id)
+    
+    valores = anotar_valores(valores).order_by('portafolio_id', 'fecha').values(
+        'id', 'portafolio_id', 'portafolio_nombre', 'fecha', 'valor_total'
+    )
+    pesos = anotar_pesos(pesos).order_by('portafolio_id', 'fecha', 'activo__codigo').values(
+        'id', 'portafolio_id', 'portafolio_nombre', 'activo_codigo', 'activo_nombre',
+        'fecha', 'peso', 'valor_activo'
+    )
+    return portafolios, valores, pesos
+
+def armar_datos(portafolios, valores, pesos, fecha_inicio, fecha_fin):
+    valores_por_portafolio = {p.id: [] for p in portafolios}
+    for v in valores:
+        valores_por_portafolio.setdefault(v['portafolio_id'], []).append(v)
+    
+    pesos_por_portafolio = {p.id: [] for p in portafolios}
+    for p in pesos:
+        pesos_por_portafolio.setdefault(p['portafolio_id'], []).append(p)
+    contar_filas(len(valores) + len(pesos))
     
     resultado = []
     
-    for portafolio in portafolios_query:
-        valores_portafolio = ValorPortafolio.objects.filter(
-            portafolio=portafolio,
-            fecha__gte=fecha_inicio,
-            fecha__lte=fecha_fin
-        ).order_by('fecha')
-        
-        pesos_activos = PesoActivo.objects.filter(
-            portafolio=portafolio,
-            fecha__gte=fecha_inicio,
-            fecha__lte=fecha_fin
-        ).order_by('fecha', 'activo__codigo')
-        
+    for portafolio in portafolios:
         resultado.append({
             'portafolio': PortafolioSerializer(portafolio).data,
-            'valores_portafolio': ValorPortafolioSerializer(valores_portafolio, many=True).data,
-            'pesos_activos': PesoActivoSerializer(pesos_activos, many=True).data,
+            'valores_portafolio': ValorPortafolioSerializer(valores_por_portafolio[portafolio.id], many=True).data,
+            'pesos_activos': PesoActivoSerializer(pesos_por_portafolio[portafolio.id], many=True).data,
             'fecha_inicio': fecha_inicio,
             'fecha_fin': fecha_fin
         })
     
-    return Response({
+    return {
         'datos': resultado,
         'fecha_inicio': fecha_inicio,
         'fecha_fin': fecha_fin,
         'total_portafolios': len(resultado)
-    })
+    }
 
-@api_view(['POST'])
-def procesar_transaccion(request):
-    portafolio_id = request.data.get('portafolio_id')
-    fecha_str = request.data.get('fecha')
-    transacciones_data = request.data.get('transacciones', [])
+@lectura_condicional
+@api_view(['GET'])
+def obtener_datos_portafolio(request):
+    parametros, error = parametros_datos(request.GET)
+    if error:
+        return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
     
-    if not all([portafolio_id, fecha_str, transacciones_data]):
-        return Response({
-            'error': 'Debe proporcionar portafolio_id, fecha y transacciones'
+    # Una consulta por tipo de serie para todos los portafolios
+    portafolios, valores, pesos = (list(qs) for qs in consultas_datos(*parametros))
+    return Response(armar_datos(portafolios, valores, pesos, *parametros[:2]))
+
+class _Eco:
+    def write(self, valor):
+        return valor
+
+COLUMNAS_EXPORTACION = [
+    'tipo', 'portafolio_id', 'portafolio', 'fecha', 'activo_codigo',
+    'peso', 'valor_activo', 'valor_total'
+]
+
+def _filas_exportacion(portafolios, fecha_inicio, fecha_fin, chunk_size=2000):
+    nombres = dict(portafolios.values_list('id', 'nombre'))
+    ids = sorted(nombres)
+    valores = ValorPortafolio.objects.filter(
+        portafolio_id__in=ids, fecha__gte=fecha_inicio, fecha__lte=fecha_fin
+    ).order_by('portafolio_id', 'fecha').values_list('portafolio_id', 'fecha', 'valor_total')
+    for pid, fecha, valor_total in valores.iterator(chunk_size=chunk_size):
+        contar_filas(1)
+        yield {
+            'tipo': 'valor', 'portafolio_id': pid, 'portafolio': nombres[pid],
+            'fecha': str(fecha), 'valor_total': str(valor_total),
+        }
+    pesos = PesoActivo.objects.filter(
+        portafolio_id__in=ids, fecha__gte=fecha_inicio, fecha__lte=fecha_fin
+    ).order_by('portafolio_id', 'fecha', 'activo__codigo').values_list(
+        'portafolio_id', 'fecha', 'activo__codigo', 'peso', 'valor_activo'
+    )
+    for pid, fecha, codigo, peso, valor_activo in pesos.iterator(chunk_size=chunk_size):
+        contar_filas(1)
+        yield {
+            'tipo': 'peso', 'portafolio_id': pid, 'portafolio': nombres[pid],
+            'fecha': str(fecha), 'activo_codigo': codigo,
+            'peso': str(peso), 'valor_activo': str(valor_activo),
+        }
+
+def _lineas_csv(filas):
+    writer = csv.DictWriter(_Eco(), fieldnames=COLUMNAS_EXPORTACION)
+    yield writer.writeheader()
+    for fila in filas:
+        yield writer.writerow(fila)
+
+def exportar_datos_portafolio(request):
+    fecha_inicio = request.GET.get('fecha_inicio')
+    fecha_fin = request.GET.get('fecha_fin')
+    portafolio_id = request.GET.get('portafolio_id')
+    formato = request.GET.get('formato', 'ndjson')
+    
+    if not fecha_inicio or not fecha_fin:
+        return JsonResponse({
+            'error': 'Debe proporcionar fecha_inicio y fecha_fin en formato YYYY-MM-DD'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if formato not in ('ndjson', 'csv'):
+        return JsonResponse({
+            'error': 'formato debe ser ndjson o csv'
         }, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-        portafolio = Portafolio.objects.get(id=portafolio_id)
-    except (ValueError, Portafolio.DoesNotExist):
-        return Response({
-            'error': 'Fecha inválida o portafolio no encontrado'
+        fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
+        fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({
+            'error': 'Formato de fecha inválido. Use YYYY-MM-DD'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    try:
-        with transaction.atomic():
-            transacciones_creadas = []
-            
-            for trans_data in transacciones_data:
-                activo_codigo = trans_data.get('activo_codigo')
-                tipo = trans_data.get('tipo')
-                monto = Decimal(str(trans_data.get('monto', 0)))
-                
-                try:
-                    activo = Activo.objects.get(codigo=activo_codigo)
-                    precio = Precio.objects.get(activo=activo, fecha=fecha).precio
-                    
-                    if tipo == 'COMPRA':
-                        cantidad = monto / precio
-                    else:
-                        cantidad = -(monto / precio)
-                    
-                    transaccion = Transaccion.objects.create(
-                        portafolio=portafolio,
-                        activo=activo,
-                        fecha=fecha,
-                        tipo=tipo,
-                        monto=monto,
-                        precio_unitario=precio,
-                        cantidad=abs(cantidad)
-                    )
-                    transacciones_creadas.append(transaccion)
-                    
-                    actualizar_cantidades_post_transaccion(
-                        portafolio, activo, fecha, cantidad
-                    )
-                    
-                except Activo.DoesNotExist:
-                    return Response({
-                        'error': f'Activo {activo_codigo} no encontrado'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                except Precio.DoesNotExist:
-                    return Response({
-                        'error': f'Precio para {activo_codigo} en {fecha} no encontrado'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-            
-            recalcular_valores_historicos_desde_fecha(portafolio, fecha)
-            
-            return Response({
-                'message': 'Transacciones procesadas exitosamente',
-                'transacciones_procesadas': len(transacciones_creadas)
-            })
-            
-    except Exception as e:
-        return Response({
-            'error': f'Error procesando transacciones: {str(e)}'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-def actualizar_cantidades_post_transaccion(portafolio, activo, fecha_transaccion, cambio_cantidad):
-    cantidad_anterior = CantidadActivo.objects.filter(
-        portafolio=portafolio,
-        activo=activo,
-        fecha__lt=fecha_transaccion
-    ).order_by('-fecha').first()
+    portafolios_query = Portafolio.objects.all()
+    if portafolio_id:
+        try:
+            portafolios_query = portafolios_query.filter(id=int(portafolio_id))
+        except ValueError:
+            return JsonResponse({
+                'error': 'portafolio_id debe ser un número entero'
+            }, status=status.HTTP_400_BAD_REQUEST)
     
-    if cantidad_anterior:
-        nueva_cantidad = cantidad_anterior.cantidad + cambio_cantidad
+    filas = _filas_exportacion(portafolios_query, fecha_inicio, fecha_fin)
+    if formato == 'csv':
+        respuesta = StreamingHttpResponse(_lineas_csv(filas), content_type='text/csv; charset=utf-8')
     else:
-        nueva_cantidad = cambio_cantidad
-    
-    CantidadActivo.objects.update_or_create(
-        portafolio=portafolio,
-        activo=activo,
-        fecha=fecha_transaccion,
-        defaults={'cantidad': nueva_cantidad}
-    )
-    
-    fechas_posteriores = Precio.objects.filter(
-        activo=activo,
-        fecha__gt=fecha_transaccion
-    ).values_list('fecha', flat=True)
-    
-    for fecha in fechas_posteriores:
-        CantidadActivo.objects.update_or_create(
-            portafolio=portafolio,
-            activo=activo,
-            fecha=fecha,
-            defaults={'cantidad': nueva_cantidad}
+        respuesta = StreamingHttpResponse(
+            (json.dumps(fila, ensure_ascii=False) + '\n' for fila in filas),
+            content_type='application/x-ndjson; charset=utf-8'
         )
-
-def recalcular_valores_historicos_desde_fecha(portafolio, fecha_inicio):
-    fechas = Precio.objects.filter(
-        fecha__gte=fecha_inicio
-    ).values_list('fecha', flat=True).distinct().order_by('fecha')
-    
-    for fecha in fechas:
-        valor_total_portafolio = Decimal('0')
-        
-        for peso_portafolio in portafolio.pesos.all():
-            activo = peso_portafolio.activo
-            
-            try:
-                precio = Precio.objects.get(activo=activo, fecha=fecha).precio
-                cantidad_obj = CantidadActivo.objects.filter(
-                    portafolio=portafolio,
-                    activo=activo,
-                    fecha__lte=fecha
-                ).order_by('-fecha').first()
-                
-                if cantidad_obj:
-                    valor_activo = cantidad_obj.cantidad * precio
-                    valor_total_portafolio += valor_activo
-                    
-                    PesoActivo.objects.update_or_create(
-                        portafolio=portafolio,
-                        activo=activo,
-                        fecha=fecha,
-                        defaults={
-                            'peso': Decimal('0'),  # Se actualizará después
-                            'valor_activo': valor_activo
-                        }
-                    )
-                    
-            except Precio.DoesNotExist:
-                continue
-        
-        if valor_total_portafolio > 0:
-            ValorPortafolio.objects.update_or_create(
-                portafolio=portafolio,
-                fecha=fecha,
-                defaults={'valor_total': valor_total_portafolio}
-            )
-            
-            for peso_activo in PesoActivo.objects.filter(
-                portafolio=portafolio, fecha=fecha
-            ):
-                peso = peso_activo.valor_activo / valor_total_portafolio
-                peso_activo.peso = peso
-                peso_activo.save()
+    respuesta['Content-Disposition'] = (
+        f'attachment; filename="portafolios_{fecha_inicio}_{fecha_fin}.{formato}"'
+    )
+    return respuesta
 
 def dashboard_view(request):
     portafolios = Portafolio.objects.all()
@@ -240,72 +211,137 @@ def dashboard_view(request):
         'activos': activos
     })
 
-@api_view(['GET'])
-def datos_graficos(request):
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
-    portafolio_id = request.GET.get('portafolio_id')
+# Valida los parámetros de datos-graficos: (parametros, None) o (None, mensaje)
+def parametros_graficos(params):
+    fecha_inicio = params.get('fecha_inicio')
+    fecha_fin = params.get('fecha_fin')
+    portafolio_id = params.get('portafolio_id')
+    # Opcionales: freq (D, W, M) toma el último día de cada período y max_points
+    # reduce la línea con LTTB y los pesos a fin de tramo
+    freq = params.get('freq', 'D').upper()
+    max_points = params.get('max_points')
     
     if not all([fecha_inicio, fecha_fin, portafolio_id]):
-        return Response({
-            'error': 'Debe proporcionar fecha_inicio, fecha_fin y portafolio_id'
-        }, status=status.HTTP_400_BAD_REQUEST)
+        return None, 'Debe proporcionar fecha_inicio, fecha_fin y portafolio_id'
     
     try:
-        fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-        fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-        portafolio = Portafolio.objects.get(id=portafolio_id)
-    except (ValueError, Portafolio.DoesNotExist):
-        return Response({
-            'error': 'Parámetros inválidos'
-        }, status=status.HTTP_400_BAD_REQUEST)
-    
-    valores = ValorPortafolio.objects.filter(
-        portafolio=portafolio,
-        fecha__gte=fecha_inicio,
-        fecha__lte=fecha_fin
-    ).order_by('fecha')
+        parametros = {
+            'fecha_inicio': datetime.strptime(fecha_inicio, '%Y-%m-%d').date(),
+            'fecha_fin': datetime.strptime(fecha_fin, '%Y-%m-%d').date(),
+            'portafolio_id': int(portafolio_id),
+            'freq': freq,
+            'max_points': None if max_points is None else int(max_points),
+        }
+        if freq not in FRECUENCIAS:
+            raise ValueError(freq)
+        if parametros['max_points'] is not None and parametros['max_points'] < 3:
+            raise ValueError(max_points)
+    except ValueError:
+        return None, 'Parámetros inválidos'
+    return parametros, None
+
+def armar_graficos(portafolio, serie, fecha_inicio, fecha_fin, freq='D', max_points=None, **_):
+    fechas_linea, valores = serie.linea(fecha_inicio, fecha_fin)
+    fechas_pesos, activos, pesos = serie.pesos_rango(fecha_inicio, fecha_fin)
+    if freq != 'D' or max_points is not None:
+        idx_linea, idx_pesos = reducir(fechas_linea, valores, fechas_pesos, freq, max_points)
+        fechas_linea, valores = fechas_linea[idx_linea], valores[idx_linea]
+        fechas_pesos, pesos = fechas_pesos[idx_pesos], pesos[idx_pesos]
     
     datos_linea = [
-        {'fecha': str(v.fecha), 'valor': float(v.valor_total)}
-        for v in valores
+        {'fecha': str(f), 'valor': v}
+        for f, v in zip(fechas_linea.tolist(), valores.tolist())
     ]
     
-    pesos = PesoActivo.objects.filter(
-        portafolio=portafolio,
-        fecha__gte=fecha_inicio,
-        fecha__lte=fecha_fin
-    ).order_by('fecha', 'activo__codigo')
-    
-    fechas_set = set()
-    activos_data = {}
-    
-    for peso in pesos:
-        fecha_str = str(peso.fecha)
-        activo_codigo = peso.activo.codigo
-        
-        fechas_set.add(fecha_str)
-        
-        if activo_codigo not in activos_data:
-            activos_data[activo_codigo] = {}
-        
-        activos_data[activo_codigo][fecha_str] = float(peso.peso)
-    
-    fechas_ordenadas = sorted(list(fechas_set))
-    
     datos_stacked = []
-    for fecha in fechas_ordenadas:
-        punto = {'fecha': fecha}
-        for activo_codigo, data in activos_data.items():
-            punto[activo_codigo] = data.get(fecha, 0)
+    for f, fila in zip(fechas_pesos.tolist(), pesos.tolist()):
+        punto = {'fecha': str(f)}
+        punto.update(zip(activos, fila))
         datos_stacked.append(punto)
+    contar_filas(len(datos_linea) + len(datos_stacked))
     
-    return Response({
+    return {
         'datos_linea': datos_linea,
         'datos_stacked': datos_stacked,
-        'activos': list(activos_data.keys()),
+        'activos': activos,
         'portafolio': portafolio.nombre
-    })
+    }
+
+@lectura_condicional
+@api_view(['GET'])
+def datos_graficos(request):
+    parametros, error = parametros_graficos(request.GET)
+    if error:
+        return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        portafolio = Portafolio.objects.get(id=parametros['portafolio_id'])
+    except Portafolio.DoesNotExist:
+        return Response({
+            'error': 'Parámetros inválidos'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(armar_graficos(portafolio, obtener_serie(portafolio), **parametros))
+
+# Varios portafolios en una llamada: portafolio_ids=1,2,3 y el rango de fechas
+# (freq y max_points opcionales como en datos-graficos)
+@lectura_condicional
+@api_view(['GET'])
+def comparar_portafolios(request):
+    try:
+        portafolio_ids = list(dict.fromkeys(int(i) for i in request.GET.get('portafolio_ids', '').split(',')))
+    except ValueError:
+        return Response({
+            'error': 'Debe proporcionar portafolio_ids como enteros separados por coma'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    # Mismas validaciones de fechas, freq y max_points que datos-graficos
+    parametros, error = parametros_graficos(dict(request.GET.items(), portafolio_id=portafolio_ids[0]))
+    if error:
+        return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        datos = comparar(
+            portafolio_ids, parametros['fecha_inicio'], parametros['fecha_fin'],
+            parametros['freq'], parametros['max_points'],
+        )
+    except Portafolio.DoesNotExist as e:
+        return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+    contar_filas(len(datos['fechas']) * len(portafolio_ids))
+    return Response(datos)
+
+# Riesgo y rendimiento de un portafolio en el rango (mismos parámetros que
+# datos-graficos; freq y max_points no se usan). Las contribuciones leen Precio,
+# que no sube version_datos: su firma va en el ETag.
+@lectura_condicional(depende=(dependencia_precios,))
+@api_view(['GET'])
+def analitica_portafolio(request):
+    parametros, error = parametros_graficos(request.GET)
+    # Opcionales: ventana (retornos por Sharpe móvil), tasa_libre anual y
+    # referencia_id (portafolio contra el que se calcula la beta)
+    try:
+        ventana = int(request.GET.get('ventana', 63))
+        tasa_libre = float(request.GET.get('tasa_libre', 0))
+        referencia_id = request.GET.get('referencia_id')
+        referencia_id = None if referencia_id is None else int(referencia_id)
+        if ventana < 2:
+            raise ValueError(ventana)
+    except ValueError:
+        error = error or 'Parámetros inválidos'
+    if error:
+        return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        portafolio = Portafolio.objects.get(id=parametros['portafolio_id'])
+        referencia = None if referencia_id is None else Portafolio.objects.get(id=referencia_id)
+    except Portafolio.DoesNotExist:
+        return Response({'error': 'Portafolio no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    
+    datos = analitica(
+        portafolio, parametros['fecha_inicio'], parametros['fecha_fin'],
+        ventana, tasa_libre, referencia,
+    )
+    contar_filas(len(datos['fechas']))
+    return Response(datos)
 
 @api_view(['POST'])
 def procesar_transaccion_legacy(request):
@@ -314,6 +350,12 @@ def procesar_transaccion_legacy(request):
 def test_api_view(request):
     return render(request, 'portfolio/test_api.html')
 
+def metricas_view(request):
+    # Solo para scraping local
+    if request.META.get('REMOTE_ADDR') not in ('127.0.0.1', '::1'):
+        return HttpResponseForbidden('Solo disponible desde localhost')
+    return HttpResponse(registro.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 class TransaccionApi(APIView):
     def post(self, request):
         try:
@@ -328,59 +370,182 @@ class TransaccionApi(APIView):
         except Portafolio.DoesNotExist:
             return Response({"detail": f"No existe portafolio id={portafolio_id}"}, status=404)
 
+        # Tipo y monto se validan antes de escribir; activos o precios que faltan
+        # se informan por transacción y el resto se aplica
+        errores = []
+        for i, t in enumerate(transacciones):
+            tipo = str(t.get("tipo") or "").upper()
+            if tipo not in TIPOS:
+                errores.append({"indice": i, "activo": t.get("activo_codigo"), "error": f"Tipo inválido: {t.get('tipo')}"})
+            try:
+                Decimal(str(t.get("monto", "0")))
+            except InvalidOperation:
+                errores.append({"indice": i, "activo": t.get("activo_codigo"), "error": "Monto inválido"})
+        if errores:
+            return Response({"detail": "Transacciones inválidas.", "errores": errores}, status=400)
+
         resultados = []
-        for t in transacciones:
-            codigo = t.get("activo_codigo")
-            tipo = t.get("tipo")
-            monto = Decimal(str(t.get("monto", "0")))
+        # Como aplicar_lote: las cantidades, las transacciones y la revalorización
+        # se confirman juntas o no se confirma nada
+        with transaction.atomic():
+            cantidades_antes = indice_cantidades(pf)
+            cantidades = cantidades_antes.copia()
+            activos_operados = []
+            for t in transacciones:
+                codigo = t.get("activo_codigo")
+                tipo = str(t["tipo"]).upper()
+                monto = Decimal(str(t.get("monto", "0")))
 
-            try:
-                activo = Activo.objects.get(codigo=codigo)
-            except Activo.DoesNotExist:
-                resultados.append({"activo": codigo, "error": "Activo no encontrado"})
-                continue
+                try:
+                    activo = Activo.objects.get(codigo=codigo)
+                except Activo.DoesNotExist:
+                    resultados.append({"activo": codigo, "error": "Activo no encontrado"})
+                    continue
 
-            try:
-                precio = Precio.objects.get(activo=activo, fecha=fecha).precio
-            except Precio.DoesNotExist:
-                resultados.append({"activo": codigo, "error": f"No hay precio para {fecha}"})
-                continue
-
-            c_prev = CantidadActivo.objects.filter(
-                portafolio=pf, activo=activo, fecha__lte=fecha
-            ).order_by("-fecha").first()
-            cantidad_actual = c_prev.cantidad if c_prev else Decimal("0")
-
-            delta = monto / precio if precio != 0 else Decimal("0")
-            if tipo.upper() == "VENTA":
-                delta = -delta
-
-            nueva_cantidad = cantidad_actual + delta
-
-            CantidadActivo.objects.update_or_create(
-                portafolio=pf,
-                activo=activo,
-                fecha=fecha,
-                defaults={"cantidad": nueva_cantidad},
-            )
-
-            Transaccion.objects.create(
-                portafolio=pf,
-                activo=activo,
-                fecha=fecha,
-                tipo=tipo.upper(),
-                monto=monto,
-                precio_unitario=precio,
-                cantidad=abs(delta)
-            )
-
-            resultados.append({
-                "activo": codigo,
-                "precio": str(precio),
-                "delta_cantidad": str(delta),
-                "nueva_cantidad": str(nueva_cantidad),
-            })
-
-        recalcular_valores_historicos_desde_fecha(pf, fecha)
+                try:
+                    precio = Precio.objects.get(activo=activo, fecha=fecha).precio
+                except Precio.DoesNotExist:
+                    resultados.append({"activo": codigo, "error": f"No hay precio para {fecha}"})
+                    continue
+
+                delta = monto / precio if precio != 0 else Decimal("0")
+                if tipo == "VENTA":
+                    delta = -delta
+
+                _, nueva_cantidad = registrar_cambio_cantidad(pf.id, activo.id, fecha, delta, cantidades)
+
+                Transaccion.objects.create(
+                    portafolio=pf,
+                    activo=activo,
+                    fecha=fecha,
+                    tipo=tipo,
+                    monto=monto,
+                    precio_unitario=precio,
+                    cantidad=abs(delta)
+                )
+
+                activos_operados.append(activo.id)
+                resultados.append({
+                    "activo": codigo,
+                    "precio": str(precio),
+                    "delta_cantidad": str(delta),
+                    "nueva_cantidad": str(nueva_cantidad),
+                })
+
+            revalorizar_incremental(pf.id, fecha, cantidades_antes, activos_operados, cantidades)
 
         return Response({"detail": "Transacciones procesadas", "resultados": resultados}, status=200)
+
+# Mismo payload que TransaccionLoteApi (y fecha_fin opcional); devuelve las
+# cantidades y series proyectadas sin escribir en la BD
+class TransaccionSimulacionApi(APIView):
+    def post(self, request):
+        try:
+            portafolio_id = request.data["portafolio_id"]
+            fecha = datetime.strptime(request.data["fecha"], "%Y-%m-%d").date()
+            transacciones = list(request.data["transacciones"])
+            fecha_fin = request.data.get("fecha_fin")
+            fecha_fin = None if fecha_fin is None else datetime.strptime(fecha_fin, "%Y-%m-%d").date()
+        except Exception:
+            return Response({"detail": "JSON inválido o faltan campos."}, status=400)
+
+        try:
+            pf = Portafolio.objects.get(id=portafolio_id)
+        except Portafolio.DoesNotExist:
+            return Response({"detail": f"No existe portafolio id={portafolio_id}"}, status=404)
+
+        try:
+            datos = simular(pf, fecha, transacciones, fecha_fin)
+        except ErrorLote as e:
+            return Response({"detail": "Lote inválido", "errores": e.errores}, status=400)
+        return Response(datos, status=200)
+
+class TransaccionLoteApi(APIView):
+    def post(self, request):
+        try:
+            portafolio_id = request.data["portafolio_id"]
+            fecha = datetime.strptime(request.data["fecha"], "%Y-%m-%d").date()
+            transacciones = list(request.data["transacciones"])
+        except Exception:
+            return Response({"detail": "JSON inválido o faltan campos."}, status=400)
+
+        try:
+            pf = Portafolio.objects.get(id=portafolio_id)
+        except Portafolio.DoesNotExist:
+            return Response({"detail": f"No existe portafolio id={portafolio_id}"}, status=404)
+
+        try:
+            resultados = procesar_lote(pf, fecha, transacciones)
+        except ErrorLote as e:
+            return Response({"detail": "Lote rechazado; no se aplicó ninguna transacción", "errores": e.errores}, status=400)
+
+        return Response({
+            "detail": "Lote procesado",
+            "transacciones_procesadas": len(transacciones),
+            "resultados": resultados,
+        }, status=200)
+
+# Rebalanceo a pesos objetivo: {"portafolio_id", "fecha", "pesos": {codigo: peso}}
+# (sin pesos se usan los iniciales). Con "simular": true no escribe nada.
+class RebalanceoApi(APIView):
+    def post(self, request):
+        try:
+            portafolio_id = request.data["portafolio_id"]
+            fecha = datetime.strptime(request.data["fecha"], "%Y-%m-%d").date()
+            pesos = request.data.get("pesos")
+            pesos = None if pesos is None else dict(pesos)
+            simulado = bool(request.data.get("simular", False))
+        except Exception:
+            return Response({"detail": "JSON inválido o faltan campos."}, status=400)
+
+        try:
+            pf = Portafolio.objects.get(id=portafolio_id)
+        except Portafolio.DoesNotExist:
+            return Response({"detail": f"No existe portafolio id={portafolio_id}"}, status=404)
+
+        try:
+            ordenes, resultado = rebalancear(pf, fecha, pesos, simulado)
+        except ErrorLote as e:
+            return Response({"detail": "Rebalanceo rechazado; no se aplicó ninguna transacción", "errores": e.errores}, status=400)
+
+        if simulado:
+            return Response({"detail": "Rebalanceo simulado", "transacciones": ordenes, "simulacion": resultado}, status=200)
+        return Response({
+            "detail": "Rebalanceo aplicado",
+            "transacciones": ordenes,
+            "resultados": resultado,
+        }, status=200)
+
+# Backtest de rebalanceo periódico: portafolio_id, freq (M o Q), fechas
+# opcionales y pesos opcionales como pesos=COD1:0.6,COD2:0.4. Se calcula en
+# vivo desde Precio y PesoPortafolio, así que ambos van en el ETag.
+@lectura_condicional(depende=(dependencia_precios, dependencia_pesos_objetivo))
+@api_view(['GET'])
+def backtest_rebalanceo(request):
+    try:
+        pf = Portafolio.objects.get(id=int(request.GET.get('portafolio_id', '')))
+    except ValueError:
+        return Response({'error': 'Debe proporcionar portafolio_id'}, status=status.HTTP_400_BAD_REQUEST)
+    except Portafolio.DoesNotExist:
+        return Response({'error': 'Portafolio no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        freq = request.GET.get('freq', 'M').upper()
+        if freq not in FRECUENCIAS_REBALANCEO:
+            raise ValueError(freq)
+        fechas = [
+            None if request.GET.get(campo) is None else datetime.strptime(request.GET[campo], '%Y-%m-%d').date()
+            for campo in ('fecha_inicio', 'fecha_fin')
+        ]
+        pesos = request.GET.get('pesos')
+        if pesos is not None:
+            pesos = {codigo: float(peso) for codigo, peso in (par.rsplit(':', 1) for par in pesos.split(','))}
+    except ValueError:
+        return Response({'error': 'Parámetros inválidos'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        datos = backtest(pf, freq, pesos, *fechas)
+    except ErrorLote as e:
+        return Response({'error': 'Pesos inválidos', 'errores': e.errores}, status=status.HTTP_400_BAD_REQUEST)
+    contar_filas(len(datos['fechas']))
+    return Response(datos)
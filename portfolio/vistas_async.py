@@ -0,0 +1,56 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.renderers import JSONRenderer
+
+from .condicional import lectura_condicional
+from .models import Portafolio
+from .serializers import PortafolioSerializer
+from .series import obtener_serie
+from .views import armar_datos, armar_graficos, consultas_datos, parametros_datos, parametros_graficos
+
+# Variantes async de las APIs de lectura (mismas respuestas que las de
+# views.py) para servir con ASGI, p. ej. `uvicorn mi_proyecto.asgi:application`.
+# El ORM async de Django corre las consultas de una solicitud una tras otra en
+# un único hilo (sync_to_async); lo que se gana es no bloquear el event loop
+# mientras esperan, no paralelismo entre consultas.
+
+
+def _json(datos, status=200):
+    return HttpResponse(JSONRenderer().render(datos), status=status, content_type='application/json')
+
+
+async def _lista(qs):
+    return [fila async for fila in qs]
+
+
+@lectura_condicional
+@require_GET
+async def portafolios(request):
+    filas = await _lista(Portafolio.objects.order_by('id'))
+    return _json(PortafolioSerializer(filas, many=True).data)
+
+
+@lectura_condicional
+@require_GET
+async def datos_portafolio(request):
+    parametros, error = parametros_datos(request.GET)
+    if error:
+        return _json({'error': error}, status=400)
+    portafolios, valores, pesos = [await _lista(qs) for qs in consultas_datos(*parametros)]
+    return _json(armar_datos(portafolios, valores, pesos, *parametros[:2]))
+
+
+@lectura_condicional
+@require_GET
+async def datos_graficos(request):
+    parametros, error = parametros_graficos(request.GET)
+    if error:
+        return _json({'error': error}, status=400)
+    try:
+        portafolio = await Portafolio.objects.aget(id=parametros['portafolio_id'])
+    except Portafolio.DoesNotExist:
+        return _json({'error': 'Parámetros inválidos'}, status=400)
+    # La serie sale del cache de resultados o de dos consultas síncronas
+    serie = await sync_to_async(obtener_serie)(portafolio)
+    return _json(armar_graficos(portafolio, serie, **parametros))